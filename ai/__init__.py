@@ -1,5 +1,4 @@
-# 初始化文件 
+# 初始化文件
 
-from .agent import MinecraftAgent
-
-# 在这里可以导出其他需要的类和方法 
\ No newline at end of file
+# 保持为空：推理子进程 (spawn) 导入 ai.local_llm 时会先执行本文件，
+# 在这里导入 agent 会把整个智能体及其依赖带进子进程。请使用 from ai.agent import MinecraftAgent
@@ -0,0 +1,267 @@
+import re
+
+# 动作类型 -> 必需参数/可选参数及其取值类型
+# 取值类型: number 数字, string 非空字符串, text 任意字符串, boolean 布尔值,
+#           int 非负整数, posint 正整数, posnum 正数, object JSON对象, 元组 取值只能是其中之一
+ACTION_SCHEMA = {
+    "moveTo": {"required": {"x": "number", "y": "number", "z": "number"}, "optional": {}},
+    "collect": {"required": {"blockType": "string"}, "optional": {"count": "posint", "radius": "posnum"}},
+    "placeBlock": {"required": {"itemName": "string", "x": "number", "y": "number", "z": "number"}, "optional": {}},
+    "dig": {"required": {"x": "number", "y": "number", "z": "number"}, "optional": {}},
+    "attack": {"required": {"target": "string"}, "optional": {}},
+    "jumpAttack": {"required": {"target": "string"}, "optional": {}},
+    "lookAt": {"required": {"x": "number", "y": "number", "z": "number"}, "optional": {}},
+    "equip": {"required": {"itemName": "string"}, "optional": {"destination": "string"}},
+    "unequip": {"required": {}, "optional": {"destination": "string"}},
+    "useHeldItem": {"required": {}, "optional": {}},
+    "craft": {"required": {"itemName": "string"}, "optional": {"count": "posint"}},
+    "chat": {"required": {"message": "text"}, "optional": {}},
+    "setControlState": {"required": {"control": "string", "state": "boolean"}, "optional": {}},
+    "clearControlStates": {"required": {}, "optional": {}},
+    "wait": {"required": {}, "optional": {"ticks": "int"}},
+    "macro": {"required": {"name": "string"}, "optional": {"params": "object"}},
+}
+
+# 所有动作的可选参数 (出现在不支持它的动作上时报错)
+OPTIONAL_PARAMS = {key for spec in ACTION_SCHEMA.values() for key in spec["optional"]}
+
+
+def build_schema(macro_names=None):
+    """按当前宏库生成动作表：宏名只能取已有的宏，宏库为空时去掉 macro 动作"""
+    schema = {action_type: spec for action_type, spec in ACTION_SCHEMA.items() if action_type != "macro"}
+    if macro_names:
+        schema["macro"] = {"required": {"name": tuple(sorted(macro_names))},
+                           "optional": ACTION_SCHEMA["macro"]["optional"]}
+    return schema
+
+
+def allowed_params(action_type):
+    """动作允许的全部参数 -> 取值类型"""
+    spec = ACTION_SCHEMA[action_type]
+    return {**spec["required"], **spec["optional"]}
+
+
+def validate_value(key, kind, value):
+    """检查参数取值，不合法时抛出 TypeError 或 ValueError"""
+    if isinstance(kind, tuple):
+        if value not in kind:
+            raise ValueError(f"Parameter '{key}' must be one of: {', '.join(kind)}")
+    elif kind == "number":
+        if not isinstance(value, (int, float)):
+            raise TypeError(f"Parameter '{key}' must be a number, got {type(value).__name__}")
+    elif kind == "string":
+        if not isinstance(value, str) or not value:
+            raise TypeError(f"Parameter '{key}' must be a non-empty string")
+    elif kind == "text":
+        if not isinstance(value, str):
+            raise TypeError(f"Parameter '{key}' must be a string")
+    elif kind == "boolean":
+        if not isinstance(value, bool):
+            raise TypeError(f"Parameter '{key}' must be a boolean")
+    elif kind in ("int", "posint"):
+        if not isinstance(value, int):
+            raise TypeError(f"'{key}' must be an integer")
+        if kind == "int" and value < 0:
+            raise ValueError(f"'{key}' cannot be negative")
+        if kind == "posint" and value <= 0:
+            raise ValueError(f"'{key}' must be positive")
+    elif kind == "posnum":
+        if not isinstance(value, (int, float)):
+            raise TypeError(f"'{key}' must be a number")
+        if value <= 0:
+            raise ValueError(f"'{key}' must be positive")
+    elif kind == "object":
+        if not isinstance(value, dict):
+            raise TypeError(f"'{key}' must be an object")
+
+
+# 数字的 (前缀, 完整) 正则
+NUMBER_PATTERNS = {
+    "number": (re.compile(r"-?((0|[1-9]\d*)(\.\d*)?)?"), re.compile(r"-?(0|[1-9]\d*)(\.\d+)?")),
+    "posnum": (re.compile(r"((0|[1-9]\d*)(\.\d*)?)?"), re.compile(r"(0|[1-9]\d*)(\.\d+)?")),
+    "int": (re.compile(r"(0|[1-9]\d*)?"), re.compile(r"0|[1-9]\d*")),
+    "posint": (re.compile(r"([1-9]\d*)?"), re.compile(r"[1-9]\d*")),
+}
+WHITESPACE = " \t\n\r"
+ESCAPES = '"\\/bfnrt'
+
+
+class ActionGrammar:
+    """动作JSON的增量前缀校验器：逐字符输入，判断当前文本能否继续构成合法动作
+
+    语法: {"type": "<动作类型>", "<参数>": <值>, ...}，"type" 必须是第一个键，
+    其余键来自该动作的参数表且不重复，必需参数齐全后才能闭合。
+    object 类型的可选参数 (如宏的 params) 不会被生成，宏使用默认参数；
+    取值为元组的参数 (如 build_schema 生成的宏名) 只能是元组中的某一项。
+    """
+
+    def __init__(self, schema=None, max_whitespace=4):
+        self.schema = schema or ACTION_SCHEMA
+        self.max_whitespace = max_whitespace
+        self.state = "start"
+        self.action_type = None
+        self.used = set()
+        self.key = ""
+        self.buffer = ""  # 当前键名/字符串/数字/字面量
+        self.kind = None  # 当前值的类型
+        self.choices = ()  # 枚举值 (动作类型或宏名) 的候选
+        self.escape = False
+        self.whitespace = 0
+
+    def copy(self):
+        clone = ActionGrammar.__new__(ActionGrammar)
+        clone.__dict__.update(self.__dict__)
+        clone.used = set(self.used)
+        return clone
+
+    @property
+    def done(self):
+        return self.state == "done"
+
+    def _key_candidates(self):
+        if self.action_type is None:
+            return ["type"]
+        spec = self.schema[self.action_type]
+        return [k for k, kind in {**spec["required"], **spec["optional"]}.items()
+                if k not in self.used and kind != "object"]
+
+    def _can_close(self):
+        return self.action_type is not None and set(self.schema[self.action_type]["required"]) <= self.used
+
+    def feed_text(self, text):
+        """输入一段文本，全部合法返回 True"""
+        return all(self.feed(ch) for ch in text)
+
+    def feed(self, ch):
+        """输入一个字符，合法返回 True"""
+        state = self.state
+        if ch in WHITESPACE and state in ("start", "before_key", "colon", "value", "after_value", "done"):
+            self.whitespace += 1
+            return self.whitespace <= self.max_whitespace
+        if state not in ("string", "key", "enum"):
+            self.whitespace = 0
+
+        if state == "start":
+            if ch != "{":
+                return False
+            self.state = "before_key"
+            return True
+
+        if state == "before_key":
+            if ch == '"':
+                self.state, self.buffer = "key", ""
+                return True
+            return False  # 空对象或多余的逗号都不是合法动作
+
+        if state == "key":
+            if ch == '"':
+                if self.buffer not in self._key_candidates():
+                    return False
+                self.key = self.buffer
+                self.state = "colon"
+                return True
+            if not any(k.startswith(self.buffer + ch) for k in self._key_candidates()):
+                return False
+            self.buffer += ch
+            return True
+
+        if state == "colon":
+            if ch != ":":
+                return False
+            self.state = "value"
+            self.kind = "type" if self.key == "type" else self.schema[self.action_type]["required"].get(
+                self.key, self.schema[self.action_type]["optional"].get(self.key))
+            return True
+
+        if state == "value":
+            return self._start_value(ch)
+
+        if state == "enum":
+            if ch == '"':
+                if self.buffer not in self.choices:
+                    return False
+                if self.kind == "type":
+                    self.action_type = self.buffer
+                return self._end_value()
+            if not any(choice.startswith(self.buffer + ch) for choice in self.choices):
+                return False
+            self.buffer += ch
+            return True
+
+        if state == "string":
+            if self.escape:
+                self.escape = False
+                if ch not in ESCAPES:
+                    return False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                if self.kind == "string" and not self.buffer:
+                    return False
+                return self._end_value()
+            elif ch == "\n":
+                return False
+            self.buffer += ch
+            return True
+
+        if state == "number":
+            prefix, full = NUMBER_PATTERNS[self.kind]
+            if prefix.fullmatch(self.buffer + ch):
+                self.buffer += ch
+                return True
+            # 数字结束，当前字符按值之后的状态处理
+            if not full.fullmatch(self.buffer) or (self.kind == "posnum" and float(self.buffer) <= 0):
+                return False
+            self._end_value()
+            return self.feed(ch)
+
+        if state == "literal":
+            self.buffer += ch
+            if not any(lit.startswith(self.buffer) for lit in ("true", "false")):
+                return False
+            if self.buffer in ("true", "false"):
+                return self._end_value()
+            return True
+
+        if state == "after_value":
+            if ch == ",":
+                if not self._key_candidates():
+                    return False
+                self.state = "before_key"
+                return True
+            if ch == "}" and self._can_close():
+                self.state = "done"
+                return True
+            return False
+
+        return False  # done 之后不再接受非空白字符
+
+    def _start_value(self, ch):
+        self.buffer = ""
+        kind = self.kind
+        if kind == "type" or isinstance(kind, tuple):
+            if ch != '"':
+                return False
+            self.state = "enum"
+            self.choices = tuple(self.schema) if kind == "type" else kind
+        elif kind in ("string", "text"):
+            if ch != '"':
+                return False
+            self.state = "string"
+        elif kind in NUMBER_PATTERNS:
+            if not NUMBER_PATTERNS[kind][0].fullmatch(ch):
+                return False
+            self.state, self.buffer = "number", ch
+        elif kind == "boolean":
+            if ch not in "tf":
+                return False
+            self.state, self.buffer = "literal", ch
+        else:
+            return False
+        return True
+
+    def _end_value(self):
+        self.used.add(self.key)
+        self.state = "after_value"
+        self.buffer = ""
+        return True
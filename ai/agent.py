@@ -1,5 +1,6 @@
 import os
 import json
+import random
 import time
 import requests
 import logging
@@ -8,7 +9,6 @@ from datetime import datetime
 import threading
 import concurrent.futures
 import gc
-import torch
 import re # Import re for regex parsing
 from pathlib import Path # <<<确保导入 Path>>>
 # Import i18n function for logging
@@ -20,12 +20,14 @@ except ImportError:
 from .prompts import SYSTEM_PROMPT, TASKS, get_state_analysis_prompt
 from .memory import Memory
 from .learning import LearningSystem
-from .local_llm import LocalLLM
+from .llm_worker import LLMWorkerClient
 from .cache_system import CacheSystem
 from .pattern_recognition import PatternRecognition
-from .vision_learning import VisionLearningSystem
-from .vision_capture import MinecraftVisionCapture
-from torchvision import transforms
+from .macros import MacroLibrary, MacroExecutor
+from .action_schema import ACTION_SCHEMA, OPTIONAL_PARAMS, allowed_params, validate_value
+from .vision_capture import MinecraftVisionCapture, FramePrefetcher
+from .frame_diff import FrameChangeDetector, hamming
+from .frame_preprocess import FramePreprocessor
 from PIL import Image
 import base64
 from io import BytesIO
@@ -77,6 +79,12 @@ def safe_execution(func):
                 
     return wrapper
 
+def _empty_cuda_cache():
+    """释放CUDA缓存；torch 尚未被导入时 (未启用视觉/本地模型) 不做任何事"""
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
 class MinecraftAgent:
     """Minecraft AI代理"""
     
@@ -89,6 +97,7 @@ class MinecraftAgent:
         
         self.memory = Memory()
         self.current_task = None
+        self.closed = False  # close() 只执行一次 (GUI 的 stop_ai 和 run() 都会调用)
         
         # 加载配置
         self.config = self.load_config()
@@ -109,39 +118,129 @@ class MinecraftAgent:
         self.use_local_model = os.environ.get("USE_LOCAL_MODEL", "0") == "1"
         if self.use_local_model:
             try:
-                self.local_model = LocalLLM()
-                self.logger.info("Using local large language model") # Log in English or use key?
+                # 后台加载并预热，就绪前使用API或缓存的决策
+                llm_kwargs = dict(
+                    warmup_system_prompt=SYSTEM_PROMPT,
+                    quantize=self.ai_config.get('local_model_quantize', True),
+                    num_threads=self.ai_config.get('local_model_threads'),
+                    constrained=self.ai_config.get('local_model_constrained', True),
+                    draft_model_name=self.ai_config.get('local_model_draft'),
+                    draft_tokens=self.ai_config.get('local_model_draft_tokens', 4)
+                )
+                if self.ai_config.get('local_model_process', True):
+                    # 独立推理进程：不占用GUI进程的GIL，模型崩溃时自动重启
+                    self.local_model = LLMWorkerClient(
+                        llm_kwargs,
+                        max_batch_size=self.ai_config.get('local_model_batch_size', 8),
+                        batch_wait=self.ai_config.get('local_model_batch_wait', 0.05)
+                    )
+                else:
+                    from .local_llm import LocalLLM  # 按需导入 torch/transformers
+                    self.local_model = LocalLLM(background=True, **llm_kwargs)
+                self.logger.info("Using local large language model (loading in background)") # Log in English or use key?
             except Exception as e:
                 # Use translated log key if available, otherwise fallback
                 self.logger.error(_("log_ai_error", error=f"Local model loading failed: {e}"))
                 self.use_local_model = False
         
         self.cache = CacheSystem()
-        self.pattern_recognition = PatternRecognition()
-        self.prediction_threshold = 0.8  # 相似度阈值
-        self.use_prediction = True
+        self.use_cache = os.environ.get("USE_CACHE", "0") == "1"
+        self.pattern_recognition = PatternRecognition(
+            capacity=self.ai_config.get('pattern_capacity', 20000),
+            recency_size=self.ai_config.get('pattern_recency_size', 5000),
+            max_bytes=self.ai_config.get('pattern_max_bytes')
+        )
+        self.prediction_threshold = self.ai_config.get('prediction_threshold', 0.8)  # 校准后置信度阈值
+        # 可以跳过LLM的步骤中仍按该比例调用LLM做影子比较，分箱校准后继续更新
+        self.prediction_shadow_rate = self.ai_config.get('prediction_shadow_rate', 0.05)
+        self.shadow_verifications = 0
+        self.use_prediction = os.environ.get('USE_PREDICTION', '0') == '1'
+        
+        # 学习系统 (老虎机模式基于动作结果统计直接决策，跳过LLM)
+        self.learning = None
+        if self.ai_config.get('learning_enabled', True):
+            self.learning = LearningSystem(
+                exploration_rate=self.ai_config.get('bandit_exploration_rate', 0.1),
+                confidence_threshold=self.ai_config.get('bandit_confidence_threshold', 0.9),
+                min_samples=self.ai_config.get('bandit_min_samples', 5)
+            )
+        self.use_bandit = self.learning is not None and (
+            os.environ.get("USE_BANDIT", "0") == "1" or self.ai_config.get('bandit_enabled', False)
+        )
+        
+        # 宏动作 (高频成功的动作序列，一次决策执行多个动作)
+        self.use_macros = self.ai_config.get('macros_enabled', False)
+        self.macro_promote_interval = self.ai_config.get('macro_promote_interval', 20)
+        self.macros = MacroLibrary(
+            min_support=self.ai_config.get('macro_min_support', 5),
+            min_success_rate=self.ai_config.get('macro_min_success_rate', 0.8)
+        )
+        self.macro_executor = MacroExecutor(
+            self.mc_api, lambda: (self.get_bot_status() or {}).get('state'), self.macros
+        )
+        self._sync_macro_grammar()
+        self.recorded_steps = 0
         
         # 绩效统计
         self.api_calls = 0
         self.cached_responses = 0
         self.predictions_used = 0
         self.prediction_successes = 0
+        self.bandit_decisions = 0
         
         # 视觉系统
         self.use_vision = self.config.get('vision', {}).get('use_vision', True)
         self.vision_learning = None
         self.vision_system_degraded = False
+        # 视觉帧客户端：优先以原始图像字节传输，旧服务器回退到JSON/Base64
+        self.vision_capture = MinecraftVisionCapture(self.mc_api, timeout=10)
+        # 帧变化检测：画面没有明显变化时不重复上传图像
+        vision_settings = self.config.get('vision', {})
+        self.frame_detector = None
+        if vision_settings.get('frame_diff_enabled', True):
+            self.frame_detector = FrameChangeDetector(
+                method=vision_settings.get('frame_diff_method', 'dhash'),
+                threshold=vision_settings.get('frame_diff_threshold', 8),
+                max_interval=vision_settings.get('frame_diff_max_interval', 10)
+            )
+        # 上传前缩小并重新编码截图
+        self.frame_preprocessor = None
+        self.image_byte_budget = vision_settings.get('image_byte_budget', 60000)
+        if vision_settings.get('preprocess_enabled', True):
+            self.frame_preprocessor = FramePreprocessor(
+                max_edge=vision_settings.get('image_max_edge', 768),
+                image_format=vision_settings.get('image_format', 'JPEG'),
+                quality=vision_settings.get('image_quality', 70),
+                byte_budget=self.image_byte_budget
+            )
         if self.use_vision:
             try:
-            vision_config = self.config.get('vision', {})
+                vision_config = self.config.get('vision', {})
                 vision_model = vision_config.get('vision_model', 'MobileNet')
-            self.vision_learning = VisionLearningSystem(model_name=vision_model)
+                from .vision_learning import VisionLearningSystem  # 按需导入 torch/torchvision
+                self.vision_learning = VisionLearningSystem(model_name=vision_model,
+                                                            use_exported=vision_config.get('export_model', True),
+                                                            replay_capacity=vision_config.get('replay_capacity', 50000),
+                                                            label_top_k=vision_config.get('scene_label_top_k', 3))
                 self.logger.info(f"Vision learning system initialized with model: {vision_model}")
-        except Exception as e:
-                 self.logger.warning(_("log_vision_system_init_failed", error=str(e)))
-                 self.logger.warning(_("log_vision_system_init_warning"))
-            self.vision_system_degraded = True
-                 self.use_vision = False # Disable vision if init failed
+            except Exception as e:
+                self.logger.warning(_("log_vision_system_init_failed", error=str(e)))
+                self.logger.warning(_("log_vision_system_init_warning"))
+                self.vision_system_degraded = True
+                self.use_vision = False # Disable vision if init failed
+        # 场景标签足够时不向API发送图像
+        self.scene_tags_only = vision_settings.get('scene_tags_only', False)
+        self.last_scene_description = None  # 画面没有明显变化时复用，不重复运行CNN
+        self.description_hash = None  # 生成 last_scene_description 的那一帧，与已发送图像的参考帧分开记录
+        # 后台预取视觉帧，step() 直接读取最新一帧
+        self.frame_prefetcher = None
+        if self.use_vision and vision_settings.get('prefetch_enabled', True):
+            self.frame_prefetcher = FramePrefetcher(
+                MinecraftVisionCapture(self.mc_api, timeout=10),  # 独立的连接，不与主线程共用会话
+                interval=vision_settings.get('prefetch_interval'),
+                # 动作完成后取的帧要到下一步 (约 delay 秒后) 才使用
+                max_age=vision_settings.get('frame_max_age', 2.0) + self.delay
+            ).start()
     
     def set_task(self, task):
         """设置当前任务"""
@@ -166,36 +265,55 @@ class MinecraftAgent:
             self.logger.info("Bot status retrieved successfully.") # Internal log
             current_state_data = bot_status.get('state', {})
 
-            # 获取视觉帧 (Base64)
-            image_base64 = None
+            # 获取视觉帧 (原始图像字节，仅在发送给API时才编码为Base64)
+            frame_bytes, frame_mime = None, None
             if self.use_vision and self.vision_learning:
                 self.logger.info("Getting vision data...") # Internal log
+                if self.frame_prefetcher:
+                    frame_bytes, frame_mime, frame_age = self.frame_prefetcher.latest()
+                    if frame_bytes is None and frame_age is not None:
+                        self.logger.info(f"Discarding stale vision frame ({frame_age:.1f}s old).") # Internal log
+                    elif frame_bytes is None and self.frame_prefetcher.last_error:
+                        self.logger.warning(_("log_vision_get_frame_failed", error=self.frame_prefetcher.last_error))
+                else:
+                    frame_bytes, frame_mime = self.vision_capture.get_latest_frame_bytes()
+                    if frame_bytes is None:
+                        self.logger.warning(_("log_vision_get_frame_failed", error=self.vision_capture.last_error))
+                if frame_bytes is not None and len(frame_bytes) > 5_000_000:
+                    self.logger.warning("Vision image too large, skipping inclusion.") # Internal log
+                    frame_bytes = None
+                elif frame_bytes is not None:
+                    self.logger.info(f"Vision data retrieved ({frame_mime}, {len(frame_bytes)} bytes).") # Internal log
+
+            observed_frame = frame_bytes  # 预处理前的原始帧，动作完成后写入经验回放
+            # 与上次发送的帧比较，画面变化不大时本步不附带图像
+            frame_changed = True
+            frame_hash = None
+            if frame_bytes and self.frame_detector:
                 try:
-                    vision_response = requests.get(f"{self.mc_api}/bot/vision", timeout=10)
-                    if vision_response.status_code == 200:
-                        vision_data = vision_response.json()
-                        if vision_data.get('success') and vision_data.get('data'):
-                            image_base64 = vision_data['data'].split('base64,')[-1]
-                            if len(image_base64) * 3 / 4 > 5_000_000:
-                                self.logger.warning("Vision image too large, skipping inclusion.") # Internal log
-                                image_base64 = None
-                            else:
-                                self.logger.info("Vision data retrieved.") # Internal log
-                        elif vision_data.get('error'):
-                             self.logger.warning(_("log_vision_get_frame_failed", error=vision_data.get('error')))
-                        else:
-                             self.logger.info("Vision data retrieved, but no image data found.") # Internal log
-                    else:
-                         self.logger.warning(f"Vision API request failed: {vision_response.status_code}") # Internal log
-                except requests.exceptions.RequestException as e:
-                    self.logger.error(_("log_vision_get_frame_failed", error=f"RequestException: {e}"))
+                    frame_changed, distance = self.frame_detector.check(frame_bytes)
+                    frame_hash = self.frame_detector.pending_hash
+                    self.logger.info(f"Frame change distance: {distance}, send image: {frame_changed}") # Internal log
                 except Exception as e:
-                    self.logger.error(_("log_vision_get_frame_failed", error=f"Unknown error: {e}"))
+                    self.logger.warning(f"Frame change detection failed: {e}") # Internal log
             elif self.use_vision and not self.vision_learning:
                  self.logger.warning("Vision enabled but system not initialized.") # Internal log
 
-            # 1. 模式识别预测 (Optional)
-            # ...
+            # 1. 模式识别预测 (校准置信度足够高时跳过LLM，否则以影子模式与LLM决策比较)
+            prediction = None
+            if self.use_prediction:
+                prediction = self.pattern_recognition.predict_action(current_state_data)
+
+            # 本地模型仍在后台加载时，本步改用API或缓存的决策
+            local_ready = False
+            if self.use_local_model and hasattr(self, 'local_model'):
+                if self.local_model.failed():
+                    self.logger.error(_("log_ai_error", error=f"Local model loading failed: {self.local_model.ready.exception()}"))
+                    self.use_local_model = False
+                else:
+                    local_ready = self.local_model.is_ready()
+                    if not local_ready:
+                        self.logger.info("Local model still loading, falling back to API/cache.") # Internal log
 
             # 2. 生成文本提示部分
             self.logger.info("Generating text prompt...") # Internal log
@@ -206,45 +324,104 @@ class MinecraftAgent:
             messages = []
             messages.append({"role": "system", "content": SYSTEM_PROMPT})
             user_content = [{"type": "text", "text": text_prompt}]
-            if image_base64 and not self.use_local_model:
+            # 场景标签：本地文本模型、画面未变化或只用标签时，以文字形式提供视觉信息
+            scene_description = None
+            if frame_bytes and (local_ready or not frame_changed or self.scene_tags_only):
+                scene_description = self._describe_scene(frame_bytes, frame_hash)
+            # DeepSeekAPI.chat 不保留历史，模型看不到之前发送的图像：跳过图像时只提供缓存的场景描述，
+            # 没有可用描述时仍然附带图像
+            image_skipped = bool(frame_bytes and not local_ready and not frame_changed and scene_description)
+            if image_skipped:
+                user_content[0]["text"] += f"\n\n[Visual context: {scene_description} (the view has not changed since the previous step)]"
+            elif scene_description:
+                user_content[0]["text"] += f"\n\n[Visual context: {scene_description}]"
+            if frame_bytes and not local_ready and not image_skipped and not (self.scene_tags_only and scene_description):
+                if self.frame_preprocessor:
+                    try:
+                        frame_bytes, frame_mime = self.frame_preprocessor.process(frame_bytes, frame_mime)
+                        stats = self.frame_preprocessor.get_stats()
+                        self.logger.info(f"Frame preprocessed: {len(frame_bytes)} bytes, edge {stats['last_edge']}, "
+                                         f"saved {stats['bytes_saved']} bytes so far") # Internal log
+                    except Exception as e:
+                        self.logger.warning(f"Frame preprocessing failed, sending original: {e}") # Internal log
+                image_base64 = base64.b64encode(frame_bytes).decode("ascii")
                 user_content.append({
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{image_base64}"}
+                    "image_url": {"url": f"data:{frame_mime};base64,{image_base64}"}
                 })
+                if self.frame_detector:
+                    self.frame_detector.mark_sent()  # 只有图像确实附带在请求中时才更新参考帧
                 self.logger.info("Image data added to prompt.") # Internal log
-            elif image_base64 and self.use_local_model:
+            elif image_skipped:
+                 self.logger.info(f"Image skipped, scene unchanged; sent cached scene description: {scene_description}") # Internal log
+            elif frame_bytes and local_ready and not scene_description:
                  user_content[0]["text"] += "\n\n[Note: Visual context is available.]"
                  self.logger.info("Image presence noted for local model.") # Internal log
+            elif scene_description:
+                 self.logger.info(f"Scene tags added to prompt: {scene_description}") # Internal log
             messages.append({"role": "user", "content": user_content})
 
-            # 4. 缓存 (暂未实现多模态缓存)
-            cached_response = None
+            # 4. 预测跳过：只有在该置信度区间已经积累足够影子样本时才信任预测
+            action = None
+            result = {}
             response = None
-
-            # 5. 调用 LLM
-            llm_type = 'Local' if self.use_local_model else 'API'
-            self.logger.info(f"Calling {llm_type} LLM...") # Internal log
-            start_time = time.time()
-            try:
-                if self.use_local_model and hasattr(self, 'local_model'):
-                    response = self.local_model.chat(messages)
-                elif not self.use_local_model and self.api:
-                    self.api_calls += 1
-                    response = self.api.chat(messages)
-                else:
-                     raise Exception(f"LLM client ({llm_type}) not available.")
-            except Exception as llm_error:
-                 self.logger.error(_("log_ai_error", error=f"LLM call failed: {llm_error}"))
-                 # Fallback action
-                 action = {"type": "chat", "message": "Error communicating with LLM."}
-                 result = {"success": False, "error": f"LLM call failed: {llm_error}"}
-                 response = None # Ensure response is None so we don't parse
-
-            end_time = time.time()
-            self.logger.info(f"LLM call finished in {end_time - start_time:.2f}s.") # Internal log
+            prediction_bypass = False
+            if self._trust_prediction(prediction):
+                action = prediction['action']
+                prediction_bypass = True
+                self.predictions_used += 1
+                self.logger.info(
+                    f"Prediction bypass: {action} (confidence {prediction['confidence']:.2f}, "
+                    f"similarity {prediction['similarity']:.2f}, success rate {prediction['success_rate']:.2f}, "
+                    f"support {prediction['support']})"
+                ) # Internal log
+
+            # 老虎机决策：当前上下文中有明显占优的动作时直接执行，跳过LLM
+            if action is None and self.use_bandit:
+                choice = self.learning.select_action(current_state_data)
+                if choice:
+                    action = choice['action']
+                    self.bandit_decisions += 1
+                    self.logger.info(
+                        f"Bandit selected {action} (confidence {choice['confidence']:.2f}, "
+                        f"success rate {choice['success_rate']:.2f}, support {choice['support']}), skipping LLM."
+                    ) # Internal log
+
+            # 5. 缓存 (按文本提示词缓存，不含图像)
+            cached_response = None
+            warming_up = self.use_local_model and not local_ready and not self.api
+            if action is None and (self.use_cache or warming_up):
+                cached_response = self.cache.get(text_prompt)
+                if cached_response:
+                    self.cached_responses += 1
+                    response = cached_response
+                elif warming_up:
+                    # 本地模型未就绪且没有API可用：等待而不是阻塞
+                    action = {"type": "wait", "ticks": 20}
+                    self.logger.info("No API or cached decision while local model loads, waiting.") # Internal log
+
+            # 6. 调用 LLM
+            if action is None and response is None:
+                llm_type = 'Local' if local_ready else 'API'
+                self.logger.info(f"Calling {llm_type} LLM...") # Internal log
+                start_time = time.time()
+                try:
+                    if local_ready:
+                        response = self.local_model.chat(messages)
+                    elif self.api:
+                        self.api_calls += 1
+                        response = self.api.chat(messages)
+                    else:
+                        raise Exception(f"LLM client ({llm_type}) not available.")
+                except Exception as llm_error:
+                    self.logger.error(_("log_ai_error", error=f"LLM call failed: {llm_error}"))
+                    result = {"success": False, "error": f"LLM call failed: {llm_error}"}
+                    response = None # Ensure response is None so we don't parse
+
+                end_time = time.time()
+                self.logger.info(f"LLM call finished in {end_time - start_time:.2f}s.") # Internal log
             
             # 处理响应
-            action = None
             if response is not None:
                 if not response.strip():
                     self.logger.warning("LLM returned empty response.") # Internal log
@@ -257,12 +434,15 @@ class MinecraftAgent:
                         action = self._parse_action(cleaned_response)
                         self.logger.info(f"Parsed action: {action}") # Internal log
                     except Exception as e:
-                         self.logger.error(_("log_ai_error", error=f"Parsing LLM response failed: {e}\nRaw: {response[:200]}..."))
-                         action = {"type": "chat", "message": f"Error parsing response."}
-                         result = {"success": False, "error": f"Parsing response failed: {e}"}
+                        self.logger.error(_("log_ai_error", error=f"Parsing LLM response failed: {e}\nRaw: {response[:200]}..."))
+                        action = {"type": "chat", "message": f"Error parsing response."}
+                        result = {"success": False, "error": f"Parsing response failed: {e}"}
+                # 影子模式：把预测与LLM的实际选择比较，用于在线校准置信度
+                if prediction and not result:
+                    self.pattern_recognition.record_shadow(prediction, action, self.prediction_threshold)
             # If action wasn't set due to LLM error or parsing error, create a default
             if action is None:
-                if 'result' not in locals(): # If result wasn't set by LLM error handler
+                if not result: # If result wasn't set by LLM error handler
                     action = {"type": "chat", "message": "Having trouble deciding..."}
                     result = {"success": False, "error": "Action could not be determined"}
                 else: # Result already contains the error
@@ -271,47 +451,125 @@ class MinecraftAgent:
             # 执行动作 (only if action was determined)
             if 'error' not in result: # If no error occurred before action execution stage
                 try:
-                    self.logger.info(f"Sending action to bot server: {action}") # Internal log
-                    bot_response = requests.post(
-                        f"{self.mc_api}/bot/action",
-                        json=action,
-                        timeout=30
-                    )
-                    self.logger.info(f"Bot server response code: {bot_response.status_code}") # Internal log
-
-                    if bot_response.status_code == 200:
-                    result = bot_response.json()
-                        self.logger.info(f"Bot execution result: {result}") # Internal log
+                    if action.get('type') == 'macro':
+                        self.logger.info(f"Executing macro: {action}") # Internal log
+                        result = self.macro_executor.execute(action['name'], action.get('params'))
+                        self.logger.info(f"Macro result: {result.get('message') or result.get('error')}") # Internal log
                     else:
-                        error_msg = f"Bot server error: {bot_response.status_code} - {bot_response.text}"
-                        result = {"success": False, "error": error_msg}
-                        self.logger.error(_("log_send_action_failed", error=error_msg))
+                        self.logger.info(f"Sending action to bot server: {action}") # Internal log
+                        bot_response = requests.post(
+                            f"{self.mc_api}/bot/action",
+                            json=action,
+                            timeout=30
+                        )
+                        self.logger.info(f"Bot server response code: {bot_response.status_code}") # Internal log
+
+                        if bot_response.status_code == 200:
+                            result = bot_response.json()
+                            self.logger.info(f"Bot execution result: {result}") # Internal log
+                        else:
+                            error_msg = f"Bot server error: {bot_response.status_code} - {bot_response.text}"
+                            result = {"success": False, "error": error_msg}
+                            self.logger.error(_("log_send_action_failed", error=error_msg))
 
                 except requests.exceptions.RequestException as e:
                     error_msg = f"Communication error with bot server: {e}"
                     result = {"success": False, "error": error_msg}
                     self.logger.error(_("log_send_action_failed", error=error_msg))
-                    
-                    # 记录动作和结果
-                    self.memory.add_memory({
-                        'action': action,
-                        'result': result,
-                        'timestamp': time.time()
-                    })
+
+                # 记录动作和结果
+                self.memory.add_memory({
+                    'action': action,
+                    'result': result,
+                    'timestamp': time.time()
+                })
+                outcome = "success" if result.get('success') else str(result.get('error', 'failed'))
+                # 成功的LLM决策写入缓存 (本地模型会话也写入，供下次启动预热期间使用)
+                if (response and not cached_response and result.get('success')
+                        and (self.use_cache or self.use_local_model)):
+                    self.cache.put(text_prompt, response)
+                if self.learning:
+                    self.learning.record_action_outcome(action.get('type', 'unknown'), current_state_data, outcome, action=action)
+                if self.use_prediction or self.use_macros:
+                    self.pattern_recognition.add_observation(current_state_data, action, outcome)
+                    if prediction_bypass and result.get('success'):
+                        self.prediction_successes += 1
+                self.recorded_steps += 1
+                if self.use_macros and self.recorded_steps % self.macro_promote_interval == 0:
+                    self.promote_macros()
+                # 本步看到的帧连同动作和结果交给后台线程写入经验回放缓冲区
+                if self.use_vision and self.vision_learning and observed_frame:
+                    try:
+                        self.vision_learning.learn_from_frame_async(
+                            Image.open(BytesIO(observed_frame)), current_state_data, action, result)
+                    except Exception as e:
+                        self.logger.warning(f"Recording replay experience failed: {e}") # Internal log
                     
             # 统计
-            total_steps = self.api_calls + self.cached_responses + self.predictions_used
+            total_steps = self.api_calls + self.cached_responses + self.predictions_used + self.bandit_decisions
             if total_steps > 0 and total_steps % 10 == 0:
-                 # Use internal log for stats
-                 self.logger.info(f"Stats - API: {self.api_calls}, Cache: {self.cached_responses}, Predict: {self.predictions_used}")
-                    
-                    return result
-                
-            except Exception as e:
-             import traceback
-             self.logger.critical(_("log_ai_error", error=f"CRITICAL STEP ERROR: {e}\n{traceback.format_exc()}"))
-             return {"success": False, "error": f"Critical step error: {e}"}
+                # Use internal log for stats
+                self.logger.info(f"Stats - API: {self.api_calls}, Cache: {self.cached_responses}, Predict: {self.predictions_used}, Bandit: {self.bandit_decisions}")
+                if self.use_prediction:
+                    calibration = self.pattern_recognition.calibrator.stats()
+                    self.logger.info(
+                        f"Prediction calibration - shadow samples: {calibration['samples']}, "
+                        f"agreement: {calibration['agreement_rate']:.2%}, "
+                        f"false bypass: {calibration['false_bypass_rate']:.2%}, "
+                        f"bypass successes: {self.prediction_successes}/{self.predictions_used}, "
+                        f"shadow-verified bypasses: {self.shadow_verifications}"
+                    )
+
+            return result
+
+        except Exception as e:
+            import traceback
+            self.logger.critical(_("log_ai_error", error=f"CRITICAL STEP ERROR: {e}\n{traceback.format_exc()}"))
+            return {"success": False, "error": f"Critical step error: {e}"}
+        finally:
+            # 每步结束后 (包括出错、未执行动作的步骤) 预取下一步要用的帧
+            if self.frame_prefetcher:
+                self.frame_prefetcher.request()
     
+    def _describe_scene(self, frame_bytes, frame_hash=None):
+        """返回场景描述；与生成上次描述的帧相比画面没有明显变化时复用，不重复运行CNN"""
+        if (self.last_scene_description and frame_hash is not None and self.description_hash is not None
+                and hamming(frame_hash, self.description_hash) <= self.frame_detector.threshold):
+            return self.last_scene_description
+        try:
+            scene_description = self.vision_learning.get_visual_context_description(Image.open(BytesIO(frame_bytes)))
+        except Exception as e:
+            self.logger.warning(f"Scene description failed: {e}") # Internal log
+            return None
+        self.last_scene_description = scene_description
+        self.description_hash = frame_hash
+        return scene_description
+
+    def _trust_prediction(self, prediction):
+        """校准后置信度超过阈值时跳过LLM；其中随机 prediction_shadow_rate 比例的步骤仍调用LLM做影子比较"""
+        if not (prediction and prediction['calibrated'] and prediction['confidence'] > self.prediction_threshold):
+            return False
+        if random.random() < self.prediction_shadow_rate:
+            self.shadow_verifications += 1
+            self.logger.info(f"Shadow-verifying calibrated prediction {prediction['action']} against the LLM.") # Internal log
+            return False
+        return True
+
+    def promote_macros(self):
+        """把序列挖掘器从实际执行的动作中挖掘出的高频成功序列提升为宏"""
+        try:
+            changed = self.macros.promote_from_patterns(self.pattern_recognition)
+            if changed:
+                self.logger.info(f"Macro library updated: {', '.join(self.macros.macros)}") # Internal log
+                self._sync_macro_grammar()
+        except Exception as e:
+            self.logger.warning(f"Macro promotion failed: {e}") # Internal log
+
+    def _sync_macro_grammar(self):
+        """让本地模型的约束解码只生成当前宏库中的宏名"""
+        if self.use_local_model and hasattr(self, 'local_model'):
+            self.local_model.set_macro_names(list(self.macros.macros) if self.use_macros else [])
+
     def _clean_response(self, response):
         """清理LLM返回的原始响应文本"""
         if not isinstance(response, str): # Handle non-string input safely
@@ -321,7 +579,7 @@ class MinecraftAgent:
         response = re.sub(r"```json\\n?", "", response)
         response = re.sub(r"\\n?```", "", response)
         # 移除可能的前后空白字符
-            response = response.strip()
+        response = response.strip()
         # 尝试替换掉可能存在的非标准引号或转义 (注意原始字符串中的反斜杠)
         response = response.replace("\\\\'", "'").replace('\\\\"', '"') # Handles escaped quotes like \\' or \\"
         # 特殊处理：如果包含换行符，通常只取第一行有效命令
@@ -388,7 +646,7 @@ class MinecraftAgent:
                             parsed_action[key] = False
                         elif '.' in value:
                             parsed_action[key] = float(value)
-                else:
+                        else:
                             parsed_action[key] = int(value)
                     except ValueError:
                         parsed_action[key] = value  # Keep as string
@@ -475,7 +733,7 @@ class MinecraftAgent:
                     self.logger.debug(f"Simple command '{command}' not recognized for this format.")
             except (ValueError, TypeError) as e:
                 self.logger.debug(f"Simple action parsing/validation failed: {e}. Action attempt: {parsed_action}. Falling back.")
-        except Exception as e:
+            except Exception as e:
                  self.logger.error(f"Unexpected error processing simple action: {e}")
 
         # 4. 如果所有格式都失败，回退到 Chat
@@ -504,121 +762,31 @@ class MinecraftAgent:
         if not isinstance(action_type, str):
             raise TypeError(f"Action 'type' field must be a string, got {type(action_type).__name__}")
 
-        # 2. Define known action types and their required parameters
-        known_actions = {
-            "moveTo": {"x", "y", "z"},
-            "collect": {"blockType"},
-            "placeBlock": {"itemName", "x", "y", "z"},
-            "dig": {"x", "y", "z"},
-            "attack": {"target"},
-            "jumpAttack": {"target"},
-            "lookAt": {"x", "y", "z"},
-            "equip": {"itemName"},
-            "unequip": set(),
-            "useHeldItem": set(),
-            "craft": {"itemName"},
-            "chat": {"message"},
-            "setControlState": {"control", "state"},
-            "clearControlStates": set(),
-            "wait": set(),
-        }
-
-        # 3. Check if action type is known
-        if action_type not in known_actions:
+        # 2. Check if action type is known (schema shared with constrained decoding)
+        if action_type not in ACTION_SCHEMA:
             raise ValueError(f"Unknown action type: '{action_type}'")
 
-        required_params_set = known_actions[action_type]
+        allowed_params_set = allowed_params(action_type)
         provided_params_set = set(action.keys()) - {'type'}
 
-        # 4. Check for missing required parameters
-        missing = required_params_set - provided_params_set
+        # 3. Check for missing required parameters
+        missing = set(ACTION_SCHEMA[action_type]["required"]) - provided_params_set
         if missing:
             raise ValueError(f"Action '{action_type}' missing required parameters: {', '.join(sorted(missing))}")
 
-        # 5. Perform Simplified Type Checks
+        # 4. Type checks driven by the schema
         try:
-            # Coordinate Checks
-            if action_type in ["moveTo", "placeBlock", "dig", "lookAt"]:
-                for coord in ['x', 'y', 'z']:
-                    val = action[coord]
-                    if not isinstance(val, (int, float)):
-                        raise TypeError(f"Parameter '{coord}' must be a number, got {type(val).__name__}")
-
-            # String Checks
-            if action_type in ["attack", "jumpAttack"]:
-                val = action['target']
-                if not isinstance(val, str) or not val:
-                    raise TypeError("Parameter 'target' must be a non-empty string")
-            elif action_type == "collect":
-                val = action['blockType']
-                if not isinstance(val, str) or not val:
-                    raise TypeError("Parameter 'blockType' must be a non-empty string")
-            elif action_type in ["placeBlock", "equip", "craft"]:
-                val = action['itemName']
-                if not isinstance(val, str) or not val:
-                    raise TypeError("Parameter 'itemName' must be a non-empty string")
-            elif action_type == "chat":
-                val = action['message']
-                if not isinstance(val, str):
-                    raise TypeError("Parameter 'message' must be a string")
-            elif action_type == "setControlState":
-                val_control = action['control']
-                if not isinstance(val_control, str) or not val_control:
-                    raise TypeError("Parameter 'control' must be a non-empty string")
-
-            # Boolean Check
-            if action_type == "setControlState":
-                val_state = action['state']
-                if not isinstance(val_state, bool):
-                    raise TypeError("Parameter 'state' must be a boolean")
-
-            # Optional Param Checks
-            if "ticks" in action:
-                if action_type != "wait":
-                    raise ValueError("Parameter 'ticks' only valid for 'wait' action")
-                val_ticks = action['ticks']
-                if not isinstance(val_ticks, int):
-                    raise TypeError("'ticks' must be an integer")
-                if val_ticks < 0:
-                    raise ValueError("'ticks' cannot be negative")
-            if "count" in action:
-                if action_type not in ["collect", "craft"]:
-                    raise ValueError(f"'count' not valid for '{action_type}' action")
-                val_count = action['count']
-                if not isinstance(val_count, int):
-                    raise TypeError("'count' must be an integer")
-                if val_count <= 0:
-                    raise ValueError("'count' must be positive")
-            if "radius" in action:
-                if action_type != "collect":
-                    raise ValueError("'radius' only valid for 'collect' action")
-                val_radius = action['radius']
-                if not isinstance(val_radius, (int, float)):
-                    raise TypeError("'radius' must be a number")
-                if val_radius <= 0:
-                    raise ValueError("'radius' must be positive")
-            if "destination" in action:
-                if action_type not in ["equip", "unequip"]:
-                    raise ValueError(f"'destination' only valid for '{action_type}' action")
-                val_dest = action['destination']
-                if not isinstance(val_dest, str) or not val_dest:
-                    raise TypeError("'destination' must be a non-empty string")
+            for key in sorted(provided_params_set):
+                if key in allowed_params_set:
+                    validate_value(key, allowed_params_set[key], action[key])
+                elif key in OPTIONAL_PARAMS:
+                    raise ValueError(f"'{key}' not valid for '{action_type}' action")
+
+            if action_type == "macro" and not self.macros.get(action['name']):
+                raise ValueError(f"Unknown macro: '{action['name']}'")
 
             # Check for Unknown Parameters
-            allowed_params_set = set(known_actions[action_type])
-            if action_type == "wait" and "ticks" in action:
-                allowed_params_set.add("ticks")
-            if action_type == "collect":
-                if "count" in action:
-                    allowed_params_set.add("count")
-                if "radius" in action:
-                    allowed_params_set.add("radius")
-            if action_type == "craft" and "count" in action:
-                allowed_params_set.add("count")
-            if action_type in ["equip", "unequip"] and "destination" in action:
-                allowed_params_set.add("destination")
-
-            unknown = provided_params_set - allowed_params_set
+            unknown = provided_params_set - set(allowed_params_set)
             if unknown:
                 self.logger.warning(
                     f"Action '{action_type}' received parameters not strictly defined for it: {', '.join(sorted(unknown))}"
@@ -786,8 +954,22 @@ class MinecraftAgent:
             "deepseek_api_key": "",
             "minecraft": {"host": "0.0.0.0", "port": 25565, "username": "AI", "version": "1.21.1"},
             "server": {"port": 3002, "host": "localhost"},
-            "ai": {"steps": 100, "delay": 3, "api_key": ""}, # api_key likely needed here too
-            "vision": {"use_vision": True, "vision_model": "MobileNet"},
+            "ai": {"steps": 100, "delay": 3, "api_key": "", # api_key likely needed here too
+                   "bandit_enabled": False, "bandit_exploration_rate": 0.1,
+                   "bandit_confidence_threshold": 0.9, "bandit_min_samples": 5,
+                   "prediction_threshold": 0.8, "prediction_shadow_rate": 0.05,
+                   "macros_enabled": False, "macro_min_support": 5, "macro_min_success_rate": 0.8,
+                   "local_model_quantize": True, "local_model_threads": None,
+                   "local_model_constrained": True, "local_model_draft": None,
+                   "local_model_draft_tokens": 4, "local_model_process": True,
+                   "local_model_batch_size": 8, "local_model_batch_wait": 0.05},
+            "vision": {"use_vision": True, "vision_model": "MobileNet", "frame_diff_enabled": True,
+                       "frame_diff_method": "dhash", "frame_diff_threshold": 8, "frame_diff_max_interval": 10,
+                       "preprocess_enabled": True, "image_max_edge": 768, "image_format": "JPEG",
+                       "image_quality": 70, "image_byte_budget": 60000,
+                       "prefetch_enabled": True, "prefetch_interval": None, "frame_max_age": 2.0,
+                       "export_model": True, "replay_capacity": 50000, "scene_label_top_k": 3,
+                       "scene_tags_only": False},
             "gui": {"language": "zh"}
         }
         if not config_path.exists():
@@ -809,17 +991,17 @@ class MinecraftAgent:
                 return default_config
 
         try:
-                    with open(config_path, "r", encoding='utf-8') as f:
+            with open(config_path, "r", encoding='utf-8') as f:
                 loaded_config = json.load(f)
-                # Deep merge (simple version for expected structure)
-                merged_config = default_config.copy()
-                for key, value in loaded_config.items():
-                    if isinstance(value, dict) and key in merged_config and isinstance(merged_config[key], dict):
-                        # Recursively merge dictionaries (level 1 depth)
-                        merged_config[key] = {**merged_config[key], **value} # Python 3.5+ merge
-                    else:
-                        merged_config[key] = value
-                return merged_config
+            # Deep merge (simple version for expected structure)
+            merged_config = default_config.copy()
+            for key, value in loaded_config.items():
+                if isinstance(value, dict) and key in merged_config and isinstance(merged_config[key], dict):
+                    # Recursively merge dictionaries (level 1 depth)
+                    merged_config[key] = {**merged_config[key], **value} # Python 3.5+ merge
+                else:
+                    merged_config[key] = value
+            return merged_config
         except json.JSONDecodeError as e:
             self.logger.error(_("log_config_load_failed", error=f"Invalid JSON in config.json ({config_path}): {e}"))
             return default_config
@@ -837,10 +1019,10 @@ class MinecraftAgent:
         try:
             response = requests.get(f"{self.mc_api}/bot/status", timeout=15)
             response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                return response.json()
+            return response.json()
         except requests.exceptions.Timeout:
             self.logger.warning("Timeout getting bot status.") # Internal log
-                return None
+            return None
         except requests.exceptions.ConnectionError:
             self.logger.warning("Connection error getting bot status.") # Internal log
             return None
@@ -848,7 +1030,7 @@ class MinecraftAgent:
             self.logger.error(f"Error getting bot status: {e}") # Internal log
             return None
         except json.JSONDecodeError:
-             self.logger.error("Failed to decode JSON from bot status response.") # Internal log
+            self.logger.error("Failed to decode JSON from bot status response.") # Internal log
             return None
     
     def send_action(self, action):
@@ -890,12 +1072,13 @@ class MinecraftAgent:
                 self.cached_responses += 1
                 return self.parse_ai_response(cached_response)
         
-        # 使用模式识别
+        # 使用模式识别 (只信任已校准的置信度)
+        prediction = None
         if os.environ.get('USE_PREDICTION', '0') == '1' and not has_recent_chat:
-            prediction = self.pattern_recognition.predict_action(state)
-            if prediction and prediction.get('confidence', 0) > self.prediction_threshold:
+            prediction = self.pattern_recognition.predict_action(state.get('state', {}))
+            if self._trust_prediction(prediction):
                 self.predictions_used += 1
-                return prediction.get('action')
+                return prediction['action']
         
         # 调用AI模型获取决策
         if self.use_local_model:
@@ -911,10 +1094,11 @@ class MinecraftAgent:
             cache_key = self.cache.get_cache_key(prompt)
             self.cache.cache_response(cache_key, response)
         
-        # 如果使用模式识别，则记录新模式
-        if os.environ.get('USE_PREDICTION', '0') == '1':
+        # 如果使用模式识别，则以影子模式记录预测与LLM决策是否一致
+        if prediction:
             parsed_response = self.parse_ai_response(response)
-            self.pattern_recognition.add_pattern(state, parsed_response)
+            if parsed_response:
+                self.pattern_recognition.record_shadow(prediction, parsed_response[0], self.prediction_threshold)
         
         return self.parse_ai_response(response)
     
@@ -982,97 +1166,6 @@ class MinecraftAgent:
             # 返回一个默认动作
             return [{"type": "chat", "message": "我需要重新思考一下。"}]
     
-    def run_step(self):
-        """运行一个决策步骤"""
-        # 获取当前状态
-        state = self.get_bot_status()
-        if not state:
-            print("无法获取机器人状态，将重试...")
-            # 重试一次
-            time.sleep(2)
-            state = self.get_bot_status()
-            if not state:
-                print("重试失败，跳过此步骤")
-                return False
-        
-        # 初始化视觉帧
-        current_frame = None
-        if self.use_vision:
-            try:
-                # 直接从API获取
-                current_frame = self.vision_learning.get_frame_from_bot(f"{self.mc_api}/bot/vision")
-            except Exception as e:
-                print(f"获取视觉帧失败: {e}")
-        
-        # 决定动作
-        actions = self.decide_action(state)
-        
-        # 确保actions是列表格式
-        if not isinstance(actions, list):
-            actions = [actions]
-        
-        # 顺序执行多个动作
-        overall_success = True
-        result = None
-        
-        for action in actions:
-            try:
-                print(f"执行动作: {action}")
-                
-                # 执行动作
-                response = requests.post(
-                    f"{self.mc_api}/bot/action",
-                    json=action,
-                    timeout=30  # 增加超时时间到30秒
-                )
-                
-                # 处理响应
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    # 记录到内存中
-                    self.memory.add_memory(
-                        action=action,
-                        result=result.get("actionResult", "unknown"),
-                        state=result
-                    )
-                    
-                    # 检查动作结果
-                    action_result = result.get("actionResult", "")
-                    if "error" in action_result.lower() or "失败" in action_result:
-                        print(f"动作执行失败: {action_result}")
-                        overall_success = False
-                        break
-                    
-                    # 如果是长时间动作，适当延迟
-                    if action["type"] in ["move", "collect", "dig"]:
-                        time.sleep(self.delay)  # 使用配置的延迟
-                else:
-                    print(f"API请求错误: {response.status_code}, {response.text}")
-                    overall_success = False
-                    break
-                
-            except requests.exceptions.Timeout:
-                print(f"执行动作超时，可能任务仍在进行中")
-                # 对于可能是长时间运行任务的，我们不视为失败
-                if action["type"] in ["move", "collect", "dig"]:
-                    time.sleep(self.delay * 2)  # 给予更长的等待时间
-                    continue
-                else:
-                    overall_success = False
-                    break
-            except Exception as e:
-                print(f"执行动作时出错: {e}")
-                overall_success = False
-                break
-        
-        # 如果使用视觉学习，处理当前帧
-        if self.use_vision and current_frame is not None and result is not None:
-            last_action = actions[-1] if actions else None
-            self.vision_learning.learn_from_frame(current_frame, state.get('state', {}), last_action, result)
-        
-        return overall_success
-    
     def run(self, steps=None, delay=None):
         """运行AI代理"""
         steps = steps or self.ai_config.get('steps', 100)
@@ -1092,15 +1185,31 @@ class MinecraftAgent:
                     # Add a longer delay after a failure to allow recovery?
                     time.sleep(delay * 1.5)
                 else:
-                time.sleep(delay)
+                    time.sleep(delay)
                 
         except KeyboardInterrupt:
             self.logger.info("User interrupt detected, stopping AI agent.")
         except Exception as e:
             self.logger.critical(_("log_ai_error", error=f"CRITICAL RUNTIME ERROR: {e}"))
         finally:
+            self.close()
             self.logger.info("Minecraft AI Agent stopped.")
             
+    def close(self):
+        """保存学习数据并停止本地模型推理进程 (重复调用无效果)"""
+        if self.closed:
+            return
+        self.closed = True
+        self.pattern_recognition.save()
+        if self.learning:
+            self.learning.save_learning()
+        if getattr(self, 'frame_prefetcher', None):
+            self.frame_prefetcher.stop()
+        if getattr(self, 'vision_learning', None):
+            self.vision_learning.close()
+        if isinstance(getattr(self, 'local_model', None), LLMWorkerClient):
+            self.local_model.close()
+
     def set_task(self, task_key):
         """设置当前任务"""
         if task_key in TASKS:
@@ -1343,15 +1452,14 @@ class MinecraftAgent:
                 if hasattr(self, 'vision_system') and self.vision_system is not None:
                     # 强制垃圾回收
                     gc.collect()
-                    if torch.cuda.is_available():
-                        torch.cuda.empty_cache()
+                    _empty_cuda_cache()
                     
                     # 获取视觉帧 - 超时保护
                     self.log("尝试获取视觉数据...")
                     frame = None
                     try:
                         frame_future = concurrent.futures.ThreadPoolExecutor().submit(
-                            self.vision_system.get_frame_from_bot
+                            self.vision_capture.get_latest_frame
                         )
                         frame = frame_future.result(timeout=5)  # 5秒超时
                     except concurrent.futures.TimeoutError:
@@ -1369,7 +1477,7 @@ class MinecraftAgent:
                                 frame = frame.resize((112, 112), Image.LANCZOS)  # 减小到1/4大小
                             
                             # 安全提取特征
-                            if self.vision_system.model is not None:
+                            if self.vision_system.feature_extractor is not None:
                                 features_future = concurrent.futures.ThreadPoolExecutor().submit(
                                     self.vision_system.extract_features, frame
                                 )
@@ -1426,8 +1534,7 @@ class MinecraftAgent:
                     if memory_change > 100 * 1024 * 1024:  # 增长超过100MB
                         self.log("内存增长过大，强制清理")
                         gc.collect()
-                        if torch.cuda.is_available():
-                            torch.cuda.empty_cache()
+                        _empty_cuda_cache()
                 except Exception:
                     pass
                 
@@ -1611,11 +1718,16 @@ class MinecraftAgent:
 
          task_description = TASKS.get(self.current_task, "根据环境自主决定行动")
 
+         macro_text = ""
+         if self.use_macros and len(self.macros):
+             macro_text = "\n可用的宏 (一次执行多个动作，params 可覆盖默认参数):\n" + self.macros.describe()
+
          text_prompt = f"""
 当前任务：{self.current_task} - {task_description}
 
 {state_info}
 {memory_text}
+{macro_text}
 
 请根据当前状态、任务和视觉信息（如果提供），生成下一步行动。必须返回一个JSON对象。
 可用的动作类型有：move, collect, craft, place, dig, equip, attack, chat, look。
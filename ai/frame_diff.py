@@ -0,0 +1,98 @@
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+
+def _grayscale(image, size):
+    """缩小并转为灰度数组，JPEG 可在解码阶段直接按缩小尺寸解码"""
+    image.draft("L", (size[0] * 2, size[1] * 2))
+    small = image.convert("L").resize(size, Image.BILINEAR)
+    return np.asarray(small, dtype=np.float32)
+
+
+def dhash(image, hash_size=8):
+    """差值哈希：比较相邻像素的亮度，返回 hash_size*hash_size 位的布尔数组"""
+    pixels = _grayscale(image, (hash_size + 1, hash_size))
+    return (pixels[:, 1:] > pixels[:, :-1]).ravel()
+
+
+_DCT_MATRICES = {}
+
+
+def _dct_matrix(n):
+    """n 点 DCT-II 变换矩阵 (缓存)"""
+    if n not in _DCT_MATRICES:
+        k = np.arange(n)[:, None]
+        i = np.arange(n)[None, :]
+        _DCT_MATRICES[n] = np.cos(np.pi * (2 * i + 1) * k / (2 * n)).astype(np.float32)
+    return _DCT_MATRICES[n]
+
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    """感知哈希：取二维 DCT 的低频部分与其中位数比较"""
+    n = hash_size * highfreq_factor
+    pixels = _grayscale(image, (n, n))
+    matrix = _dct_matrix(n)
+    low = (matrix @ pixels @ matrix.T)[:hash_size, :hash_size]
+    return (low > np.median(low)).ravel()
+
+
+def hamming(a, b):
+    """两个哈希之间不同的位数"""
+    return int(np.count_nonzero(a != b))
+
+
+HASH_FUNCTIONS = {"dhash": dhash, "phash": phash}
+
+
+class FrameChangeDetector:
+    """帧变化检测：与上次发送给模型的帧比较感知哈希，画面变化足够大或间隔足够久时才需要重新发送"""
+
+    def __init__(self, method="dhash", hash_size=8, threshold=8, max_interval=10):
+        if method not in HASH_FUNCTIONS:
+            raise ValueError(f"未知的哈希方法: {method}")
+        self.method = method
+        self.hash_size = hash_size
+        self.threshold = threshold  # 汉明距离超过该值视为画面变化
+        self.max_interval = max_interval  # 最多连续跳过的步数
+        self.last_hash = None  # 上次发送的帧
+        self.pending_hash = None  # 最近一次检查的帧
+        self.steps_since_sent = 0
+        self.checks = 0
+        self.sent = 0
+
+    def hash(self, image):
+        return HASH_FUNCTIONS[self.method](image, self.hash_size)
+
+    def hash_bytes(self, data):
+        """由编码后的图像字节计算哈希"""
+        return self.hash(Image.open(BytesIO(data)))
+
+    def check(self, frame):
+        """检查一帧 (PIL 图像或编码字节)，返回 (是否需要发送, 与上次发送帧的距离)"""
+        self.pending_hash = self.hash_bytes(frame) if isinstance(frame, (bytes, bytearray)) else self.hash(frame)
+        self.checks += 1
+        self.steps_since_sent += 1
+        if self.last_hash is None:
+            return True, None
+        distance = hamming(self.pending_hash, self.last_hash)
+        return distance > self.threshold or self.steps_since_sent >= self.max_interval, distance
+
+    def mark_sent(self):
+        """最近一次检查的帧已发送给模型"""
+        if self.pending_hash is not None:
+            self.last_hash = self.pending_hash
+            self.steps_since_sent = 0
+            self.sent += 1
+
+    def reset(self):
+        self.last_hash = None
+        self.steps_since_sent = 0
+
+    def get_stats(self):
+        return {
+            "checks": self.checks,
+            "sent": self.sent,
+            "skipped": self.checks - self.sent,
+            "skip_rate": (self.checks - self.sent) / self.checks if self.checks else 0.0
+        }
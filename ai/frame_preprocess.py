@@ -0,0 +1,105 @@
+import logging
+from io import BytesIO
+from PIL import Image, features
+
+FORMAT_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+class FramePreprocessor:
+    """上传前的帧预处理：按预算选择分辨率，缩小到最长边不超过 max_edge 后重新编码为 JPEG/WebP
+
+    每步按字节预算从分辨率阶梯中挑选最大的可用尺寸，预测大小使用最近编码的每像素字节数。
+    """
+
+    def __init__(self, max_edge=768, min_edge=256, image_format="JPEG", quality=70,
+                 byte_budget=None, scale_step=0.75):
+        image_format = image_format.upper()
+        if image_format == "WEBP" and not features.check("webp"):
+            logging.getLogger("MinecraftAI.FramePreprocess").warning("WebP not supported by Pillow, using JPEG")
+            image_format = "JPEG"
+        if image_format not in FORMAT_MIME:
+            raise ValueError(f"不支持的图像格式: {image_format}")
+        self.max_edge = max_edge
+        self.min_edge = min_edge
+        self.image_format = image_format
+        self.quality = quality
+        self.byte_budget = byte_budget  # 每帧的目标字节数，None 表示只按 max_edge 缩放
+        self.edges = self._edge_ladder(max_edge, min_edge, scale_step)
+        self.bytes_per_pixel = None  # 最近一次编码的每像素字节数 (指数平均)
+        self.stats = {"frames": 0, "bytes_in": 0, "bytes_out": 0, "last_edge": None}
+
+    @staticmethod
+    def _edge_ladder(max_edge, min_edge, scale_step):
+        edges = [max_edge]
+        while edges[-1] * scale_step >= min_edge:
+            edges.append(int(edges[-1] * scale_step))
+        return edges
+
+    @staticmethod
+    def _fit(size, edge):
+        width, height = size
+        scale = min(1.0, edge / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def choose_edge(self, size, budget=None):
+        """按字节预算选择本帧的最长边"""
+        budget = budget if budget is not None else self.byte_budget
+        if not budget or self.bytes_per_pixel is None:
+            return self.edges[0]
+        for edge in self.edges:
+            width, height = self._fit(size, edge)
+            if width * height * self.bytes_per_pixel <= budget:
+                return edge
+        return self.edges[-1]
+
+    def _encode(self, image, size):
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+        buffer = BytesIO()
+        options = {"quality": self.quality}
+        if self.image_format == "JPEG":
+            options["optimize"] = True
+        else:
+            options["method"] = 4
+        image.save(buffer, format=self.image_format, **options)
+        return buffer.getvalue()
+
+    def process(self, data, mime="image/png", budget=None):
+        """处理一帧编码后的图像，返回 (字节, MIME类型)"""
+        image = Image.open(BytesIO(data))
+        original_size = image.size
+        edge = self.choose_edge(original_size, budget)
+        size = self._fit(original_size, edge)
+        if image.format == "JPEG":
+            image.draft("RGB", size)  # JPEG 直接按缩小后的尺寸解码
+        image = image.convert("RGB")
+        output = self._encode(image, size)
+
+        # 超出预算时再降一级分辨率
+        budget = budget if budget is not None else self.byte_budget
+        index = self.edges.index(edge)
+        while budget and len(output) > budget and index + 1 < len(self.edges):
+            index += 1
+            edge = self.edges[index]
+            size = self._fit(original_size, edge)
+            output = self._encode(image, size)
+
+        bpp = len(output) / (size[0] * size[1])
+        self.bytes_per_pixel = bpp if self.bytes_per_pixel is None else 0.7 * self.bytes_per_pixel + 0.3 * bpp
+
+        out_mime = FORMAT_MIME[self.image_format]
+        if len(output) >= len(data) and max(original_size) <= edge:
+            output, out_mime = data, mime  # 原图已经足够小
+        self.stats["frames"] += 1
+        self.stats["bytes_in"] += len(data)
+        self.stats["bytes_out"] += len(output)
+        self.stats["last_edge"] = edge
+        return output, out_mime
+
+    def get_stats(self):
+        bytes_in, bytes_out = self.stats["bytes_in"], self.stats["bytes_out"]
+        return {
+            **self.stats,
+            "bytes_saved": bytes_in - bytes_out,
+            "ratio": bytes_in / bytes_out if bytes_out else 0.0
+        }
@@ -2,17 +2,29 @@ import os
 import json
 import time
 import random
+import hashlib
 from collections import defaultdict
 
 class LearningSystem:
     """AI学习系统，使AI能够从经验中学习和改进"""
     
-    def __init__(self, learning_file="learning.json"):
+    def __init__(self, learning_file="learning.json", exploration_rate=0.1,
+                 confidence_threshold=0.9, min_samples=5, min_success_rate=0.6, save_interval=10):
         self.learning_file = learning_file
+        self.save_interval = save_interval  # 每记录多少次动作结果保存一次
+        self.unsaved_outcomes = 0
         self.action_outcomes = defaultdict(list)  # 记录动作结果
         self.successful_strategies = []  # 成功的策略
         self.failed_strategies = []  # 失败的策略
         self.task_knowledge = {}  # 任务相关知识
+        self.context_arms = defaultdict(set)  # 上下文 -> 出现过的动作类型
+
+        # 多臂老虎机参数
+        self.exploration_rate = exploration_rate  # 强制交给LLM探索的概率
+        self.confidence_threshold = confidence_threshold  # 最优动作胜出概率阈值
+        self.min_samples = min_samples  # 直接决策所需的最少样本数
+        self.min_success_rate = min_success_rate  # 直接决策所需的最低成功率
+        self.bandit_draws = 200  # Thompson采样次数
         self.load_learning()
     
     def load_learning(self):
@@ -25,11 +37,35 @@ class LearningSystem:
                     self.successful_strategies = data.get("successful_strategies", [])
                     self.failed_strategies = data.get("failed_strategies", [])
                     self.task_knowledge = data.get("task_knowledge", {})
+                self._rebuild_context_index()
             except Exception as e:
                 print(f"加载学习数据失败: {e}")
+
+    def _rebuild_context_index(self):
+        """根据动作结果重建上下文索引"""
+        self.context_arms = defaultdict(set)
+        for key in self.action_outcomes:
+            action_type, _, context_key = key.rpartition("_")
+            if action_type:
+                self.context_arms[context_key].add(action_type)
+
+    def _simplify_context(self, context):
+        """简化上下文，只保留关键信息"""
+        return {
+            "nearby_blocks": [block["name"] for block in context.get("nearbyBlocks", [])[:5]],
+            "inventory_has": [item["name"] for item in context.get("inventory", [])],
+            "health": context.get("health"),
+            "food": context.get("food")
+        }
+
+    def _context_key(self, context):
+        """生成稳定的上下文键 (内置hash在进程间不稳定，无法持久化)"""
+        data = json.dumps(self._simplify_context(context), sort_keys=True)
+        return hashlib.md5(data.encode()).hexdigest()
     
     def save_learning(self):
         """保存学习数据"""
+        self.unsaved_outcomes = 0
         try:
             with open(self.learning_file, "w") as f:
                 json.dump({
@@ -41,26 +77,25 @@ class LearningSystem:
         except Exception as e:
             print(f"保存学习数据失败: {e}")
     
-    def record_action_outcome(self, action_type, context, result):
+    def record_action_outcome(self, action_type, context, result, action=None):
         """记录动作结果"""
-        # 简化上下文，只保留关键信息
-        simplified_context = {
-            "nearby_blocks": [block["name"] for block in context.get("nearbyBlocks", [])[:5]],
-            "inventory_has": [item["name"] for item in context.get("inventory", [])],
-            "health": context.get("health"),
-            "food": context.get("food")
-        }
+        context_key = self._context_key(context)
         
-        # 记录结果
-        key = f"{action_type}_{hash(json.dumps(simplified_context))}"
-        self.action_outcomes[key].append({
+        # 记录结果 (保存完整动作，以便老虎机模式直接复用)
+        key = f"{action_type}_{context_key}"
+        outcome = {
             "result": result,
             "success": "success" in result.lower(),
             "timestamp": time.time()
-        })
+        }
+        if action is not None:
+            outcome["action"] = action
+        self.action_outcomes[key].append(outcome)
+        self.context_arms[context_key].add(action_type)
         
         # 定期保存
-        if random.random() < 0.1:  # 10%概率保存
+        self.unsaved_outcomes += 1
+        if self.unsaved_outcomes >= self.save_interval:
             self.save_learning()
     
     def learn_from_sequence(self, action_sequence, overall_result):
@@ -106,14 +141,7 @@ class LearningSystem:
             return success_count / len(all_outcomes)
         else:
             # 获取特定上下文下的成功率
-            simplified_context = {
-                "nearby_blocks": [block["name"] for block in context.get("nearbyBlocks", [])[:5]],
-                "inventory_has": [item["name"] for item in context.get("inventory", [])],
-                "health": context.get("health"),
-                "food": context.get("food")
-            }
-            
-            key = f"{action_type}_{hash(json.dumps(simplified_context))}"
+            key = f"{action_type}_{self._context_key(context)}"
             outcomes = self.action_outcomes.get(key, [])
             
             if not outcomes:
@@ -122,6 +150,61 @@ class LearningSystem:
             success_count = sum(1 for outcome in outcomes if outcome["success"])
             return success_count / len(outcomes)
     
+    def get_context_arms(self, context):
+        """获取上下文下各动作类型的成功/失败次数"""
+        context_key = self._context_key(context)
+        arms = {}
+        for action_type in self.context_arms.get(context_key, ()):
+            outcomes = self.action_outcomes.get(f"{action_type}_{context_key}", [])
+            successes = sum(1 for outcome in outcomes if outcome["success"])
+            arms[action_type] = {
+                "successes": successes,
+                "failures": len(outcomes) - successes,
+                "outcomes": outcomes
+            }
+        return arms
+    
+    def select_action(self, context):
+        """
+        上下文老虎机决策 (Thompson采样)。
+        当某个动作在当前上下文中明显占优时直接返回该动作，否则返回None交给LLM决策。
+        """
+        # 按探索率把决策让给LLM，保证新动作仍有机会被尝试
+        if random.random() < self.exploration_rate:
+            return None
+        
+        arms = self.get_context_arms(context)
+        if not arms:
+            return None
+        
+        # 从每个动作的Beta后验中采样，统计各动作胜出的次数
+        wins = dict.fromkeys(arms, 0)
+        for _ in range(self.bandit_draws):
+            best_type = max(arms, key=lambda a: random.betavariate(
+                1 + arms[a]["successes"], 1 + arms[a]["failures"]))
+            wins[best_type] += 1
+        
+        best_type = max(wins, key=wins.get)
+        best = arms[best_type]
+        support = best["successes"] + best["failures"]
+        confidence = wins[best_type] / self.bandit_draws
+        success_rate = (1 + best["successes"]) / (2 + support)  # 后验均值
+        
+        if (support < self.min_samples or confidence < self.confidence_threshold
+                or success_rate < self.min_success_rate):
+            return None
+        
+        # 复用该动作最近一次成功时的完整参数
+        for outcome in reversed(best["outcomes"]):
+            if outcome["success"] and outcome.get("action"):
+                return {
+                    "action": outcome["action"],
+                    "confidence": confidence,
+                    "success_rate": success_rate,
+                    "support": support
+                }
+        return None
+    
     def get_successful_strategy(self, task):
         """获取成功的策略"""
         # 过滤与任务相关的成功策略
@@ -0,0 +1,265 @@
+import json
+import queue
+import threading
+import time
+import multiprocessing
+from concurrent.futures import Future
+
+
+def _worker_main(conn, llm_kwargs):
+    """推理子进程：持有模型，按顺序处理管道中的请求"""
+    try:
+        from .local_llm import LocalLLM
+        llm = LocalLLM(**dict(llm_kwargs, background=False))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        conn.close()
+        return
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+        method, args, kwargs = request
+        try:
+            if method == "ping":
+                result = "pong"
+            elif method in ("chat", "chat_batch", "set_macro_names"):
+                result = getattr(llm, method)(*args, **kwargs)
+            else:
+                raise ValueError(f"未知的请求: {method}")
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class LLMWorkerClient:
+    """在独立进程中运行 LocalLLM，接口与 LocalLLM 相同 (chat / ready / is_ready / failed)
+
+    请求经队列依次通过管道发送给子进程；batch_wait 秒内到达、采样参数相同的并发 chat 请求
+    合并为一次 chat_batch 共享前向计算。空闲时定期 ping 做健康检查，
+    子进程崩溃 (如内存不足) 或超时未响应时自动重启。
+    """
+
+    def __init__(self, llm_kwargs=None, request_timeout=300, load_timeout=1800,
+                 health_interval=15, max_restarts=5, max_batch_size=8, batch_wait=0.05):
+        self.llm_kwargs = llm_kwargs or {}
+        self.request_timeout = request_timeout
+        self.load_timeout = load_timeout
+        self.health_interval = health_interval
+        self.max_restarts = max_restarts
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait  # 凑批最多等待的秒数
+        self.batches = 0
+        self.batched_requests = 0
+        self.context = multiprocessing.get_context("spawn")  # 子进程不继承Qt/CUDA状态
+        self.process = None
+        self.conn = None
+        self.ready = Future()
+        self.restarts = 0
+        self.requests = queue.Queue()
+        self.pending = []  # 凑批时取出但不能并入当前批的请求，下一轮优先处理
+        self.closed = False
+        self.last_activity = time.time()
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+        self.health_thread = threading.Thread(target=self._health_check, daemon=True)
+        self.health_thread.start()
+
+    def is_ready(self):
+        """子进程中的模型是否可用 (子进程已退出时为 False)"""
+        process = self.process
+        return (self.ready.done() and self.ready.exception() is None
+                and process is not None and process.is_alive())
+
+    def failed(self):
+        """重启次数用尽后视为失败"""
+        return self.ready.done() and self.ready.exception() is not None
+
+    def _start(self):
+        """启动子进程并等待模型加载完成"""
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=_worker_main, args=(child_conn, self.llm_kwargs), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        if not parent_conn.poll(self.load_timeout):
+            raise TimeoutError("推理进程加载模型超时")
+        try:
+            status, detail = parent_conn.recv()
+        except EOFError:
+            raise RuntimeError(f"推理进程意外退出 (exitcode {self.process.exitcode})")
+        if status != "ready":
+            raise RuntimeError(f"推理进程加载模型失败: {detail}")
+
+    def _stop(self):
+        if self.conn is not None:
+            try:
+                self.conn.send(None)
+            except (OSError, EOFError, BrokenPipeError):
+                pass
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+            self.process = None
+
+    def _ensure_started(self):
+        """(重新) 启动子进程，失败时按指数退避重试，重启次数用尽后把 ready 设为异常"""
+        while self.process is None or not self.process.is_alive():
+            if self.ready.done() and not self.failed():
+                self.ready = Future()  # 重启期间 is_ready() 为 False，调用方可改用API/缓存
+            self._stop()
+            try:
+                self._start()
+                print(f"推理进程已启动 (pid {self.process.pid})")
+                self.ready.set_result(True)
+                return True
+            except Exception as e:
+                print(f"推理进程启动失败: {e}")
+                self._stop()
+                self.restarts += 1
+                if self.restarts > self.max_restarts:
+                    if not self.ready.done():
+                        self.ready.set_exception(e)
+                    return False
+                time.sleep(min(2 ** self.restarts, 60))
+        return True
+
+    def _call(self, method, args, kwargs, timeout):
+        """在调度线程中发送请求并等待结果；子进程无响应时重启"""
+        try:
+            if self.process is None or not self.process.is_alive():
+                raise EOFError(f"推理进程已退出 (exitcode {getattr(self.process, 'exitcode', None)})")
+            self.conn.send((method, args, kwargs))
+            if not self.conn.poll(timeout):
+                raise TimeoutError(f"推理进程 {timeout}s 内没有响应")
+            status, result = self.conn.recv()
+        except (OSError, EOFError, BrokenPipeError, TimeoutError) as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"推理进程异常，正在重启: {error}")
+            self.restarts += 1
+            self._stop()
+            raise RuntimeError(f"推理进程异常: {error}")
+        self.restarts = 0  # 子进程正常响应，重置重启计数
+        if status != "ok":
+            raise RuntimeError(result)
+        return result
+
+    def _dispatch(self):
+        while not self.closed:
+            if not self._ensure_started():
+                # 无法启动：之后的请求全部失败
+                while True:
+                    item = self.requests.get()
+                    if item is None:
+                        return
+                    item[3].set_exception(self.ready.exception())
+            item = self.pending.pop(0) if self.pending else self.requests.get()
+            if item is None:
+                break
+            method, args, kwargs, future, timeout = item
+            if method == "restart":
+                future.set_result(None)  # 回到循环开头由 _ensure_started 重启子进程
+                continue
+            if method == "chat" and self.max_batch_size > 1:
+                batch = self._collect(item)
+                if len(batch) > 1:
+                    self._call_batch(batch)
+                    self.last_activity = time.time()
+                    continue
+            try:
+                future.set_result(self._call(method, args, kwargs, timeout))
+            except Exception as e:
+                future.set_exception(e)
+            self.last_activity = time.time()
+        self._stop()
+
+    def _collect(self, first):
+        """以第一个 chat 请求为起点，在 batch_wait 内收集采样参数相同的 chat 请求"""
+        batch = [first]
+        deadline = time.time() + self.batch_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self.requests.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if item is None or item[0] != "chat" or item[2] != first[2]:
+                self.pending.append(item)  # 先处理完这一批
+                break
+            batch.append(item)
+        return batch
+
+    def _call_batch(self, batch):
+        """把一批 chat 请求作为一次 chat_batch 发送给子进程，按顺序把回复分发给各请求"""
+        messages_list = [args[0] for _, args, _, _, _ in batch]
+        kwargs = batch[0][2]
+        timeout = max(item[4] for item in batch)
+        try:
+            responses = self._call("chat_batch", (messages_list,), kwargs, timeout)
+        except Exception as e:
+            for item in batch:
+                item[3].set_exception(e)
+            return
+        self.batches += 1
+        self.batched_requests += len(batch)
+        for item, response in zip(batch, responses):
+            item[3].set_result(response)
+
+    def _health_check(self):
+        """空闲时定期 ping 子进程；子进程已退出时立即清除就绪状态并重启"""
+        while not self.closed:
+            time.sleep(self.health_interval)
+            if (self.closed or not self.ready.done() or self.failed()
+                    or not self.requests.empty() or self.pending):
+                continue
+            process = self.process
+            if process is not None and not process.is_alive():
+                print(f"推理进程已退出 (exitcode {process.exitcode})，正在重启")
+                self.ready = Future()
+                self._submit("restart", (), {})
+                continue
+            if time.time() - self.last_activity < self.health_interval:
+                continue
+            try:
+                self._submit("ping", (), {}, timeout=min(30, self.request_timeout)).result()
+            except Exception as e:
+                print(f"推理进程健康检查失败: {e}")
+
+    def _submit(self, method, args, kwargs, timeout=None):
+        future = Future()
+        self.requests.put((method, args, kwargs, future, timeout or self.request_timeout))
+        return future
+
+    def chat(self, messages, temperature=0.7, max_tokens=2048, constrained=None):
+        """与 LocalLLM.chat 相同的接口"""
+        try:
+            return self._submit("chat", (messages,), {"temperature": temperature, "max_tokens": max_tokens,
+                                                      "constrained": constrained}).result()
+        except Exception as e:
+            print(f"本地模型推理错误: {e}")
+            return json.dumps({"type": "chat", "message": f"发生错误: {e}"}, ensure_ascii=False)
+
+    def chat_batch(self, messages_list, temperature=0.7, max_tokens=2048, constrained=None):
+        """与 LocalLLM.chat_batch 相同的接口"""
+        return self._submit("chat_batch", (messages_list,), {"temperature": temperature, "max_tokens": max_tokens,
+                                                             "constrained": constrained}).result()
+
+    def set_macro_names(self, macro_names):
+        """与 LocalLLM.set_macro_names 相同的接口；重启后的子进程也使用最新的宏库"""
+        self.llm_kwargs = dict(self.llm_kwargs, macro_names=sorted(macro_names))
+        self._submit("set_macro_names", (sorted(macro_names),), {})
+
+    def close(self):
+        """停止调度线程和推理进程"""
+        self.closed = True
+        self.requests.put(None)
+        self.dispatcher.join(timeout=10)
@@ -1,110 +1,510 @@
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import (AutoModelForCausalLM, AutoTokenizer, DynamicCache, LogitsProcessor, LogitsProcessorList,
+                          StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer)
+from .action_schema import ActionGrammar, build_schema
+
+
+class JsonScanner:
+    """增量扫描文本，检测第一个完整 (括号平衡) 的顶层JSON对象或数组"""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.done = False
+
+    def feed(self, text):
+        """输入新文本，返回是否已经出现完整的JSON值"""
+        for ch in text:
+            if self.done:
+                break
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]" and self.depth > 0:
+                self.depth -= 1
+                self.done = self.depth == 0
+            elif ch == '"' and self.depth > 0:
+                self.in_string = True
+        return self.done
+
+
+class JsonStoppingCriteria(StoppingCriteria):
+    """生成出完整的顶层JSON值后立即停止生成"""
+
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.scanners = []
+        self.scanned = 0  # 已扫描的新token数
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if not self.scanners:
+            self.scanners = [JsonScanner() for _ in range(input_ids.shape[0])]
+        start = self.prompt_length + self.scanned
+        self.scanned = input_ids.shape[-1] - self.prompt_length
+        # 结构字符都是ASCII，逐段解码不会被多字节字符截断影响
+        done = [scanner.feed(self.tokenizer.decode(row[start:], skip_special_tokens=True))
+                for scanner, row in zip(self.scanners, input_ids)]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class ActionGrammarLogitsProcessor(LogitsProcessor):
+    """约束解码：只允许让输出保持为合法动作JSON前缀的token，动作闭合后强制结束"""
+
+    def __init__(self, tokenizer, prompt_length, token_texts=None, top_k=32, max_k=4096, schema=None):
+        self.tokenizer = tokenizer
+        self.schema = schema  # 动作表 (宏名限定为当前宏库)，None 时使用完整动作表
+        self.prompt_length = prompt_length
+        self.token_texts = token_texts if token_texts is not None else {}  # token id -> 文本
+        self.top_k = top_k
+        self.max_k = max_k
+        self.eos_token_id = tokenizer.eos_token_id
+        self.grammars = []
+        self.scanned = 0
+
+    def _text(self, token_id):
+        text = self.token_texts.get(token_id)
+        if text is None:
+            text = self.tokenizer.decode([token_id], skip_special_tokens=True)
+            self.token_texts[token_id] = text
+        return text
+
+    def _allowed(self, grammar, row_scores):
+        """从得分最高的候选开始检查，找不到合法token时逐步扩大范围"""
+        k = self.top_k
+        while True:
+            k = min(k, row_scores.shape[-1])
+            candidates = torch.topk(row_scores, k).indices.tolist()
+            allowed = [t for t in candidates
+                       if t != self.eos_token_id and self._text(t) and grammar.copy().feed_text(self._text(t))]
+            if allowed or k >= min(self.max_k, row_scores.shape[-1]):
+                return allowed
+            k *= 4
+
+    def greedy(self, grammar, row_scores):
+        """贪心解码：语法允许的得分最高的token，动作闭合后为 eos；没有合法token时返回 None (不约束)"""
+        if grammar.done:
+            return self.eos_token_id
+        allowed = self._allowed(grammar, row_scores)  # topk 按得分降序，第一个即最优
+        return allowed[0] if allowed else None
+
+    def __call__(self, input_ids, scores):
+        if not self.grammars:
+            self.grammars = [ActionGrammar(self.schema) for _ in range(input_ids.shape[0])]
+        start = self.prompt_length + self.scanned
+        self.scanned = input_ids.shape[-1] - self.prompt_length
+        mask = torch.full_like(scores, float("-inf"))
+        for b, row in enumerate(input_ids):
+            grammar = self.grammars[b]
+            for token_id in row[start:].tolist():
+                if grammar is not None and token_id != self.eos_token_id and not grammar.feed_text(self._text(token_id)):
+                    grammar = None  # 已经偏离语法 (无法约束时放开过)，之后不再约束
+            self.grammars[b] = grammar
+            if grammar is None:
+                mask[b] = 0
+            elif grammar.done:
+                mask[b, self.eos_token_id] = 0
+            else:
+                allowed = self._allowed(grammar, scores[b])
+                if allowed:
+                    mask[b, allowed] = 0
+                else:
+                    mask[b] = 0
+        return scores + mask
+
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful Minecraft AI agent. Answer in JSON format."
+
 
 class LocalLLM:
     """本地大语言模型"""
     
     def __init__(self, model_name="deepseek-ai/deepseek-coder-1.5b", 
-                 base_url="https://huggingface.co/deepseek-ai/deepseek-coder-1.5b"):
+                 base_url="https://huggingface.co/deepseek-ai/deepseek-coder-1.5b",
+                 use_prefix_cache=True, stop_at_json=True, background=False, warmup_system_prompt=None,
+                 quantize=False, num_threads=None, constrained=False, draft_model_name=None, draft_tokens=4,
+                 macro_names=None):
+        self.model_name = model_name
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         print(f"使用设备: {self.device}")
-        
-        # 加载模型和分词器
-        print("正在加载DeepSeek 1.5b模型...")
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            model_name, 
-            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-            device_map="auto",
-            trust_remote_code=True
-        )
-        print("DeepSeek模型加载完成")
+        # CPU推理模式：线性层动态int8量化 + 显式线程数
+        self.quantize = quantize and self.device == "cpu"
+        self.num_threads = num_threads
+        self.tokenizer = None
+        self.model = None
+        # 投机解码：小草稿模型 (需与主模型共用分词器) 一次提出 draft_tokens 个token
+        self.draft_model_name = draft_model_name
+        self.draft_model = None
+        self.draft_tokens = draft_tokens
+        self.speculative_stats = {"rounds": 0, "drafted": 0, "accepted": 0, "generated": 0}
+        self.generate_lock = threading.Lock()  # 同一时间只运行一次生成
         
         self.conversation_history = []
         self.max_history_length = 10
+        
+        # 系统提示词前缀的KV缓存 (前缀不变时跳过其预填充)
+        self.use_prefix_cache = use_prefix_cache
+        self.prefix_cache = None  # {"hash", "ids", "past"}
+        self.prefix_cache_hits = 0
+        self.prefix_cache_misses = 0
+        
+        # 生成出完整JSON后提前停止，生成时间取决于动作长度而不是 max_tokens
+        self.stop_at_json = stop_at_json
+        
+        # 按动作语法约束解码，保证输出可以通过动作校验
+        self.constrained = constrained
+        self.token_texts = {}  # 约束解码用的 token 文本缓存
+        self.action_schema = build_schema(macro_names)
+        
+        # 分词器带聊天模板时用模板构建提示词；稳定片段 (系统提示词) 的 token 缓存
+        self.use_chat_template = False
+        self.segment_ids = OrderedDict()  # 文本 -> token ids
+        self.max_segments = 64
+        
+        # 加载模型；background=True 时在后台线程加载并预热，通过 ready 查询是否就绪
+        self.warmup_system_prompt = warmup_system_prompt
+        self.ready = Future()
+        if background:
+            threading.Thread(target=self._load_and_warm_up, daemon=True).start()
+        else:
+            self._load_and_warm_up()
+            self.ready.result()  # 同步加载失败时抛出异常
+    
+    def set_macro_names(self, macro_names):
+        """宏库变化后更新约束解码的动作表 (宏名只能取已有的宏)"""
+        self.action_schema = build_schema(macro_names)
+
+    def _load_model(self):
+        """加载模型和分词器"""
+        print("正在加载DeepSeek 1.5b模型...")
+        start_time = time.time()
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # 批量生成时左填充，保证每行的新token都从同一位置开始
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.use_chat_template = getattr(self.tokenizer, "chat_template", None) is not None
+        if self.device == "cpu":
+            torch.set_num_threads(self.num_threads or os.cpu_count() or 1)
+            print(f"CPU推理: {torch.get_num_threads()} 线程, int8量化: {self.quantize}")
+        self.model = self._load_causal_lm(self.model_name)
+        print(f"DeepSeek模型加载完成，用时 {time.time() - start_time:.1f}s, "
+              f"权重占用 {model_memory_bytes(self.model) / 1024 ** 2:.0f}MB")
+        if self.draft_model_name:
+            self.draft_model = self._load_causal_lm(self.draft_model_name)
+            print(f"草稿模型 {self.draft_model_name} 加载完成，"
+                  f"权重占用 {model_memory_bytes(self.draft_model) / 1024 ** 2:.0f}MB")
+    
+    def _load_causal_lm(self, name):
+        if self.device == "cuda":
+            model = AutoModelForCausalLM.from_pretrained(
+                name, 
+                torch_dtype=torch.float16,
+                device_map="auto",
+                trust_remote_code=True
+            )
+        else:
+            # CPU上不使用 device_map (accelerate 的分发钩子会拖慢逐token推理)
+            model = AutoModelForCausalLM.from_pretrained(
+                name,
+                torch_dtype=torch.float32,
+                low_cpu_mem_usage=True,
+                trust_remote_code=True
+            )
+            if self.quantize:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model.eval()
     
-    def chat(self, messages, temperature=0.7, max_tokens=2048):
-        """生成回复，处理结构化的消息列表"""
+    def _warm_up(self):
+        """生成几个token预热 (同时预先计算系统提示词前缀的KV缓存)"""
+        start_time = time.time()
+        messages = [{"role": "user", "content": "ping"}]
+        if self.warmup_system_prompt:
+            messages.insert(0, {"role": "system", "content": self.warmup_system_prompt})
+        prefix, prompt, _ = self._build_prompt(messages)
+        self._generate_with_fallback(prefix, prompt, temperature=0.7, max_tokens=4)
+        print(f"本地模型预热完成，用时 {time.time() - start_time:.1f}s")
+    
+    def _load_and_warm_up(self):
         try:
-            # 构建适合本地模型的文本提示词
-            full_prompt = "You are a helpful Minecraft AI agent. Answer in JSON format.\n\n"
-            text_input_for_history = ""
-
-            # 遍历消息列表，构建文本提示
-            for msg in messages:
-                role = msg['role']
-                content = msg['content']
-
-                if role == "system":
-                    full_prompt = f"{content}\n\n"
-                    continue # 系统消息不加入历史记录
-
-                prompt_line = ""
-                if role == "user":
-                    prompt_line += "User: "
-                    # 处理用户消息内容 (可能是列表)
-                    if isinstance(content, list):
-                        text_parts = []
-                        has_image = False
-                        for item in content:
-                            if item['type'] == 'text':
-                                text_parts.append(item['text'])
-                            elif item['type'] == 'image_url':
-                                has_image = True
-                        prompt_line += " ".join(text_parts)
-                        if has_image:
-                            prompt_line += "\n[Note: An image was provided with this message.]"
-                        text_input_for_history = prompt_line # Store user text for history
-                    else: # 如果 content 是字符串
-                        prompt_line += content
-                        text_input_for_history = prompt_line # Store user text for history
-
-                elif role == "assistant":
-                    prompt_line += f"Assistant: {content}"
-
-                full_prompt += prompt_line + "\n"
-
-            # 确保以 Assistant: 结尾，提示模型生成回复
-            if not full_prompt.endswith("Assistant: "):
-                 full_prompt += "Assistant: "
-
-            print("本地模型接收的提示词 (截断):", full_prompt[:500] + "...") # Debug log
-
-            # 编码
-            inputs = self.tokenizer(full_prompt, return_tensors="pt").to(self.device)
-
-            # 生成
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    inputs.input_ids,
-                    max_new_tokens=max_tokens,
-                    temperature=temperature,
-                    top_p=0.95,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id # Explicitly set pad_token_id
-                )
-
-            # 解码并提取助手回复
-            # 使用 [len(full_prompt):] 可能不准确，因为编码/解码可能改变长度
-            # 更好的方法是解码整个输出，然后找到助手的回复部分
-            full_decoded_output = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-
-            # 查找最后一个 "Assistant: " 之后的内容
-            last_assistant_marker = "Assistant:"
-            last_marker_index = full_decoded_output.rfind(last_assistant_marker)
-            if last_marker_index != -1:
-                assistant_response = full_decoded_output[last_marker_index + len(last_assistant_marker):].strip()
-            else:
-                # 如果找不到标记，可能生成有问题，尝试取最后一部分
-                assistant_response = full_decoded_output[len(full_prompt):].strip()
-                print("警告: 未在本地模型输出中找到 'Assistant:' 标记，提取可能不准确")
+            self._load_model()
+            self._warm_up()
+            self.ready.set_result(True)
+        except Exception as e:
+            print(f"本地模型加载失败: {e}")
+            self.ready.set_exception(e)
+    
+    def is_ready(self):
+        """模型是否已加载并预热完成"""
+        return self.ready.done() and self.ready.exception() is None
+    
+    def failed(self):
+        """模型是否加载失败"""
+        return self.ready.done() and self.ready.exception() is not None
+    
+    def _get_prefix_cache(self, prefix):
+        """返回前缀的 token 和 past_key_values，前缀内容变化时重新计算"""
+        prefix_hash = hashlib.md5(prefix.encode("utf-8")).hexdigest()
+        if self.prefix_cache is None or self.prefix_cache["hash"] != prefix_hash:
+            prefix_ids = self._segment_ids(prefix)
+            with torch.inference_mode():
+                past = self.model(prefix_ids, use_cache=True).past_key_values
+            self.prefix_cache = {"hash": prefix_hash, "ids": prefix_ids, "past": past}
+            self.prefix_cache_misses += 1
+        else:
+            self.prefix_cache_hits += 1
+        return self.prefix_cache["ids"], self.prefix_cache["past"]
+    
+    def _segment_ids(self, text):
+        """稳定片段的 token ids (LRU缓存)；聊天模板已包含特殊token，不再额外添加"""
+        ids = self.segment_ids.get(text)
+        if ids is None:
+            ids = self.tokenizer(text, return_tensors="pt",
+                                 add_special_tokens=not self.use_chat_template).input_ids.to(self.device)
+            self.segment_ids[text] = ids
+            if len(self.segment_ids) > self.max_segments:
+                self.segment_ids.popitem(last=False)
+        else:
+            self.segment_ids.move_to_end(text)
+        return ids
+    
+    def _encode(self, prefix, suffix):
+        """前缀与后缀分开编码；启用前缀缓存时返回 (input_ids, 前缀缓存副本)，否则 (input_ids, None)"""
+        suffix_ids = self.tokenizer(suffix, return_tensors="pt", add_special_tokens=False).input_ids.to(self.device)
+        if not prefix:
+            return suffix_ids, None
+        if self.use_prefix_cache:
+            prefix_ids, past = self._get_prefix_cache(prefix)
+            # generate 会原地扩展缓存，每次生成使用一份副本
+            return torch.cat([prefix_ids, suffix_ids], dim=-1), copy.deepcopy(past)
+        return torch.cat([self._segment_ids(prefix), suffix_ids], dim=-1), None
+    
+    def _generate(self, input_ids, past, temperature, max_tokens, streamer=None, constrained=False,
+                  attention_mask=None):
+        if self.draft_model is not None and streamer is None and attention_mask is None:
+            return self._speculative_generate(input_ids, past, max_tokens, constrained)
+        stopping_criteria = None
+        if self.stop_at_json:
+            stopping_criteria = StoppingCriteriaList([JsonStoppingCriteria(self.tokenizer, input_ids.shape[-1])])
+        logits_processor = None
+        if constrained:
+            logits_processor = LogitsProcessorList([
+                ActionGrammarLogitsProcessor(self.tokenizer, input_ids.shape[-1], self.token_texts,
+                                             schema=self.action_schema)
+            ])
+        with torch.inference_mode():
+            return self.model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids) if attention_mask is None else attention_mask,
+                past_key_values=past,
+                max_new_tokens=max_tokens,
+                temperature=temperature,
+                top_p=0.95,
+                do_sample=True,
+                stopping_criteria=stopping_criteria,
+                logits_processor=logits_processor,
+                streamer=streamer,
+                pad_token_id=self.tokenizer.eos_token_id # Explicitly set pad_token_id
+            )
+    
+    def _speculative_generate(self, input_ids, past, max_tokens, constrained=False):
+        """贪心投机解码：草稿模型逐个提出若干token，主模型一次前向验证，接受与主模型贪心结果一致的部分
+
+        输出与主模型贪心解码相同 (投机模式不采样)；两个缓存都回退到已确认的序列。
+        constrained=True 时草稿和验证都只在动作语法允许的token中取最优，输出与约束贪心解码相同。
+        """
+        eos = self.tokenizer.eos_token_id
+        prompt_len = input_ids.shape[-1]
+        seq = input_ids
+        if past is None:
+            main_past = DynamicCache()
+        elif isinstance(past, tuple):
+            main_past = DynamicCache.from_legacy_cache(past)
+        else:
+            main_past = past
+        draft_past = DynamicCache()
+        scanner = JsonScanner() if self.stop_at_json else None
+        stats = self.speculative_stats
+        processor, grammar = None, None
+        if constrained:
+            processor = ActionGrammarLogitsProcessor(self.tokenizer, prompt_len, self.token_texts,
+                                                     schema=self.action_schema)
+            grammar = ActionGrammar(self.action_schema)
+
+        def pick(row_logits, state):
+            """贪心取一个token，返回 (token, 输入该token后的语法状态)；语法为 None 时不约束"""
+            token = processor.greedy(state, row_logits) if state is not None else None
+            if token is None:
+                return int(row_logits.argmax()), None  # 无法约束时放开，之后不再约束
+            state = state.copy()
+            if token != eos:
+                state.feed_text(processor._text(token))
+            return token, state
+
+        while seq.shape[-1] - prompt_len < max_tokens:
+            k = min(self.draft_tokens, max_tokens - (seq.shape[-1] - prompt_len))
+            # 1. 草稿模型提出 k 个token
+            drafts = []
+            tokens = seq[:, draft_past.get_seq_length():]
+            draft_grammar = grammar
+            for _ in range(k):
+                logits = self.draft_model(tokens, past_key_values=draft_past, use_cache=True).logits
+                token, draft_grammar = pick(logits[0, -1], draft_grammar)
+                drafts.append(token)
+                tokens = torch.tensor([[token]], device=seq.device)
+                if token == eos:
+                    break
+
+            # 2. 主模型一次前向，得到每个草稿位置上的 (约束) 贪心预测
+            fed = torch.cat([seq[:, main_past.get_seq_length():], torch.tensor([drafts], device=seq.device)], dim=-1)
+            logits = self.model(fed, past_key_values=main_past, use_cache=True).logits[0, -(len(drafts) + 1):]
+            accepted = 0
+            token, next_grammar = pick(logits[0], grammar)
+            while accepted < len(drafts) and drafts[accepted] == token:
+                grammar = next_grammar
+                accepted += 1
+                token, next_grammar = pick(logits[accepted], grammar)
+            # 接受的草稿 + 主模型在第一个分歧处 (或全部接受后) 的token
+            grammar = next_grammar
+            new_list = drafts[:accepted] + [token]
+            new_tokens = torch.tensor([new_list], device=seq.device)
+
+            stats["rounds"] += 1
+            stats["drafted"] += len(drafts)
+            stats["accepted"] += accepted
+            stats["generated"] += new_tokens.shape[-1]
+
+            # 3. 缓存回退到已确认序列 (最后一个token尚未输入)
+            seq = torch.cat([seq, new_tokens], dim=-1)
+            main_past.crop(seq.shape[-1] - 1)
+            draft_past.crop(min(draft_past.get_seq_length(), seq.shape[-1] - 1))
+
+            if eos in new_list:
+                seq = seq[:, :seq.shape[-1] - len(new_list) + new_list.index(eos) + 1]
+                break
+            if grammar is not None and grammar.done:
+                break  # 动作已闭合
+            if scanner and scanner.feed(self.tokenizer.decode(new_list, skip_special_tokens=True)):
+                break
+        return seq[:, :prompt_len + max_tokens]
+    
+    def acceptance_rate(self):
+        """投机解码的草稿接受率"""
+        drafted = self.speculative_stats["drafted"]
+        return self.speculative_stats["accepted"] / drafted if drafted else 0.0
+    
+    def _generate_with_fallback(self, prefix, prompt, temperature, max_tokens, streamer=None, constrained=False):
+        """编码并生成，返回 (输出, 提示词长度)"""
+        with self.generate_lock, torch.inference_mode():
+            input_ids, past = self._encode(prefix, prompt)
+            try:
+                return self._generate(input_ids, past, temperature, max_tokens, streamer, constrained), input_ids.shape[-1]
+            except Exception as e:
+                if past is None:
+                    raise
+                # 旧版本 transformers 可能不支持传入缓存，退回完整编码
+                print(f"前缀KV缓存不可用，改为完整编码: {e}")
+                self.use_prefix_cache = False
+                input_ids, past = self._encode(prefix, prompt)
+                return self._generate(input_ids, past, temperature, max_tokens, streamer, constrained), input_ids.shape[-1]
+    
+    @staticmethod
+    def _message_text(content):
+        """消息内容 (可能是包含图像的列表) 转换为文本"""
+        if not isinstance(content, list):
+            return content
+        text_parts = []
+        has_image = False
+        for item in content:
+            if item['type'] == 'text':
+                text_parts.append(item['text'])
+            elif item['type'] == 'image_url':
+                has_image = True
+        text = " ".join(text_parts)
+        if has_image:
+            text += "\n[Note: An image was provided with this message.]"
+        return text
+
+    def _build_prompt(self, messages):
+        """把结构化消息列表转换为 (系统前缀, 对话提示词, 用于历史记录的用户文本)
+
+        系统消息合并为可缓存的前缀；分词器带聊天模板时使用模板，否则使用 User:/Assistant: 纯文本格式。
+        """
+        system_parts = []
+        conversation = []
+        text_input_for_history = ""
+        for msg in messages:
+            text = self._message_text(msg['content'])
+            if msg['role'] == "system":
+                system_parts.append(text) # 系统消息不加入历史记录
+                continue
+            conversation.append({"role": msg['role'], "content": text})
+            if msg['role'] == "user":
+                text_input_for_history = text # Store user text for history
+        system_text = "\n\n".join(system_parts) or DEFAULT_SYSTEM_PROMPT
+
+        if self.use_chat_template:
+            try:
+                system = [{"role": "system", "content": system_text}]
+                full_text = self.tokenizer.apply_chat_template(system + conversation, tokenize=False,
+                                                               add_generation_prompt=True)
+                prefix = self.tokenizer.apply_chat_template(system, tokenize=False)
+                if not full_text.startswith(prefix):
+                    prefix = ""  # 模板渲染的系统部分不是稳定前缀，不做前缀缓存
+                return prefix, full_text[len(prefix):], text_input_for_history
+            except Exception as e:
+                print(f"聊天模板不可用，改用纯文本提示词: {e}")
+                self.use_chat_template = False
+                self.segment_ids.clear()
+
+        prompt = ""
+        for msg in conversation:
+            marker = "User" if msg['role'] == "user" else "Assistant"
+            prompt += f"{marker}: {msg['content']}\n"
+        # 确保以 Assistant: 结尾，提示模型生成回复
+        prompt += "Assistant: "
+        return f"{system_text}\n\n", prompt, text_input_for_history
 
+    def _record_history(self, text_input_for_history, assistant_response):
+        if text_input_for_history: # Make sure we have user text to add
+            self.add_to_history("user", text_input_for_history.strip())
+        self.add_to_history("assistant", assistant_response)
+
+    def chat(self, messages, temperature=0.7, max_tokens=2048, constrained=None):
+        """生成回复，处理结构化的消息列表；constrained 为 None 时使用实例设置"""
+        try:
+            self.ready.result()  # 后台加载时等待模型就绪
+            prefix, prompt, text_input_for_history = self._build_prompt(messages)
+            print("本地模型接收的提示词 (截断):", (prefix + prompt)[:500] + "...") # Debug log
+
+            start_time = time.time()
+            constrained = self.constrained if constrained is None else constrained
+            outputs, input_len = self._generate_with_fallback(prefix, prompt, temperature, max_tokens,
+                                                              constrained=constrained)
+
+            # 只解码新生成的token
+            new_tokens = outputs[0][input_len:]
+            assistant_response = self.tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+            elapsed = time.time() - start_time
+            print(f"本地模型生成 {len(new_tokens)} 个token，用时 {elapsed:.2f}s") # Debug log
             print("本地模型原始响应 (截断):", assistant_response[:200] + "...") # Debug log
 
             # 记录对话历史 (使用提取的文本部分)
-            if text_input_for_history: # Make sure we have user text to add
-                 self.add_to_history("user", text_input_for_history.replace("User: ", "").strip()) # Remove marker
-            self.add_to_history("assistant", assistant_response)
+            self._record_history(text_input_for_history, assistant_response)
 
             return assistant_response
 
@@ -112,6 +512,61 @@ class LocalLLM:
             print(f"本地模型推理错误: {e}")
             return f"{{\"type\": \"chat\", \"message\": \"发生错误: {str(e)}\"}}"
     
+    def _chat_batch(self, messages_list, temperature, max_tokens, constrained):
+        """批量生成的实现，出错时抛出异常"""
+        self.ready.result()
+        constrained = self.constrained if constrained is None else constrained
+        texts = [prefix + prompt for prefix, prompt, _ in map(self._build_prompt, messages_list)]
+
+        start_time = time.time()
+        # 各请求的前缀未必相同，批量模式不使用前缀KV缓存
+        with self.generate_lock, torch.inference_mode():
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True,
+                                    add_special_tokens=not self.use_chat_template).to(self.device)
+            outputs = self._generate(inputs.input_ids, None, temperature, max_tokens,
+                                     constrained=constrained, attention_mask=inputs.attention_mask)
+        input_len = inputs.input_ids.shape[-1]
+        responses = [self.tokenizer.decode(row[input_len:], skip_special_tokens=True).strip() for row in outputs]
+        print(f"本地模型批量生成 {len(responses)} 个回复，用时 {time.time() - start_time:.2f}s") # Debug log
+        return responses
+
+    def chat_batch(self, messages_list, temperature=0.7, max_tokens=2048, constrained=None):
+        """批量生成：左填充后只调用一次 generate，按输入顺序返回回复 (不记录对话历史)"""
+        if not messages_list:
+            return []
+        try:
+            return self._chat_batch(messages_list, temperature, max_tokens, constrained)
+        except Exception as e:
+            print(f"本地模型批量推理错误: {e}")
+            return [f"{{\"type\": \"chat\", \"message\": \"发生错误: {str(e)}\"}}"] * len(messages_list)
+    
+    def chat_stream(self, messages, temperature=0.7, max_tokens=2048, constrained=None):
+        """流式生成回复，逐段产出新生成的文本；完整的JSON生成后即停止"""
+        self.ready.result()
+        prefix, prompt, text_input_for_history = self._build_prompt(messages)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def run():
+            try:
+                self._generate_with_fallback(prefix, prompt, temperature, max_tokens, streamer,
+                                             self.constrained if constrained is None else constrained)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        chunks = []
+        for chunk in streamer:
+            chunks.append(chunk)
+            yield chunk
+        thread.join()
+        if errors:
+            print(f"本地模型推理错误: {errors[0]}")
+            return
+        self._record_history(text_input_for_history, "".join(chunks).strip())
+    
     def add_to_history(self, role, content):
         """添加消息到历史记录"""
         self.conversation_history.append({"role": role, "content": content})
@@ -122,4 +577,116 @@ class LocalLLM:
     
     def clear_history(self):
         """清除对话历史"""
-        self.conversation_history = [] 
\ No newline at end of file
+        self.conversation_history = [] 
+    
+    def benchmark(self, question="附近有什么方块?", max_tokens=64, runs=3):
+        """测量生成速度 (tokens/s)，不提前停止"""
+        self.ready.result()
+        stop_at_json, self.stop_at_json = self.stop_at_json, False
+        try:
+            prefix, prompt, _ = self._build_prompt([{"role": "user", "content": question}])
+            self._generate_with_fallback(prefix, prompt, 0.7, 4)  # 预热
+            tokens, elapsed = 0, 0.0
+            for _ in range(runs):
+                start_time = time.time()
+                outputs, input_len = self._generate_with_fallback(prefix, prompt, 0.7, max_tokens)
+                elapsed += time.time() - start_time
+                tokens += outputs.shape[-1] - input_len
+        finally:
+            self.stop_at_json = stop_at_json
+        return {
+            "tokens_per_second": tokens / elapsed if elapsed else 0.0,
+            "ms_per_token": elapsed * 1000 / tokens if tokens else 0.0,
+            "memory_mb": model_memory_bytes(self.model) / 1024 ** 2
+        }
+    
+    def benchmark_speculative(self, question="附近有什么方块?", max_tokens=64, runs=3):
+        """对比普通生成与投机解码的速度，并报告草稿接受率"""
+        if self.draft_model_name is None:
+            raise ValueError("未设置草稿模型 (draft_model_name)")
+        self.ready.result()
+        draft_model = self.draft_model
+        try:
+            self.draft_model = None
+            baseline = self.benchmark(question, max_tokens, runs)
+        finally:
+            self.draft_model = draft_model
+        self.speculative_stats = {"rounds": 0, "drafted": 0, "accepted": 0, "generated": 0}
+        speculative = self.benchmark(question, max_tokens, runs)
+        rounds = self.speculative_stats["rounds"]
+        result = {
+            "baseline_tokens_per_second": baseline["tokens_per_second"],
+            "speculative_tokens_per_second": speculative["tokens_per_second"],
+            "speedup": speculative["tokens_per_second"] / baseline["tokens_per_second"]
+            if baseline["tokens_per_second"] else 0.0,
+            "acceptance_rate": self.acceptance_rate(),
+            "tokens_per_round": self.speculative_stats["generated"] / rounds if rounds else 0.0
+        }
+        print(f"投机解码: {result['speculative_tokens_per_second']:.2f} tokens/s "
+              f"(基线 {result['baseline_tokens_per_second']:.2f}), 加速 {result['speedup']:.2f}x, "
+              f"接受率 {result['acceptance_rate']:.0%}, 每轮 {result['tokens_per_round']:.2f} token")
+        return result
+    
+    def benchmark_batch(self, batch_sizes=(1, 4, 8), max_tokens=32):
+        """测量不同批大小下的吞吐量 (请求/秒)；生成出错时抛出异常，不把错误回复计入吞吐量"""
+        self.ready.result()
+        messages = [{"role": "user", "content": "附近有什么方块?"}]
+        stop_at_json, self.stop_at_json = self.stop_at_json, False
+        results = {}
+        try:
+            self._chat_batch([messages], 0.7, 4, False)  # 预热
+            for size in batch_sizes:
+                start_time = time.time()
+                responses = self._chat_batch([messages] * size, 0.7, max_tokens, False)
+                if len(responses) != size or not all(responses):
+                    raise RuntimeError(f"batch {size}: 只得到 {sum(map(bool, responses))}/{size} 个有效回复")
+                results[size] = size / (time.time() - start_time)
+                print(f"batch {size}: {results[size]:.2f} 请求/秒")
+        finally:
+            self.stop_at_json = stop_at_json
+        return results
+
+
+def model_memory_bytes(model):
+    """模型权重占用的字节数 (包括动态量化线性层打包的int8权重)"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    for module in model.modules():
+        packed = getattr(module, "_packed_params", None)
+        if hasattr(packed, "_weight_bias"):
+            tensors.extend(t for t in packed._weight_bias() if t is not None)
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def compare_cpu_modes(model_name="deepseek-ai/deepseek-coder-1.5b", num_threads=None, max_tokens=64, runs=3):
+    """对比CPU上的基线 (float32) 与 int8 量化推理"""
+    results = {}
+    for label, quantize in (("baseline", False), ("int8", True)):
+        llm = LocalLLM(model_name, quantize=quantize, num_threads=num_threads)
+        results[label] = llm.benchmark(max_tokens=max_tokens, runs=runs)
+        print(f"{label}: {results[label]['tokens_per_second']:.2f} tokens/s, "
+              f"{results[label]['ms_per_token']:.1f} ms/token, {results[label]['memory_mb']:.0f}MB")
+        del llm
+    baseline, quantized = results["baseline"], results["int8"]
+    if quantized["ms_per_token"]:
+        print(f"加速: {baseline['ms_per_token'] / quantized['ms_per_token']:.2f}x, "
+              f"内存: {quantized['memory_mb'] / baseline['memory_mb']:.0%}")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="LocalLLM CPU推理基准测试")
+    parser.add_argument("--model", default="deepseek-ai/deepseek-coder-1.5b")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--batch", action="store_true", help="测量批量生成的吞吐量")
+    parser.add_argument("--draft", default=None, help="投机解码的草稿模型 (与主模型共用分词器)")
+    args = parser.parse_args()
+    if args.draft:
+        LocalLLM(args.model, quantize=True, num_threads=args.threads,
+                 draft_model_name=args.draft).benchmark_speculative(max_tokens=args.tokens, runs=args.runs)
+    elif args.batch:
+        LocalLLM(args.model, quantize=True, num_threads=args.threads).benchmark_batch(max_tokens=args.tokens)
+    else:
+        compare_cpu_modes(args.model, args.threads, args.tokens, args.runs)
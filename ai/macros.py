@@ -0,0 +1,237 @@
+import os
+import json
+import logging
+import requests
+
+# 会被提取为宏参数的动作字段 (聊天内容等保持原样)
+PARAM_KEYS = ("blockType", "itemName", "target", "count", "radius", "x", "y", "z")
+
+
+class Macro:
+    """参数化宏：一串动作模板，执行时绑定参数"""
+
+    def __init__(self, name, steps, params=None, support=0, success_rate=0.0, source="", min_health=6):
+        self.name = name
+        self.steps = steps  # 动作模板，参数值写作 "{参数名}"
+        self.params = params or {}  # 参数名 -> 默认值
+        self.support = support
+        self.success_rate = success_rate
+        self.source = source
+        self.min_health = min_health  # 生命值低于该值时不继续执行
+
+    @classmethod
+    def from_actions(cls, name, actions, **kwargs):
+        """由一串具体动作生成宏，相同的取值共用同一个参数"""
+        params = {}
+        value_names = {}
+        steps = []
+        for action in actions:
+            step = {}
+            for key, value in action.items():
+                if key not in PARAM_KEYS:
+                    step[key] = value
+                    continue
+                value_key = (key, json.dumps(value))
+                if value_key not in value_names:
+                    used = sum(1 for p in params if p == key or p.startswith(key + "_"))
+                    param = key if not used else f"{key}_{used + 1}"
+                    value_names[value_key] = param
+                    params[param] = value
+                step[key] = "{" + value_names[value_key] + "}"
+            steps.append(step)
+        return cls(name, steps, params, **kwargs)
+
+    def bind(self, params=None):
+        """用参数 (缺省使用默认值) 生成具体动作列表"""
+        values = dict(self.params)
+        values.update(params or {})
+        actions = []
+        for step in self.steps:
+            action = {}
+            for key, value in step.items():
+                if isinstance(value, str) and value.startswith("{") and value.endswith("}") and value[1:-1] in values:
+                    action[key] = values[value[1:-1]]
+                else:
+                    action[key] = value
+            actions.append(action)
+        return actions
+
+    def check_preconditions(self, index, actions, state):
+        """检查第 index 步执行前的前置条件，返回 (是否满足, 原因)"""
+        if not state:
+            return False, "无法获取机器人状态"
+        health = state.get("health")
+        if isinstance(health, (int, float)) and health < self.min_health:
+            return False, f"生命值过低 ({health})"
+
+        action = actions[index]
+        action_type = action.get("type")
+        inventory = {item.get("name") for item in state.get("inventory", [])}
+        if action_type in ("equip", "placeBlock"):
+            item = action.get("itemName")
+            if item not in inventory:
+                return False, f"背包中没有 {item}"
+        elif action_type in ("attack", "jumpAttack"):
+            target = action.get("target")
+            nearby = {e.get("name") for e in state.get("nearbyEntities", [])}
+            if target not in nearby:
+                return False, f"附近没有 {target}"
+        return True, ""
+
+    def describe(self):
+        """用于提示词的简短描述"""
+        steps = " -> ".join(
+            step.get("type", "?") + "(" + ", ".join(f"{k}={v}" for k, v in step.items() if k != "type") + ")"
+            for step in self.steps
+        )
+        return (f'{{"type": "macro", "name": "{self.name}", "params": {json.dumps(self.params, ensure_ascii=False)}}}'
+                f" - {steps} (成功率 {self.success_rate * 100:.0f}%, 次数 {self.support})")
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "steps": self.steps,
+            "params": self.params,
+            "support": self.support,
+            "success_rate": self.success_rate,
+            "source": self.source,
+            "min_health": self.min_health
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class MacroLibrary:
+    """宏库：把高频成功的动作序列提升为参数化宏"""
+
+    def __init__(self, macro_file="macros.json", min_support=5, min_success_rate=0.8,
+                 min_length=2, max_macros=20):
+        self.macro_file = macro_file
+        self.min_support = min_support
+        self.min_success_rate = min_success_rate
+        self.min_length = min_length
+        self.max_macros = max_macros
+        self.macros = {}  # 名称 -> Macro
+        self.load()
+
+    def load(self):
+        """加载宏"""
+        if os.path.exists(self.macro_file):
+            try:
+                with open(self.macro_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.macros = {m["name"]: Macro.from_dict(m) for m in data.get("macros", [])}
+            except Exception as e:
+                print(f"加载宏失败: {e}")
+
+    def save(self):
+        """保存宏"""
+        try:
+            with open(self.macro_file, "w", encoding="utf-8") as f:
+                json.dump({"macros": [m.to_dict() for m in self.macros.values()]}, f,
+                          ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存宏失败: {e}")
+
+    def get(self, name):
+        return self.macros.get(name)
+
+    def __len__(self):
+        return len(self.macros)
+
+    def _promote(self, actions, support, success_rate, source):
+        """加入或更新一个宏"""
+        if len(actions) < self.min_length or support < self.min_support or success_rate < self.min_success_rate:
+            return
+        if not all(isinstance(action, dict) for action in actions):
+            return
+        if any(action.get("type") == "macro" for action in actions):
+            return  # 不嵌套宏
+        name = "_".join(action.get("type", "unknown") for action in actions)
+        existing = self.macros.get(name)
+        if existing and existing.support >= support and existing.success_rate >= success_rate:
+            return
+        self.macros[name] = Macro.from_actions(name, actions, support=support,
+                                               success_rate=success_rate, source=source)
+
+    def _trim(self):
+        """去掉被更长宏覆盖的子序列，只保留得分最高的 max_macros 个宏"""
+        types = {name: [step.get("type") for step in m.steps] for name, m in self.macros.items()}
+
+        def covered(name):
+            inner, n = types[name], len(types[name])
+            for other_name, outer in types.items():
+                if len(outer) > n and self.macros[other_name].support >= self.macros[name].support:
+                    if any(outer[i:i + n] == inner for i in range(len(outer) - n + 1)):
+                        return True
+            return False
+
+        self.macros = {name: m for name, m in self.macros.items() if not covered(name)}
+        if len(self.macros) > self.max_macros:
+            ranked = sorted(self.macros.values(), key=lambda m: (m.support * m.success_rate, len(m.steps)), reverse=True)
+            self.macros = {m.name: m for m in ranked[:self.max_macros]}
+
+    def promote_from_patterns(self, pattern_recognition):
+        """从模式识别挖掘出的频繁成功序列中提升宏"""
+        before = self._snapshot()
+        for sequence in pattern_recognition.get_frequent_sequences(
+                k=self.max_macros, min_length=self.min_length,
+                min_support=self.min_support, min_success_rate=self.min_success_rate):
+            self._promote(sequence["actions"], sequence["support"], sequence["success_rate"], "patterns")
+        return self._commit(before)
+
+    def _snapshot(self):
+        return {name: (m.support, m.success_rate) for name, m in self.macros.items()}
+
+    def _commit(self, before):
+        """整理宏库，有变化时保存，返回是否有变化"""
+        self._trim()
+        if self._snapshot() == before:
+            return False
+        self.save()
+        return True
+
+    def describe(self):
+        """提示词中的宏列表"""
+        return "\n".join(f"- {m.describe()}" for m in self.macros.values())
+
+
+class MacroExecutor:
+    """按顺序把宏展开为 /bot/action 调用，遇到前置条件不满足或动作失败立即中止"""
+
+    def __init__(self, mc_api, get_state, library):
+        self.mc_api = mc_api
+        self.get_state = get_state  # 返回机器人当前状态的函数
+        self.library = library
+        self.logger = logging.getLogger("MinecraftAI.Macros")
+
+    def execute(self, name, params=None):
+        """执行宏，返回汇总结果"""
+        macro = self.library.get(name)
+        if macro is None:
+            return {"success": False, "error": f"未知的宏: {name}"}
+
+        actions = macro.bind(params)
+        results = []
+        for index, action in enumerate(actions):
+            ok, reason = macro.check_preconditions(index, actions, self.get_state())
+            if not ok:
+                return {"success": False, "error": f"宏 {name} 第{index + 1}步前置条件不满足: {reason}",
+                        "completed": index, "results": results}
+            try:
+                response = requests.post(f"{self.mc_api}/bot/action", json=action, timeout=30)
+                if response.status_code == 200:
+                    result = response.json()
+                else:
+                    result = {"success": False, "error": f"Bot server error: {response.status_code} - {response.text}"}
+            except requests.exceptions.RequestException as e:
+                result = {"success": False, "error": f"Communication error with bot server: {e}"}
+            results.append(result)
+            self.logger.info(f"Macro {name} step {index + 1}/{len(actions)}: {action} -> {result}")
+            if not result.get("success"):
+                return {"success": False, "error": f"宏 {name} 第{index + 1}步失败: {result.get('error', 'unknown error')}",
+                        "completed": index, "results": results}
+
+        return {"success": True, "message": f"宏 {name} 执行完成", "completed": len(actions), "results": results}
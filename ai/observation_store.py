@@ -0,0 +1,347 @@
+import os
+import json
+import heapq
+import random
+from collections import deque
+from itertools import islice
+
+import numpy as np
+
+class StateFeatureMatrix:
+    """预分配的状态特征矩阵，状态只编码一次，相似度对所有已存状态一次性向量化计算"""
+
+    ARRAYS = ("positions", "vitals", "blocks", "block_counts", "inventory", "inventory_counts", "success")
+
+    def __init__(self, capacity=1024, vocab_capacity=64, max_capacity=None):
+        self.capacity = capacity if max_capacity is None else min(capacity, max_capacity)
+        self.max_capacity = max_capacity  # 行数上限 (None表示不限)
+        self.size = 0
+        self.block_vocab = {}  # 方块名称 -> 列
+        self.inventory_vocab = {}  # 物品名称 -> 列
+        self.vocab_names = {}  # 词表属性名 -> 按列号排列的名称 (词表只增不减，长度变化时重建)
+        self.positions = np.zeros((self.capacity, 3), dtype=np.float32)
+        self.vitals = np.zeros((self.capacity, 2), dtype=np.float32)  # 生命值, 饥饿值
+        self.blocks = np.zeros((self.capacity, vocab_capacity), dtype=np.uint8)  # 附近方块 multi-hot
+        self.block_counts = np.zeros(self.capacity, dtype=np.float32)  # 原始列表长度 (含重复)
+        self.inventory = np.zeros((self.capacity, vocab_capacity), dtype=np.uint8)  # 物品栏 multi-hot
+        self.inventory_counts = np.zeros(self.capacity, dtype=np.float32)
+        self.success = np.zeros(self.capacity, dtype=bool)
+
+    @staticmethod
+    def extract(state):
+        """提取与 encode_state 相同的关键特征"""
+        position = state.get("position") or {}
+        return (
+            [position.get("x", 0), position.get("y", 0), position.get("z", 0)],
+            [state.get("health", 0) or 0, state.get("food", 0) or 0],
+            [b.get("name", "") for b in state.get("nearbyBlocks", [])[:5]],
+            [i.get("name", "") for i in state.get("inventory", [])]
+        )
+
+    @property
+    def nbytes(self):
+        """特征数组已分配的字节数 (按容量)"""
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    @property
+    def used_nbytes(self):
+        """已使用的行占用的字节数"""
+        return sum(getattr(self, name)[:self.size].nbytes for name in self.ARRAYS)
+
+    def names(self, vocab_name):
+        """按列号排列的词表名称"""
+        vocab = getattr(self, vocab_name)
+        names = self.vocab_names.get(vocab_name)
+        if names is None or len(names) != len(vocab):
+            names = sorted(vocab, key=vocab.get)
+            self.vocab_names[vocab_name] = names
+        return names
+
+    def _grow_rows(self):
+        """行容量翻倍 (不超过上限)"""
+        self.capacity *= 2
+        if self.max_capacity is not None:
+            self.capacity = min(self.capacity, self.max_capacity)
+        for name in self.ARRAYS:
+            old = getattr(self, name)
+            new = np.zeros((self.capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _columns(self, names, vocab, matrix_name):
+        """把名称映射为列号，必要时扩充词表和矩阵列数"""
+        columns = []
+        for name in set(names):
+            if name not in vocab:
+                vocab[name] = len(vocab)
+                matrix = getattr(self, matrix_name)
+                if vocab[name] >= matrix.shape[1]:
+                    wider = np.zeros((matrix.shape[0], matrix.shape[1] * 2), dtype=matrix.dtype)
+                    wider[:, :matrix.shape[1]] = matrix
+                    setattr(self, matrix_name, wider)
+            columns.append(vocab[name])
+        return columns
+
+    def _query_columns(self, names, vocab):
+        """查询状态的列号 (不在词表中的名称不可能有交集，直接忽略)"""
+        return np.array([vocab[name] for name in set(names) if name in vocab], dtype=np.intp)
+
+    def set_row(self, row, state, success):
+        """写入一行特征"""
+        position, vitals, blocks, inventory = self.extract(state)
+        block_columns = self._columns(blocks, self.block_vocab, "blocks")
+        inventory_columns = self._columns(inventory, self.inventory_vocab, "inventory")
+        self.positions[row] = position
+        self.vitals[row] = vitals
+        self.blocks[row] = 0
+        self.blocks[row, block_columns] = 1
+        self.block_counts[row] = len(blocks)
+        self.inventory[row] = 0
+        self.inventory[row, inventory_columns] = 1
+        self.inventory_counts[row] = len(inventory)
+        self.success[row] = success
+
+    def write(self, row, state, success):
+        """写入指定行，必要时扩容"""
+        while row >= self.capacity:
+            if self.max_capacity is not None and self.capacity >= self.max_capacity:
+                raise IndexError(f"行号 {row} 超出特征矩阵上限 {self.max_capacity}")
+            self._grow_rows()
+        self.set_row(row, state, success)
+        self.size = max(self.size, row + 1)
+        return row
+
+    def append(self, state, success):
+        """追加一行，返回行号"""
+        return self.write(self.size, state, success)
+
+    def state_view(self, row):
+        """由特征还原出最小状态字典 (用于重建索引)"""
+        block_names = self.names("block_vocab")
+        item_names = self.names("inventory_vocab")
+        x, y, z = (float(c) for c in self.positions[row])
+        return {
+            "position": {"x": x, "y": y, "z": z},
+            "health": float(self.vitals[row, 0]),
+            "food": float(self.vitals[row, 1]),
+            "nearbyBlocks": [{"name": block_names[c]} for c in np.flatnonzero(self.blocks[row])],
+            "inventory": [{"name": item_names[c]} for c in np.flatnonzero(self.inventory[row])]
+        }
+
+    def similarity(self, state, rows=None):
+        """计算查询状态与所有 (或指定) 行的相似度"""
+        position, vitals, blocks, inventory = self.extract(state)
+        if rows is None:
+            rows = slice(0, self.size)
+        block_columns = self._query_columns(blocks, self.block_vocab)
+        inventory_columns = self._query_columns(inventory, self.inventory_vocab)
+
+        pos_sim = 1.0 / (1.0 + np.linalg.norm(self.positions[rows] - np.asarray(position, dtype=np.float32), axis=1))
+        vital_sim = 1.0 - np.abs(self.vitals[rows] - np.asarray(vitals, dtype=np.float32)) / 20.0
+        common_blocks = self.blocks[rows][:, block_columns].sum(axis=1, dtype=np.float32)
+        block_sim = common_blocks / np.maximum(self.block_counts[rows], max(len(blocks), 1))
+        common_items = self.inventory[rows][:, inventory_columns].sum(axis=1, dtype=np.float32)
+        inv_sim = common_items / np.maximum(self.inventory_counts[rows], max(len(inventory), 1))
+
+        return (0.3 * pos_sim + 0.1 * vital_sim[:, 0] + 0.1 * vital_sim[:, 1]
+                + 0.2 * block_sim + 0.3 * inv_sim)
+
+
+def is_success(result):
+    """动作结果是否成功：字典看 success 字段，字符串按智能体的约定只有 "success" 算成功"""
+    if isinstance(result, dict):
+        return bool(result.get("success"))
+    return isinstance(result, str) and result.strip().lower() == "success"
+
+
+class ObservationStore:
+    """
+    容量受限的观察存储：最近窗口 + 加权蓄水池采样。
+    滑出最近窗口的观察以加权蓄水池 (A-Res) 方式竞争长期保留位，成功的观察权重更高。
+    """
+
+    def __init__(self, capacity=20000, recency_size=5000, success_weight=4.0, max_bytes=None):
+        if not 0 < recency_size <= capacity:
+            raise ValueError("recency_size 必须在 1 到 capacity 之间")
+        self.capacity = capacity
+        self.recency_size = recency_size
+        self.success_weight = success_weight
+        self.max_bytes = max_bytes  # 字节上限 (None表示只按行数限制)
+        self.features = StateFeatureMatrix(capacity=min(1024, capacity), max_capacity=capacity)
+        self.actions = []  # 与特征矩阵行对齐
+        self.results = []
+        self.payload_bytes = []  # 每行动作/结果的序列化字节数
+        self.payload_total = 0
+        self.recency = deque()  # 最近窗口中的行，按时间排序
+        self.reservoir = []  # (权重键, 行) 最小堆
+        self.seen = 0  # 累计观察数
+
+    @property
+    def size(self):
+        return self.features.size
+
+    def __len__(self):
+        return self.features.size
+
+    def memory_bytes(self):
+        """已使用的行占用的字节数 (特征数组 + 动作/结果载荷)，不含预分配但未使用的容量"""
+        return self.features.used_nbytes + self.payload_total
+
+    def is_full(self):
+        """行数或字节数达到上限"""
+        if self.size >= self.capacity:
+            return True
+        return self.max_bytes is not None and self.size > 0 and self.memory_bytes() >= self.max_bytes
+
+    def _reservoir_key(self, row):
+        """A-Res 权重键 u^(1/w)，成功的观察更容易留下"""
+        weight = self.success_weight if self.features.success[row] else 1.0
+        return random.random() ** (1.0 / weight)
+
+    def _retire_oldest(self):
+        """把最近窗口中最旧的行移入蓄水池，返回被淘汰可复用的行 (没有则返回None)"""
+        row = self.recency.popleft()
+        key = self._reservoir_key(row)
+        reservoir_size = self.capacity - self.recency_size
+        if len(self.reservoir) < reservoir_size and not self.is_full():
+            heapq.heappush(self.reservoir, (key, row))
+            return None
+        if self.reservoir and key > self.reservoir[0][0]:
+            _, evicted = heapq.heapreplace(self.reservoir, (key, row))
+            return evicted
+        return row
+
+    def add(self, state, action, result):
+        """添加一条观察，返回 (写入的行, 是否覆盖了旧行)"""
+        self.seen += 1
+        success = is_success(result)
+
+        row = None
+        if len(self.recency) >= self.recency_size or self.is_full():
+            row = self._retire_oldest()
+        if row is None:
+            if self.is_full():
+                row = self._retire_oldest()
+            else:
+                row = self.size
+
+        overwritten = row < self.size
+        self.features.write(row, state, success)
+        payload = len(json.dumps(action, ensure_ascii=False, default=str)) + len(str(result))
+        if overwritten:
+            self.payload_total -= self.payload_bytes[row]
+            self.actions[row] = action
+            self.results[row] = result
+            self.payload_bytes[row] = payload
+        else:
+            self.actions.append(action)
+            self.results.append(result)
+            self.payload_bytes.append(payload)
+        self.payload_total += payload
+        self.recency.append(row)
+        return row, overwritten
+
+    def recent_rows(self, count):
+        """最近的若干行 (按时间顺序)"""
+        rows = list(islice(reversed(self.recency), count))
+        rows.reverse()
+        return rows
+
+    def snapshot(self):
+        """复制保存所需的数据 (数组切片复制，动作/结果列表浅复制)，之后可在其他线程中写入文件"""
+        n = self.size
+        features = self.features
+        return {
+            "positions": features.positions[:n].copy(),
+            "vitals": features.vitals[:n].copy(),
+            "blocks": np.packbits(features.blocks[:n], axis=1),
+            "block_width": features.blocks.shape[1],
+            "block_counts": features.block_counts[:n].copy(),
+            "inventory": np.packbits(features.inventory[:n], axis=1),
+            "inventory_width": features.inventory.shape[1],
+            "inventory_counts": features.inventory_counts[:n].copy(),
+            "success": features.success[:n].copy(),
+            "block_vocab": list(features.names("block_vocab")),
+            "inventory_vocab": list(features.names("inventory_vocab")),
+            "actions": list(self.actions),
+            "results": list(self.results),
+            "recency": list(self.recency),
+            "reservoir": list(self.reservoir),
+            "seen": self.seen,
+        }
+
+    @staticmethod
+    def write_snapshot(path, snapshot):
+        """把快照写成紧凑的二进制文件 (npz，multi-hot 按位打包)"""
+        payload = json.dumps({"actions": snapshot["actions"], "results": snapshot["results"]},
+                             ensure_ascii=False, default=str)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                positions=snapshot["positions"],
+                vitals=snapshot["vitals"],
+                blocks=snapshot["blocks"],
+                block_width=np.int64(snapshot["block_width"]),
+                block_counts=snapshot["block_counts"],
+                inventory=snapshot["inventory"],
+                inventory_width=np.int64(snapshot["inventory_width"]),
+                inventory_counts=snapshot["inventory_counts"],
+                success=snapshot["success"],
+                block_vocab=np.array(json.dumps(snapshot["block_vocab"])),
+                inventory_vocab=np.array(json.dumps(snapshot["inventory_vocab"])),
+                payload=np.frombuffer(payload.encode("utf-8"), dtype=np.uint8),
+                recency=np.array(snapshot["recency"], dtype=np.int64),
+                reservoir_keys=np.array([key for key, _ in snapshot["reservoir"]], dtype=np.float64),
+                reservoir_rows=np.array([row for _, row in snapshot["reservoir"]], dtype=np.int64),
+                seen=np.int64(snapshot["seen"])
+            )
+        os.replace(tmp_path, path)
+
+    def save(self, path):
+        """保存为紧凑的二进制文件 (npz，multi-hot 按位打包)"""
+        self.write_snapshot(path, self.snapshot())
+
+    def load(self, path):
+        """从二进制文件恢复，成功返回True"""
+        if not os.path.exists(path):
+            return False
+        with np.load(path, allow_pickle=False) as data:
+            n = len(data["success"])
+            if n > self.capacity:
+                print(f"观察存储文件行数 ({n}) 超过容量 ({self.capacity})，忽略")
+                return False
+            block_width = int(data["block_width"])
+            inventory_width = int(data["inventory_width"])
+            features = StateFeatureMatrix(capacity=max(n, min(1024, self.capacity)),
+                                          max_capacity=self.capacity)
+            features.blocks = np.zeros((features.capacity, block_width), dtype=np.uint8)
+            features.inventory = np.zeros((features.capacity, inventory_width), dtype=np.uint8)
+            features.positions[:n] = data["positions"]
+            features.vitals[:n] = data["vitals"]
+            features.blocks[:n] = np.unpackbits(data["blocks"], axis=1, count=block_width)
+            features.block_counts[:n] = data["block_counts"]
+            features.inventory[:n] = np.unpackbits(data["inventory"], axis=1, count=inventory_width)
+            features.inventory_counts[:n] = data["inventory_counts"]
+            features.success[:n] = data["success"]
+            features.block_vocab = {name: i for i, name in enumerate(json.loads(str(data["block_vocab"])))}
+            features.inventory_vocab = {name: i for i, name in enumerate(json.loads(str(data["inventory_vocab"])))}
+            features.size = n
+            payload = json.loads(data["payload"].tobytes().decode("utf-8"))
+            recency = data["recency"].tolist()
+            reservoir = list(zip(data["reservoir_keys"].tolist(), data["reservoir_rows"].tolist()))
+            seen = int(data["seen"])
+
+        self.features = features
+        self.actions = payload["actions"]
+        self.results = payload["results"]
+        self.payload_bytes = [
+            len(json.dumps(a, ensure_ascii=False, default=str)) + len(str(r))
+            for a, r in zip(self.actions, self.results)
+        ]
+        self.payload_total = sum(self.payload_bytes)
+        self.recency = deque(recency)
+        heapq.heapify(reservoir)
+        self.reservoir = reservoir
+        self.seen = seen
+        return True
@@ -1,14 +1,224 @@
+import os
 import numpy as np
 import json
-from collections import defaultdict
+import threading
+from collections import deque
+from .state_index import StateIndex
+from .observation_store import ObservationStore
+
+class SequenceMiner:
+    """增量 n-gram 序列挖掘：每次插入只更新以最新动作结尾的至多 max_n 个后缀"""
+    
+    def __init__(self, max_n=5, max_sequences=50000):
+        self.max_n = max_n
+        self.max_sequences = max_sequences  # 超过后裁剪只出现过一次的序列
+        self.window = deque(maxlen=max_n)  # 最近的 (动作类型, 是否成功, 动作)
+        self.stats = {}  # 动作类型序列 -> {"support", "successes", "actions"}
+    
+    def update(self, action, success):
+        """加入一个动作，更新所有以它结尾的 n-gram"""
+        self.window.append((action.get("type", "unknown"), success, action))
+        sequence = ()
+        actions = []
+        all_success = True
+        for action_type, ok, concrete in reversed(self.window):
+            sequence = (action_type,) + sequence
+            actions.insert(0, concrete)
+            all_success = all_success and ok
+            entry = self.stats.get(sequence)
+            if entry is None:
+                entry = self.stats[sequence] = {"support": 0, "successes": 0, "actions": None}
+            entry["support"] += 1
+            if all_success:
+                entry["successes"] += 1
+                # 保存最近一次成功出现时的具体动作，用于重放
+                entry["actions"] = list(actions)
+        
+        if len(self.stats) > self.max_sequences:
+            self.stats = {seq: entry for seq, entry in self.stats.items() if entry["support"] > 1}
+    
+    def top_sequences(self, k=10, min_length=2, min_support=3, min_success_rate=0.6):
+        """返回出现频繁且成功率高的序列"""
+        candidates = []
+        for sequence, entry in self.stats.items():
+            if len(sequence) < min_length or entry["support"] < min_support:
+                continue
+            success_rate = entry["successes"] / entry["support"]
+            if success_rate < min_success_rate or not entry["actions"]:
+                continue
+            candidates.append({
+                "sequence": list(sequence),
+                "support": entry["support"],
+                "success_rate": success_rate,
+                "actions": entry["actions"]
+            })
+        candidates.sort(key=lambda c: (c["support"] * c["success_rate"], len(c["sequence"])), reverse=True)
+        return candidates[:k]
+
+class ConfidenceCalibrator:
+    """
+    在线置信度校准：影子模式下记录预测与LLM决策是否一致，
+    按原始分数分箱估计一致率，作为校准后的置信度。
+    """
+    
+    def __init__(self, bins=10, prior_strength=5.0, min_bin_samples=10):
+        self.bins = bins
+        self.prior_strength = prior_strength  # 样本不足时向原始分数收缩的强度
+        self.min_bin_samples = min_bin_samples  # 分箱样本不足时视为未校准
+        self.counts = np.zeros(bins)
+        self.agreements = np.zeros(bins)
+        self.samples = 0
+        self.agreed = 0
+        self.would_bypass = 0  # 置信度超过阈值的影子样本
+        self.false_bypasses = 0  # 其中与LLM不一致的样本
+    
+    def _bin(self, raw_score):
+        return min(int(raw_score * self.bins), self.bins - 1)
+    
+    def calibrate(self, raw_score):
+        """把原始分数映射为校准后的置信度 (分箱一致率，保证单调)"""
+        centers = (np.arange(self.bins) + 0.5) / self.bins
+        rates = (self.agreements + self.prior_strength * centers) / (self.counts + self.prior_strength)
+        rates = np.maximum.accumulate(rates)
+        return float(rates[self._bin(raw_score)])
+    
+    def is_calibrated(self, raw_score):
+        """该分数所在分箱是否有足够的影子样本"""
+        return bool(self.counts[self._bin(raw_score)] >= self.min_bin_samples)
+    
+    def record(self, raw_score, confidence, agreed, threshold):
+        """记录一次影子比较"""
+        b = self._bin(raw_score)
+        self.counts[b] += 1
+        self.samples += 1
+        if agreed:
+            self.agreements[b] += 1
+            self.agreed += 1
+        if confidence > threshold:
+            self.would_bypass += 1
+            if not agreed:
+                self.false_bypasses += 1
+    
+    def state_dict(self):
+        """可序列化为JSON的分箱计数与统计"""
+        return {
+            "bins": self.bins,
+            "counts": self.counts.tolist(),
+            "agreements": self.agreements.tolist(),
+            "samples": self.samples,
+            "agreed": self.agreed,
+            "would_bypass": self.would_bypass,
+            "false_bypasses": self.false_bypasses
+        }
+    
+    def load_state_dict(self, state):
+        """从 state_dict() 的结果恢复；分箱数不同时抛出 ValueError"""
+        if state.get("bins") != self.bins:
+            raise ValueError(f"分箱数不一致: {state.get('bins')} != {self.bins}")
+        self.counts = np.array(state["counts"], dtype=float)
+        self.agreements = np.array(state["agreements"], dtype=float)
+        self.samples = state["samples"]
+        self.agreed = state["agreed"]
+        self.would_bypass = state["would_bypass"]
+        self.false_bypasses = state["false_bypasses"]
+    
+    def stats(self):
+        """一致率与误跳过率"""
+        return {
+            "samples": self.samples,
+            "agreement_rate": self.agreed / self.samples if self.samples else 0.0,
+            "would_bypass": self.would_bypass,
+            "false_bypass_rate": self.false_bypasses / self.would_bypass if self.would_bypass else 0.0
+        }
+
 
 class PatternRecognition:
     """模式识别系统，识别状态-动作模式并预测动作"""
     
-    def __init__(self):
-        self.state_action_pairs = []
-        self.action_patterns = defaultdict(list)
+    def __init__(self, store_file="patterns.npz", capacity=20000, recency_size=5000,
+                 success_weight=4.0, max_bytes=None, save_interval=200):
         self.scenario_templates = {}
+        self.sequence_miner = SequenceMiner()
+        self.store_file = store_file
+        self.calibration_file = os.path.splitext(store_file)[0] + ".calibration.json"  # 置信度校准分箱
+        self.save_interval = save_interval  # 每多少次观察在后台保存一次
+        self.save_thread = None
+        # 容量受限的观察存储 (特征矩阵 + 动作)，替代无限增长的列表
+        self.store = ObservationStore(capacity=capacity, recency_size=recency_size,
+                                      success_weight=success_weight, max_bytes=max_bytes)
+        self.index = StateIndex()  # 近邻索引，观察数较多时避免全量比较
+        self.brute_force_limit = 5000  # 低于该数量时直接全量向量化计算
+        self.neighbour_k = 25  # 估计经验成功率时考虑的近邻数
+        self.calibrator = ConfidenceCalibrator()
+        self.load()
+    
+    @property
+    def features(self):
+        return self.store.features
+    
+    @property
+    def actions(self):
+        return self.store.actions
+    
+    def load(self):
+        """加载观察存储并重建近邻索引"""
+        try:
+            if self.store.load(self.store_file):
+                for row in range(self.store.size):
+                    self.index.insert(row, self.features.state_view(row))
+                # 用最近窗口重放恢复序列统计
+                for row in self.store.recency:
+                    self.sequence_miner.update(self.actions[row], bool(self.features.success[row]))
+        except Exception as e:
+            print(f"加载观察存储失败: {e}")
+        try:
+            if os.path.exists(self.calibration_file):
+                with open(self.calibration_file, "r") as f:
+                    self.calibrator.load_state_dict(json.load(f))
+        except Exception as e:
+            print(f"加载置信度校准数据失败: {e}")
+    
+    def _write_calibration(self, state):
+        """写入校准分箱 (先写临时文件再替换)"""
+        tmp_path = f"{self.calibration_file}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.calibration_file)
+    
+    def save(self):
+        """保存观察存储 (等待正在进行的后台保存完成后同步写入，退出时调用)"""
+        if self.save_thread is not None:
+            self.save_thread.join()
+            self.save_thread = None
+        try:
+            self.store.save(self.store_file)
+        except Exception as e:
+            print(f"保存观察存储失败: {e}")
+        try:
+            self._write_calibration(self.calibrator.state_dict())
+        except Exception as e:
+            print(f"保存置信度校准数据失败: {e}")
+
+    def save_async(self):
+        """在调用线程中复制快照，压缩和写文件交给后台线程；上一次保存未完成时跳过"""
+        if self.save_thread is not None and self.save_thread.is_alive():
+            return False
+        snapshot = self.store.snapshot()
+        calibration = self.calibrator.state_dict()
+
+        def write():
+            try:
+                self.store.write_snapshot(self.store_file, snapshot)
+            except Exception as e:
+                print(f"保存观察存储失败: {e}")
+            try:
+                self._write_calibration(calibration)
+            except Exception as e:
+                print(f"保存置信度校准数据失败: {e}")
+
+        self.save_thread = threading.Thread(target=write, daemon=True)
+        self.save_thread.start()
+        return True
     
     def encode_state(self, state):
         """将状态编码为特征向量"""
@@ -26,67 +236,111 @@ class PatternRecognition:
     
     def add_observation(self, state, action, result):
         """添加观察到的状态-动作对"""
-        encoded_state = self.encode_state(state)
-        self.state_action_pairs.append((encoded_state, action, result))
-        
-        # 记录动作模式
-        action_type = action.get("type", "unknown")
-        self.action_patterns[action_type].append((encoded_state, action, result))
+        # 编码进特征矩阵，预测时无需再解析JSON；存储满时复用被淘汰的行
+        row, overwritten = self.store.add(state, action, result)
+        if overwritten:
+            self.index.remove(row)
+        self.index.insert(row, state)
         
         # 识别并保存常见场景模板
-        self.identify_scenarios()
-    
-    def identify_scenarios(self):
-        """识别常见场景模板"""
-        if len(self.state_action_pairs) < 10:
-            return
-            
-        # 分析最近10次动作
-        recent_pairs = self.state_action_pairs[-10:]
-        
-        # 检查是否存在相似的状态序列
-        state_sequence = [s for s, _, _ in recent_pairs]
+        self.identify_scenarios(action, bool(self.features.success[row]))
         
-        # 简单检测：如果相同动作连续执行
-        action_sequence = [a.get("type", "") for _, a, _ in recent_pairs]
+        # 定期在后台保存，不阻塞决策循环
+        if self.save_interval and self.store.seen % self.save_interval == 0:
+            self.save_async()
+    
+    def identify_scenarios(self, action, success):
+        """增量更新动作序列统计，识别常见场景模板"""
+        self.sequence_miner.update(action, success)
         
-        for i in range(len(action_sequence) - 2):
-            if action_sequence[i] == action_sequence[i+1] == action_sequence[i+2]:
-                # 发现重复动作模式
-                pattern_key = f"repeated_{action_sequence[i]}"
-                if pattern_key not in self.scenario_templates:
-                    self.scenario_templates[pattern_key] = {
-                        "pattern": action_sequence[i:i+3],
-                        "actions": [a for _, a, _ in recent_pairs[i:i+3]],
-                        "count": 1
-                    }
-                else:
-                    self.scenario_templates[pattern_key]["count"] += 1
+        # 兼容原有模板：相同动作连续执行三次
+        window = list(self.sequence_miner.window)[-3:]
+        if len(window) == 3 and window[0][0] == window[1][0] == window[2][0]:
+            pattern_key = f"repeated_{window[0][0]}"
+            if pattern_key not in self.scenario_templates:
+                self.scenario_templates[pattern_key] = {
+                    "pattern": [t for t, _, _ in window],
+                    "actions": [a for _, _, a in window],
+                    "count": 1
+                }
+            else:
+                self.scenario_templates[pattern_key]["count"] += 1
+    
+    def get_frequent_sequences(self, k=10, min_length=2, min_support=3, min_success_rate=0.6):
+        """获取频繁且成功的动作序列"""
+        return self.sequence_miner.top_sequences(k, min_length, min_support, min_success_rate)
     
     def predict_action(self, current_state):
-        """根据当前状态预测最佳动作"""
-        if not self.state_action_pairs:
+        """
+        根据当前状态预测最佳动作。
+        返回 {"action", "similarity", "success_rate", "support", "raw_score", "confidence", "calibrated"}，
+        没有可用的成功动作时返回None。
+        """
+        if not self.features.size:
             return None
-            
-        encoded_state = self.encode_state(current_state)
         
-        # 查找最相似的状态
-        similarity_scores = []
-        for prev_state, action, result in self.state_action_pairs:
-            # 计算相似度 (简单实现)
-            similarity = self.calculate_similarity(encoded_state, prev_state)
-            success = "success" in str(result).lower() if result else False
-            similarity_scores.append((similarity, action, success))
+        # 观察数较多时只比较索引给出的候选近邻，没有成功的候选再退回全量计算
+        rows = None
+        if self.features.size > self.brute_force_limit:
+            rows = self.index.candidates(current_state)
+            if not self.features.success[rows].any():
+                rows = None
         
-        # 按相似度排序，只考虑成功的动作
-        similarity_scores = [s for s in similarity_scores if s[2]]
-        if not similarity_scores:
+        # 一次性计算与候选 (或所有已存) 状态的相似度
+        similarity = self.features.similarity(current_state, rows)
+        if rows is None:
+            rows = np.arange(self.features.size)
+        success = self.features.success[rows]
+        if not success.any():
             return None
-            
-        similarity_scores.sort(reverse=True)
         
-        # 返回最相似状态下的动作
-        return similarity_scores[0][1]
+        # 只在成功的动作中选择最相似状态下的动作
+        best = int(np.argmax(np.where(success, similarity, -np.inf)))
+        action = self.actions[rows[best]]
+        action_type = action.get("type")
+        
+        # 经验成功率：最近的k个邻居中同类型动作的成功比例 (Beta(1,1)平滑)
+        k = min(self.neighbour_k, len(rows))
+        nearest = np.argpartition(-similarity, k - 1)[:k]
+        same_type = [i for i in nearest if self.actions[rows[i]].get("type") == action_type]
+        support = len(same_type)
+        successes = int(success[same_type].sum()) if same_type else 0
+        success_rate = (successes + 1) / (support + 2)
+        
+        raw_score = float(np.clip(similarity[best] * success_rate, 0.0, 1.0))
+        return {
+            "action": action,
+            "similarity": float(similarity[best]),
+            "success_rate": success_rate,
+            "support": support,
+            "raw_score": raw_score,
+            "confidence": self.calibrator.calibrate(raw_score),
+            "calibrated": self.calibrator.is_calibrated(raw_score)
+        }
+    
+    @staticmethod
+    def actions_agree(predicted, chosen, tolerance=2.0):
+        """判断预测动作与LLM选择的动作是否一致 (类型相同，坐标在容差内，其余参数相同)"""
+        if not isinstance(predicted, dict) or not isinstance(chosen, dict):
+            return False
+        if predicted.get("type") != chosen.get("type"):
+            return False
+        for key in set(predicted) | set(chosen):
+            a, b = predicted.get(key), chosen.get(key)
+            if key in ("x", "y", "z") and isinstance(a, (int, float)) and isinstance(b, (int, float)):
+                if abs(a - b) > tolerance:
+                    return False
+            elif a != b:
+                return False
+        return True
+    
+    def record_shadow(self, prediction, chosen_action, threshold):
+        """影子模式：记录预测与LLM实际选择是否一致，用于在线校准"""
+        if not prediction:
+            return None
+        agreed = self.actions_agree(prediction["action"], chosen_action)
+        self.calibrator.record(prediction["raw_score"], prediction["confidence"], agreed, threshold)
+        return agreed
     
     def calculate_similarity(self, state1, state2):
         """计算两个状态的相似度"""
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+
+import numpy as np
+
+from .action_schema import ACTION_SCHEMA
+
+# 动作类型 -> 编码 (0 表示未知/无动作)
+ACTION_CODES = {action_type: code for code, action_type in enumerate(ACTION_SCHEMA, start=1)}
+STATE_FIELDS = ("x", "y", "z", "health", "food")
+
+
+def encode_state(state):
+    """把状态压缩为定长向量: 坐标、生命值、饥饿值"""
+    position = (state or {}).get("position") or {}
+    return [position.get("x", 0) or 0, position.get("y", 0) or 0, position.get("z", 0) or 0,
+            (state or {}).get("health", 0) or 0, (state or {}).get("food", 0) or 0]
+
+
+def encode_result(result):
+    """1 成功, 0 失败, -1 未知"""
+    if not isinstance(result, dict) or "success" not in result:
+        return -1
+    return 1 if result.get("success") else 0
+
+
+class ReplayBuffer:
+    """内存映射的视觉经验回放缓冲区
+
+    帧嵌入 (float16)、压缩状态、动作编码和结果编码分别存放在 .npy 内存映射文件中，
+    容量固定，写满后循环覆盖最旧的经验；数据留在磁盘上，不增加进程堆内存。
+    """
+
+    def __init__(self, directory, embedding_dim, capacity=50000, flush_interval=100):
+        self.directory = directory
+        self.embedding_dim = embedding_dim
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.meta_file = os.path.join(directory, "meta.json")
+        self.size = 0
+        self.cursor = 0  # 下一次写入的位置
+        self.pending = 0  # 上次落盘后新增的条数
+        os.makedirs(directory, exist_ok=True)
+
+        layout = {
+            "embeddings": (np.float16, (embedding_dim,)),
+            "states": (np.float32, (len(STATE_FIELDS),)),
+            "actions": (np.int16, ()),
+            "results": (np.int8, ()),
+            "timestamps": (np.float64, ()),
+        }
+        meta = self._load_meta()
+        reuse = meta.get("embedding_dim") == embedding_dim and meta.get("capacity") == capacity
+        if meta and not reuse:
+            print(f"回放缓冲区参数变化 (维度 {meta.get('embedding_dim')} -> {embedding_dim}, "
+                  f"容量 {meta.get('capacity')} -> {capacity})，重新创建")
+        self.arrays = {}
+        for name, (dtype, shape) in layout.items():
+            path = os.path.join(directory, f"{name}.npy")
+            if reuse and os.path.exists(path):
+                self.arrays[name] = np.load(path, mmap_mode="r+")
+            else:
+                self.arrays[name] = np.lib.format.open_memmap(path, mode="w+", dtype=dtype,
+                                                              shape=(capacity,) + shape)
+        if reuse:
+            self.size = meta.get("size", 0)
+            self.cursor = meta.get("cursor", 0)
+
+    def _load_meta(self):
+        if os.path.exists(self.meta_file):
+            try:
+                with open(self.meta_file, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"加载回放缓冲区元数据失败: {e}")
+        return {}
+
+    def __len__(self):
+        return self.size
+
+    def add(self, embedding, state, action, result):
+        """写入一条经验，返回写入位置"""
+        index = self.cursor
+        self.arrays["embeddings"][index] = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        self.arrays["states"][index] = encode_state(state)
+        self.arrays["actions"][index] = ACTION_CODES.get((action or {}).get("type"), 0)
+        self.arrays["results"][index] = encode_result(result)
+        self.arrays["timestamps"][index] = time.time()
+        self.cursor = (self.cursor + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.pending += 1
+        if self.pending >= self.flush_interval:
+            self.flush()
+        return index
+
+    def window(self, start, length):
+        """从存储位置 start 起的一段经验，返回内存映射的视图 (不复制，不跨越回绕点)"""
+        end = min(start + length, self.size)
+        return {name: array[start:end] for name, array in self.arrays.items()}
+
+    def _segments(self):
+        """按时间顺序排列的存储区间：写满后最旧的经验从 cursor 开始，回绕到 0"""
+        if self.size < self.capacity:
+            return [(0, self.size)]
+        return [(start, end) for start, end in ((self.cursor, self.capacity), (0, self.cursor)) if end > start]
+
+    def sample(self, batch_size, rng=None):
+        """均匀随机采样不重复的经验，返回复制出的数组 (i.i.d. 小批量，可随意修改)"""
+        if self.size == 0:
+            return None
+        rng = rng or np.random.default_rng()
+        batch_size = min(batch_size, self.size)
+        indices = np.sort(rng.choice(self.size, size=batch_size, replace=False))  # 排序后按顺序读取磁盘
+        return {name: array[indices] for name, array in self.arrays.items()}
+
+    def sample_window(self, length, rng=None):
+        """随机取一段时间上连续的经验，返回内存映射视图 (零拷贝)
+
+        窗口内的经验彼此相关，适合序列学习，不能代替 sample() 的随机小批量；
+        窗口不跨越回绕点，因此总是按时间顺序排列。
+        """
+        if self.size == 0:
+            return None
+        rng = rng or np.random.default_rng()
+        segments = self._segments()
+        length = min(length, max(end - start for start, end in segments))
+        starts = [(start, end - length + 1) for start, end in segments if end - start >= length]
+        offset = int(rng.integers(0, sum(high - low for low, high in starts)))
+        for low, high in starts:
+            if offset < high - low:
+                return self.window(low + offset, length)
+            offset -= high - low
+
+    def flush(self):
+        """把内存映射和元数据写回磁盘"""
+        for array in self.arrays.values():
+            array.flush()
+        try:
+            with open(self.meta_file, "w", encoding="utf-8") as f:
+                json.dump({"embedding_dim": self.embedding_dim, "capacity": self.capacity,
+                           "size": self.size, "cursor": self.cursor}, f)
+        except Exception as e:
+            print(f"保存回放缓冲区元数据失败: {e}")
+        self.pending = 0
+
+    @property
+    def nbytes(self):
+        """磁盘上的数据大小"""
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def close(self):
+        self.flush()
+        self.arrays = {}
@@ -0,0 +1,52 @@
+import numpy as np
+from PIL import Image
+
+# 颜色类别 (按 HSV 划分)，顺序即直方图的下标
+COLOR_CLASSES = ("other", "sky", "water", "lava", "foliage", "stone", "dark")
+
+
+def color_histogram(image, size=(64, 36)):
+    """缩小后按 HSV 把每个像素归入颜色类别，返回 (类别比例, 整体亮度, 上方三分之一的亮度, 上方的天空比例)"""
+    image.draft("RGB", (size[0] * 2, size[1] * 2))  # JPEG 直接按缩小尺寸解码
+    small = image.convert("RGB").resize(size, Image.BILINEAR)
+    hsv = np.asarray(small.convert("HSV"), dtype=np.float32) / 255.0
+    h, s, v = hsv[..., 0] * 360, hsv[..., 1], hsv[..., 2]
+    top = np.zeros(v.shape, dtype=bool)
+    top[:v.shape[0] // 3] = True
+
+    blue = (h >= 190) & (h <= 250) & (s > 0.25) & (v > 0.2)
+    classes = np.select(
+        [
+            v < 0.15,
+            (h <= 45) & (s > 0.7) & (v > 0.6),
+            blue & top & (v > 0.55),
+            blue & ~top,
+            (h >= 70) & (h <= 160) & (s > 0.3) & (v > 0.2),
+            (s < 0.15) & (v <= 0.75),
+        ],
+        [COLOR_CLASSES.index(name) for name in ("dark", "lava", "sky", "water", "foliage", "stone")],
+        default=0,
+    )
+    histogram = np.bincount(classes.ravel(), minlength=len(COLOR_CLASSES)) / classes.size
+    sky_share = np.count_nonzero(classes[top] == COLOR_CLASSES.index("sky")) / np.count_nonzero(top)
+    return dict(zip(COLOR_CLASSES, histogram.tolist())), float(v.mean()), float(v[top].mean()), sky_share
+
+
+def describe_scene(image):
+    """由颜色直方图和亮度得到场景标签 (day/night/underground/water/lava 等)，返回 (标签列表, 统计量)"""
+    histogram, brightness, top_brightness, sky_share = color_histogram(image)
+    tags = []
+    if sky_share < 0.02 and histogram["stone"] + histogram["dark"] > 0.5:
+        tags.append("underground")
+    elif top_brightness < 0.3:
+        tags.append("night")
+    else:
+        tags.append("day")
+    if histogram["water"] > 0.15:
+        tags.append("water")
+    if histogram["lava"] > 0.02:
+        tags.append("lava")
+    if histogram["foliage"] > 0.25:
+        tags.append("foliage")
+    stats = {"brightness": brightness, "sky": sky_share, **histogram}
+    return tags, stats
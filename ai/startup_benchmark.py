@@ -0,0 +1,61 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# 启动时不应被导入的重依赖 (只在启用视觉或本地模型时按需导入)
+HEAVY_MODULES = ("torch", "torchvision", "transformers")
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr):
+    """解析 python -X importtime 的输出，返回 {模块: (自身微秒, 累计微秒)}"""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            timings[name.strip()] = (int(self_us), int(cumulative_us))
+        except ValueError:
+            continue
+    return timings
+
+
+def measure_import(module, python=sys.executable):
+    """在新进程中导入模块，返回 (墙钟秒数, 导入耗时表)"""
+    started = time.perf_counter()
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=PROJECT_ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr.strip().splitlines()[-1]}")
+    return elapsed, parse_importtime(result.stderr)
+
+
+def report(module, top=15):
+    """打印一个模块的启动耗时报告"""
+    elapsed, timings = measure_import(module)
+    total = max((cumulative for _, cumulative in timings.values()), default=0)
+    print(f"\n== import {module}: {elapsed * 1000:.0f} ms 墙钟, {total / 1000:.0f} ms 导入, {len(timings)} 个模块")
+    heavy = [name for name in HEAVY_MODULES if name in timings]
+    print(f"重依赖: {', '.join(heavy) if heavy else '无'}")
+    # 只列出顶层包，避免子模块重复计入
+    packages = {name: value for name, value in timings.items() if "." not in name}
+    ranked = sorted(packages.items(), key=lambda item: item[1][1], reverse=True)[:top]
+    for name, (self_us, cumulative_us) in ranked:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+    return elapsed, heavy
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="启动耗时基准: 报告导入各入口模块的耗时和重依赖")
+    parser.add_argument("modules", nargs="*", default=["ai.agent", "gui.main_window"])
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+    for module in args.modules:
+        try:
+            report(module, args.top)
+        except RuntimeError as e:
+            print(e)
@@ -1,4 +1,6 @@
 import logging
+import threading
+import time
 from PIL import Image
 import requests
 import base64
@@ -8,72 +10,177 @@ from io import BytesIO
 logger = logging.getLogger("MinecraftAI.VisionCapture")
 logger.setLevel(logging.INFO)
 
+# 优先请求原始图像字节，服务器不支持时返回旧的 JSON/Base64 格式
+ACCEPT_HEADER = "image/png, image/jpeg;q=0.9, application/json;q=0.5"
+IMAGE_TYPES = ("image/png", "image/jpeg")
+
 class MinecraftVisionCapture:
     """
     负责从 Minecraft Bot 服务器捕获视觉帧。
     """
-    def __init__(self, bot_server_url="http://localhost:3002"):
+    def __init__(self, bot_server_url="http://localhost:3002", timeout=5, prefer_binary=True):
         """
         初始化视觉捕获系统。
 
         Args:
             bot_server_url (str): Bot服务器的地址。
+            timeout (float): 请求超时时间 (秒)。
+            prefer_binary (bool): 是否通过 Accept 头请求原始图像字节。
         """
         self.logger = logging.getLogger("MinecraftAI.VisionCapture")
         self.bot_server_url = bot_server_url
         self.vision_endpoint = f"{self.bot_server_url}/bot/vision"
+        self.timeout = timeout
+        self.prefer_binary = prefer_binary
+        self.session = requests.Session()  # 复用连接，避免每帧重新握手
+        self.last_error = None  # 最近一次获取失败的原因
+        self.stats = {"binary": 0, "json": 0, "failed": 0, "bytes": 0}
         self.logger.info(f"Vision Capture initialized. Endpoint: {self.vision_endpoint}")
 
-    def get_latest_frame(self) -> Image.Image | None:
+    def get_latest_frame_bytes(self):
         """
-        从 Bot 服务器获取最新的视觉帧。
+        从 Bot 服务器获取最新视觉帧的编码字节 (不解码图像)。
 
         Returns:
-            PIL.Image.Image | None: 最新的图像帧，如果获取失败则返回 None。
+            tuple[bytes, str] | tuple[None, None]: (图像字节, MIME类型)，失败时 last_error 记录原因。
         """
+        self.last_error = None
         try:
-            response = requests.get(self.vision_endpoint, timeout=5) # 设置超时
+            headers = {"Accept": ACCEPT_HEADER if self.prefer_binary else "application/json"}
+            response = self.session.get(self.vision_endpoint, headers=headers, timeout=self.timeout)
             response.raise_for_status() # 检查 HTTP 错误
 
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if content_type in IMAGE_TYPES:
+                # 二进制响应：直接使用响应缓冲区
+                self.stats["binary"] += 1
+                self.stats["bytes"] += len(response.content)
+                return response.content, content_type
+
             data = response.json()
             if data.get("success") and data.get("data"):
-                # 假设返回的是 data:image/png;base64,... 格式
-                base64_data = data["data"].split('base64,')[-1]
+                # 旧格式: data:image/png;base64,...
+                header, _, base64_data = data["data"].rpartition('base64,')
+                mime = header[5:].rstrip(';') if header.startswith("data:") else "image/png"
                 image_data = base64.b64decode(base64_data)
-                image = Image.open(BytesIO(image_data))
-                # self.logger.debug("Successfully retrieved and decoded frame.")
-                return image
-            elif data.get("error"):
-                self.logger.warning(f"Failed to get frame from bot server: {data['error']}")
-                return None
-            else:
-                self.logger.warning("Received success=false or no data from vision endpoint.")
-                return None
+                self.stats["json"] += 1
+                self.stats["bytes"] += len(image_data)
+                return image_data, mime or "image/png"
+            self.last_error = data.get("error") or data.get("message") or "No image data from vision endpoint"
 
         except requests.exceptions.Timeout:
-            self.logger.warning(f"Timeout connecting to vision endpoint: {self.vision_endpoint}")
-            return None
+            self.last_error = f"Timeout connecting to vision endpoint: {self.vision_endpoint}"
         except requests.exceptions.RequestException as e:
-            self.logger.error(f"Error requesting frame from {self.vision_endpoint}: {e}")
+            self.last_error = f"Error requesting frame from {self.vision_endpoint}: {e}"
+        except Exception as e:
+            self.last_error = f"Error processing frame data: {e}"
+        self.stats["failed"] += 1
+        self.logger.warning(self.last_error)
+        return None, None
+
+    def get_latest_frame(self) -> Image.Image | None:
+        """
+        从 Bot 服务器获取最新的视觉帧。
+
+        Returns:
+            PIL.Image.Image | None: 最新的图像帧，如果获取失败则返回 None。
+        """
+        image_data, _ = self.get_latest_frame_bytes()
+        if image_data is None:
             return None
+        try:
+            image = Image.open(BytesIO(image_data))
+            image.load()
+            return image
         except Exception as e:
-            self.logger.error(f"Error processing frame data: {e}")
-            import traceback
-            traceback.print_exc()
+            self.last_error = f"Error decoding frame: {e}"
+            self.logger.error(self.last_error)
             return None
 
+class FramePrefetcher:
+    """后台线程拉取 /bot/vision，只保留最新一帧 (单槽缓冲区)
+
+    每步结束后调用 request()，后台立即获取一帧，请求频率与决策步频一致；
+    interval 不为 None 时空闲期间也按该间隔刷新。step() 通过 latest() 立即取得最近的帧，
+    超过 max_age 秒的帧视为过期丢弃，视觉请求的延迟不再出现在决策的关键路径上。
+    """
+
+    def __init__(self, capture, interval=None, max_age=2.0):
+        self.capture = capture
+        self.interval = interval  # 定时刷新间隔 (秒)，None 表示只在 request() 时获取
+        self.max_age = max_age
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.frame = None  # (图像字节, MIME类型, 获取时间)
+        self.last_error = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {"fetched": 0, "served": 0, "stale": 0, "empty": 0}
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            self.request()  # 启动后先取一帧
+        return self
+
+    def request(self):
+        """请求后台尽快获取一帧 (如动作执行完成后)"""
+        self.wake.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.capture.timeout + 1)
+            self.thread = None
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if self.stop_event.is_set():
+                break
+            data, mime = self.capture.get_latest_frame_bytes()
+            if data is not None:
+                with self.lock:
+                    self.frame = (data, mime, time.time())
+                self.last_error = None
+                self.stats["fetched"] += 1
+            else:
+                self.last_error = self.capture.last_error
+
+    def latest(self, max_age=None):
+        """返回最新的 (图像字节, MIME类型, 帧龄秒数)，没有帧时返回 (None, None, None)，帧已过期时只返回帧龄"""
+        max_age = self.max_age if max_age is None else max_age
+        with self.lock:
+            frame = self.frame
+        if frame is None:
+            self.stats["empty"] += 1
+            return None, None, None
+        data, mime, timestamp = frame
+        age = time.time() - timestamp
+        if age > max_age:
+            self.stats["stale"] += 1
+            return None, None, age
+        self.stats["served"] += 1
+        return data, mime, age
+
 if __name__ == '__main__':
     # 配置基本的日志记录器以查看测试输出
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     print("Testing MinecraftVisionCapture...")
     # 注意：这个测试需要 Bot 服务器正在运行并提供 /bot/vision 端点
+    # 没有 Bot 服务器时可以使用 python -m ai.vision_stub_server 启动本地替身端点
     capture = MinecraftVisionCapture()
     frame = capture.get_latest_frame()
     if frame:
         print(f"Successfully captured frame. Size: {frame.size}, Mode: {frame.mode}")
+        print(f"Transport stats: {capture.stats}")
         # 可以选择性地显示或保存图像
         # frame.show()
         # frame.save("test_capture.png")
     else:
         print("Failed to capture frame. Is the bot server running and configured?")
-    print("Test finished.") 
\ No newline at end of file
+    print("Test finished.")
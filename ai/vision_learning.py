@@ -1,9 +1,16 @@
 import logging
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
 import torch
 import torchvision.models as models
 from torchvision import transforms
 from PIL import Image
 import os
+from .replay_buffer import ReplayBuffer
+from .scene_tags import describe_scene
 
 # 设置日志记录
 logger = logging.getLogger("MinecraftAI.Vision")
@@ -13,13 +20,19 @@ class VisionLearningSystem:
     """
     处理 Minecraft 视觉信息，进行学习和分析。
     """
-    def __init__(self, model_name='MobileNet', device=None):
+    def __init__(self, model_name='MobileNet', device=None, feature_cache_size=256, use_exported=True,
+                 replay_capacity=50000, replay_dir=None, label_top_k=3):
         """
         初始化视觉学习系统。
 
         Args:
             model_name (str): 要使用的预训练模型名称 ('ResNet', 'MobileNet', etc.)。
             device (str, optional): 指定运行模型的设备 ('cuda', 'cpu', None for auto-detect)。
+            feature_cache_size (int): 按帧哈希缓存的嵌入向量数量上限。
+            use_exported (bool): 优先使用导出的 TorchScript 特征提取器 (缓存在模型目录中)。
+            replay_capacity (int): 经验回放缓冲区容量，0 表示不记录经验。
+            replay_dir (str, optional): 回放缓冲区目录，默认 ~/.minecraft_ai/replay/<模型>。
+            label_top_k (int): 场景描述中附带的分类标签数量，0 表示只使用颜色/亮度标签。
         """
         self.logger = logging.getLogger("MinecraftAI.VisionLearning")
         self.logger.info(f"Initializing Vision Learning System with model: {model_name}")
@@ -29,10 +42,6 @@ class VisionLearningSystem:
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.logger.info(f"Using device: {self.device}")
 
-        self.model = self._load_model(model_name)
-        self.model.to(self.device)
-        self.model.eval() # 默认设置为评估模式
-
         # 定义图像预处理转换
         # 注意：_load_model 可能会根据模型覆盖这个预处理
         self.preprocess = transforms.Compose([
@@ -41,15 +50,153 @@ class VisionLearningSystem:
             transforms.ToTensor(),
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
         ])
+
+        # 嵌入向量缓存 (帧哈希 -> 向量) 与吞吐量统计
+        self.feature_cache = OrderedDict()
+        self.feature_cache_size = feature_cache_size
+        self.feature_stats = {"frames": 0, "cache_hits": 0, "batches": 0, "seconds": 0.0}
+        self.cache_lock = threading.Lock()  # 后台记录经验的线程也会读写缓存
+
+        # 经验回放缓冲区在第一次记录经验时创建 (需要知道嵌入维度)
+        self.replay_capacity = replay_capacity
+        self.replay_dir = replay_dir
+        self.replay_buffer = None
+        # 后台线程批量提取嵌入并写入回放缓冲区，不占用动作执行的时间
+        self.experience_queue = queue.Queue(maxsize=64)
+        self.experience_thread = None
+        self.experience_batch_size = 16
+        self.experiences_dropped = 0
+
+        # 场景描述缓存 (帧哈希 -> 文本)
+        self.label_top_k = label_top_k
+        self.categories = None
+        self.head = None  # 分类层 (weight, bias)，与导出的特征提取器一起保存
+        self.description_cache = OrderedDict()
+
+        # 分类模型按需加载；有导出的特征提取器时启动无需加载 torchvision 模型
+        self.model_name = model_name
+        self._model = None
+        self.exported = False
+        self.feature_extractor = self._load_exported_extractor() if use_exported else None
+        if self.feature_extractor is None:
+            self.feature_extractor = self._build_feature_extractor(self.model).eval().to(memory_format=torch.channels_last)
+            if use_exported:
+                self.export_feature_extractor()
         self.logger.info("Vision Learning System initialized.")
 
+    @property
+    def model(self):
+        """分类模型 (首次访问时加载)"""
+        if self._model is None:
+            self._model = self._load_model(self.model_name)
+            self._model.to(self.device)
+            self._model.eval() # 默认设置为评估模式
+        return self._model
+
+    def _get_model_dir(self):
+        """模型缓存目录 (torch.hub 权重和导出的模型)"""
+        model_dir = os.path.join(os.path.expanduser("~"), ".minecraft_ai", "models")
+        os.makedirs(model_dir, exist_ok=True)
+        return model_dir
+
+    def _model_key(self):
+        return 'resnet' if self.model_name.lower() == 'resnet' else 'mobilenet'
+
+    def _weights_name(self):
+        return 'ResNet18_Weights' if self._model_key() == 'resnet' else 'MobileNet_V2_Weights'
+
+    def _exported_path(self):
+        """导出模型的路径，包含设备和 torch 版本，版本变化后重新导出"""
+        version = torch.__version__.split('+')[0]
+        return os.path.join(self._get_model_dir(), f"{self._model_key()}_features_{self.device}_torch{version}.pt")
+
+    def _head_path(self):
+        """分类层权重的路径 (与设备无关)"""
+        version = torch.__version__.split('+')[0]
+        return os.path.join(self._get_model_dir(), f"{self._model_key()}_head_torch{version}.pt")
+
+    def _load_head(self):
+        """分类层的 (weight, bias)：优先读取保存的权重，只使用导出模型时不必构建 eager 模型"""
+        path = self._head_path()
+        if os.path.exists(path):
+            try:
+                state = torch.load(path, map_location=self.device)
+                return state["weight"], state["bias"]
+            except Exception as e:
+                self.logger.warning(f"Failed to load classifier head, rebuilding from model: {e}")
+        head = self.model.fc if hasattr(self.model, 'fc') else self.model.classifier
+        linear = [module for module in head.modules() if isinstance(module, torch.nn.Linear)][-1]  # MobileNet: Dropout + Linear
+        weight, bias = linear.weight.detach(), linear.bias.detach()
+        try:
+            torch.save({"weight": weight.cpu(), "bias": bias.cpu()}, path)
+        except Exception as e:
+            self.logger.warning(f"Failed to save classifier head: {e}")
+        return weight, bias
+
+    def _load_exported_extractor(self):
+        """加载导出的 TorchScript 特征提取器，不存在或加载失败时返回 None"""
+        path = self._exported_path()
+        if not os.path.exists(path):
+            return None
+        try:
+            extractor = torch.jit.load(path, map_location=self.device)
+            extractor.eval()
+            weights_name = self._weights_name()
+            if hasattr(models, weights_name):
+                self.preprocess = getattr(models, weights_name).DEFAULT.transforms() # 与 _load_model 相同的预处理
+            self.exported = True
+            self.logger.info(f"Loaded exported feature extractor: {path}")
+            return extractor
+        except Exception as e:
+            self.logger.warning(f"Failed to load exported feature extractor, using eager model: {e}")
+            return None
+
+    def export_feature_extractor(self):
+        """把特征提取器 trace 并 freeze 为 TorchScript (channels_last)，保存到模型目录并替换当前提取器"""
+        path = self._exported_path()
+        try:
+            extractor = self._build_feature_extractor(self.model).eval().to(memory_format=torch.channels_last)
+            example = torch.randn(1, 3, 224, 224, device=self.device).to(memory_format=torch.channels_last)
+            with torch.no_grad():
+                traced = torch.jit.freeze(torch.jit.trace(extractor, example))
+                try:
+                    traced = torch.jit.optimize_for_inference(traced)
+                except Exception as e:
+                    self.logger.debug(f"optimize_for_inference skipped: {e}")
+                traced(example) # 触发图优化
+            torch.jit.save(traced, path)
+            self.feature_extractor = traced
+            self.exported = True
+            if self.label_top_k and self.head is None:
+                self.head = self._load_head()  # 分类层与导出模型一起保存
+            self.logger.info(f"Exported feature extractor to {path}")
+            return path
+        except Exception as e:
+            self.logger.warning(f"Failed to export feature extractor, using eager model: {e}")
+            return None
+
+    def benchmark_latency(self, runs=20, batch_size=1):
+        """比较 eager 模式与导出模型的单批延迟 (毫秒)"""
+        batch = torch.randn(batch_size, 3, 224, 224, device=self.device).to(memory_format=torch.channels_last)
+        candidates = {"eager": self._build_feature_extractor(self.model).eval()}
+        if self.exported:
+            candidates["exported"] = self.feature_extractor
+        results = {}
+        with torch.inference_mode():
+            for name, extractor in candidates.items():
+                for _ in range(3): # 预热
+                    extractor(batch)
+                started = time.perf_counter()
+                for _ in range(runs):
+                    extractor(batch)
+                results[name] = (time.perf_counter() - started) / runs * 1000
+        return results
+
     def _load_model(self, model_name):
         """加载指定的预训练模型"""
         self.logger.info(f"Loading pre-trained model: {model_name}")
         # 缓存目录
-        model_dir = os.path.join(os.path.expanduser("~"), ".minecraft_ai", "models")
-        os.makedirs(model_dir, exist_ok=True)
-        torch.hub.set_dir(model_dir)
+        torch.hub.set_dir(self._get_model_dir())
 
         try:
             if model_name.lower() == 'mobilenet':
@@ -93,6 +240,102 @@ class VisionLearningSystem:
             self.logger.error(f"Error loading model {model_name}: {e}")
             raise # 重新抛出异常，让调用者知道加载失败
 
+    def _build_feature_extractor(self, model):
+        """与分类模型共享权重的特征提取器，去掉分类层，输出倒数第二层的嵌入向量"""
+        if hasattr(model, 'fc'): # ResNet: 去掉最后的全连接层
+            return torch.nn.Sequential(*list(model.children())[:-1], torch.nn.Flatten())
+        if hasattr(model, 'features'): # MobileNet: 卷积特征 + 全局平均池化
+            return torch.nn.Sequential(model.features, torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten())
+        raise ValueError(f"Cannot build feature extractor for {type(model).__name__}")
+
+    @staticmethod
+    def frame_hash(image: Image.Image) -> str:
+        """帧的内容哈希，用作嵌入缓存的键"""
+        digest = hashlib.md5(f"{image.mode}{image.size}".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def extract_features(self, frames, batch_size=16, use_cache=True):
+        """
+        批量提取倒数第二层的嵌入向量。
+
+        Args:
+            frames (PIL.Image.Image | list[PIL.Image.Image]): 单帧或帧列表。
+            batch_size (int): 每批送入模型的帧数。
+            use_cache (bool): 是否使用按帧哈希的嵌入缓存。
+
+        Returns:
+            torch.Tensor | None: 单帧时为 (D,)，列表时为 (N, D) 的 CPU 张量；失败时返回 None。
+        """
+        single = isinstance(frames, Image.Image)
+        if single:
+            frames = [frames]
+        if not frames:
+            return None
+        try:
+            hashes = [self.frame_hash(frame) for frame in frames] if use_cache else [None] * len(frames)
+            results = [None] * len(frames)
+            pending = OrderedDict() # 需要计算的帧: 哈希/序号 -> 帧在列表中的位置
+            with self.cache_lock:
+                for i, key in enumerate(hashes):
+                    if use_cache and key in self.feature_cache:
+                        self.feature_cache.move_to_end(key)
+                        results[i] = self.feature_cache[key]
+                        self.feature_stats["cache_hits"] += 1
+                    else:
+                        pending.setdefault(key if use_cache else i, []).append(i)
+
+            groups = list(pending.values())
+            for start in range(0, len(groups), batch_size):
+                chunk = groups[start:start + batch_size]
+                started = time.perf_counter()
+                batch = torch.stack([self.preprocess(frames[group[0]].convert('RGB')) for group in chunk])
+                batch = batch.to(self.device).contiguous(memory_format=torch.channels_last)
+                with torch.inference_mode():
+                    embeddings = self.feature_extractor(batch).float().cpu()
+                with self.cache_lock:
+                    self.feature_stats["seconds"] += time.perf_counter() - started
+                    self.feature_stats["frames"] += len(chunk)
+                    self.feature_stats["batches"] += 1
+                    for group, embedding in zip(chunk, embeddings):
+                        embedding = embedding.clone() # 不保留整批张量的引用
+                        for i in group:
+                            results[i] = embedding
+                        if use_cache:
+                            self._cache_feature(hashes[group[0]], embedding)
+
+            return results[0] if single else torch.stack(results)
+        except Exception as e:
+            self.logger.error(f"Error extracting features: {e}")
+            return None
+
+    def _cache_feature(self, key, embedding):
+        self.feature_cache[key] = embedding
+        self.feature_cache.move_to_end(key)
+        while len(self.feature_cache) > self.feature_cache_size:
+            self.feature_cache.popitem(last=False)
+
+    def get_feature_stats(self):
+        """嵌入提取的吞吐量 (帧/秒) 和缓存命中情况"""
+        stats = dict(self.feature_stats)
+        stats["fps"] = stats["frames"] / stats["seconds"] if stats["seconds"] else 0.0
+        total = stats["frames"] + stats["cache_hits"]
+        stats["cache_hit_rate"] = stats["cache_hits"] / total if total else 0.0
+        stats["cache_size"] = len(self.feature_cache)
+        return stats
+
+    def benchmark_features(self, num_frames=32, batch_sizes=(1, 8, 32)):
+        """比较不同批大小下的嵌入提取吞吐量 (帧/秒)，不使用缓存"""
+        frames = [Image.new('RGB', (640, 360), color=(i * 7 % 256, i * 13 % 256, i * 29 % 256))
+                  for i in range(num_frames)]
+        self.extract_features(frames[:2], batch_size=2, use_cache=False) # 预热
+        results = {}
+        for batch_size in batch_sizes:
+            started = time.perf_counter()
+            self.extract_features(frames, batch_size=batch_size, use_cache=False)
+            results[batch_size] = num_frames / (time.perf_counter() - started)
+        return results
+
     def process_frame(self, image: Image.Image):
         """
         对单个图像帧进行预处理并提取特征。
@@ -139,27 +382,92 @@ class VisionLearningSystem:
 
     def learn_from_frame(self, image: Image.Image, context_data: dict, action: dict, result: dict):
         """
-        （占位符）根据图像帧、上下文、执行的动作和结果进行学习。
-        这部分通常需要更复杂的逻辑，例如强化学习或监督学习更新。
+        把帧嵌入与状态、动作和结果一起写入经验回放缓冲区，供离线学习使用。
 
         Args:
             image (PIL.Image.Image): 视觉输入。
             context_data (dict): 执行动作时的状态信息。
             action (dict): AI 决定执行的动作。
             result (dict): 执行动作后的结果。
+
+        Returns:
+            int | None: 经验在缓冲区中的位置，未记录时返回 None。
+        """
+        if not self.replay_capacity:
+            return None
+        return self._record_experience(self.extract_features(image), context_data, action, result)
+
+    def learn_from_frame_async(self, image: Image.Image, context_data: dict, action: dict, result: dict):
         """
-        self.logger.debug("Learn from frame called (Placeholder).")
-        # 在这里实现学习逻辑，例如：
-        # 1. 提取图像特征
-        # features = self.process_frame(image)
-        # 2. 将特征与上下文、动作、结果关联起来
-        # 3. 更新模型参数（如果模型需要训练）
-        # 4. 或者存储经验用于离线学习
-        pass
+        与 learn_from_frame 相同，但只把经验放入队列，由后台线程批量提取嵌入后写入回放缓冲区。
+        队列已满时丢弃这条经验。
+
+        Returns:
+            bool: 是否已加入队列。
+        """
+        if not self.replay_capacity:
+            return False
+        if self.experience_thread is None:
+            self.experience_thread = threading.Thread(target=self._record_experiences, daemon=True)
+            self.experience_thread.start()
+        try:
+            self.experience_queue.put_nowait((image, context_data, action, result))
+            return True
+        except queue.Full:
+            self.experiences_dropped += 1
+            return False
+
+    def _record_experiences(self):
+        """后台线程：攒成一批后一次前向提取嵌入，再逐条写入回放缓冲区"""
+        while True:
+            item = self.experience_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.experience_batch_size:
+                try:
+                    item = self.experience_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.experience_queue.put(None)  # 写完这一批后再退出
+                    break
+                batch.append(item)
+            embeddings = self.extract_features([image for image, _, _, _ in batch])
+            if embeddings is None:
+                continue
+            for embedding, (_, context_data, action, result) in zip(embeddings, batch):
+                self._record_experience(embedding, context_data, action, result)
+
+    def _record_experience(self, embedding, context_data, action, result):
+        """把一条嵌入和对应的状态、动作、结果写入回放缓冲区"""
+        if embedding is None:
+            return None
+        try:
+            if self.replay_buffer is None:
+                directory = self.replay_dir or os.path.join(os.path.dirname(self._get_model_dir()), "replay", self._model_key())
+                self.replay_buffer = ReplayBuffer(directory, embedding.shape[-1], capacity=self.replay_capacity)
+                self.logger.info(f"Replay buffer at {directory}: {len(self.replay_buffer)}/{self.replay_capacity} experiences")
+            return self.replay_buffer.add(embedding.numpy(), context_data, action, result)
+        except Exception as e:
+            self.logger.error(f"Error recording experience: {e}")
+            return None
+
+    def close(self):
+        """写完队列中的经验，再把回放缓冲区写回磁盘"""
+        if self.experience_thread is not None:
+            self.experience_queue.put(None)
+            self.experience_thread.join()
+            self.experience_thread = None
+        if self.replay_buffer is not None:
+            self.replay_buffer.close()
+            self.replay_buffer = None
 
     def get_visual_context_description(self, image: Image.Image) -> str:
         """
-        （占位符）处理图像并返回一个文本描述，用于注入到 LLM 提示中。
+        处理图像并返回一个简短的文本描述，用于注入到 LLM 提示中。
+        由颜色直方图和亮度得到场景标签 (day/night/underground/water/lava)，
+        再附上由嵌入向量得到的前几个分类标签，结果按帧哈希缓存。
 
         Args:
             image (PIL.Image.Image): 输入的图像帧。
@@ -167,12 +475,39 @@ class VisionLearningSystem:
         Returns:
             str: 对图像内容的文本描述。
         """
-        self.logger.debug("Get visual context description called (Placeholder).")
-        # 这里可以使用图像字幕模型，或者简单的对象检测结果
-        # features = self.process_frame(image)
-        # description = self._generate_description_from_features(features)
-        # return description
-        return "Visual context is present." # 简单的占位符描述
+        key = self.frame_hash(image)
+        if key in self.description_cache:
+            self.description_cache.move_to_end(key)
+            return self.description_cache[key]
+
+        tags, stats = describe_scene(image)
+        description = f"Scene: {', '.join(tags)} (brightness {stats['brightness']:.2f})"
+        labels = self.classify_embedding(self.extract_features(image), self.label_top_k) if self.label_top_k else []
+        if labels:
+            description += "; looks like: " + ", ".join(labels)
+
+        self.description_cache[key] = description
+        while len(self.description_cache) > self.feature_cache_size:
+            self.description_cache.popitem(last=False)
+        return description
+
+    def classify_embedding(self, embedding, top_k=3):
+        """用分类层把嵌入向量映射为前 top_k 个 ImageNet 标签"""
+        if embedding is None or not top_k:
+            return []
+        try:
+            if self.head is None:
+                self.head = self._load_head()
+            if self.categories is None:
+                weights_name = self._weights_name()
+                self.categories = getattr(models, weights_name).DEFAULT.meta["categories"] if hasattr(models, weights_name) else []
+            with torch.inference_mode():
+                logits = torch.nn.functional.linear(embedding.reshape(1, -1).to(self.device), *self.head)
+            indices = torch.topk(logits[0], top_k).indices.tolist()
+            return [self.categories[i] if i < len(self.categories) else str(i) for i in indices]
+        except Exception as e:
+            self.logger.error(f"Error classifying embedding: {e}")
+            return []
 
 # 可以添加一些辅助函数，例如下载模型文件等
 
@@ -194,6 +529,13 @@ if __name__ == '__main__':
         vision_system_mobilenet.learn_from_frame(img, {}, {}, {})
         desc_mobilenet = vision_system_mobilenet.get_visual_context_description(img)
         print(f"MobileNet context description: {desc_mobilenet}")
+        features = vision_system_mobilenet.extract_features([img, img])
+        print(f"MobileNet embedding shape: {tuple(features.shape)}")
+        for batch_size, fps in vision_system_mobilenet.benchmark_features().items():
+            print(f"Batch size {batch_size}: {fps:.1f} frames/s")
+        print(f"Feature stats: {vision_system_mobilenet.get_feature_stats()}")
+        for name, ms in vision_system_mobilenet.benchmark_latency().items():
+            print(f"{name} feature extractor: {ms:.1f} ms/frame")
 
         # 测试 ResNet (如果需要)
         # print("\nTesting ResNet18...")
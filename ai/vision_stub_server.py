@@ -0,0 +1,112 @@
+import json
+import base64
+import threading
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+
+class VisionStubServer:
+    """本地替身 /bot/vision 端点，与 Bot 服务器的协议一致，用于在没有游戏时测试视觉客户端
+
+    binary=True 时按 Accept 头返回原始 image/png 或 image/jpeg 字节，否则返回 JSON/Base64；
+    binary=False 模拟只支持 JSON 的旧服务器。
+    """
+
+    def __init__(self, image=None, host="127.0.0.1", port=0, binary=True):
+        self.binary = binary
+        self.requests = 0
+        self.frames = {}  # MIME类型 -> 编码后的字节
+        self.set_image(image or Image.new("RGB", (640, 360), color=(90, 140, 220)))
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def set_image(self, image):
+        """替换当前帧"""
+        frames = {}
+        for mime, fmt in (("image/png", "PNG"), ("image/jpeg", "JPEG")):
+            buffer = BytesIO()
+            image.convert("RGB").save(buffer, format=fmt)
+            frames[mime] = buffer.getvalue()
+        self.frames = frames
+
+    def _choose(self, accept):
+        """按 Accept 头的 q 值选择响应格式，没有匹配时返回 JSON"""
+        if not self.binary or not accept:
+            return "application/json"
+        ranked = []
+        for order, part in enumerate(accept.split(",")):
+            fields = [f.strip() for f in part.split(";")]
+            q = 1.0
+            for field in fields[1:]:
+                if field.startswith("q="):
+                    try:
+                        q = float(field[2:])
+                    except ValueError:
+                        q = 0.0
+            ranked.append((-q, order, fields[0].lower()))
+        for _, _, mime in sorted(ranked):
+            if mime in self.frames or mime == "application/json":
+                return mime
+        return "application/json"
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/bot/vision":
+                    self.send_error(404)
+                    return
+                stub.requests += 1
+                mime = stub._choose(self.headers.get("Accept", ""))
+                if mime == "application/json":
+                    data = base64.b64encode(stub.frames["image/png"]).decode("ascii")
+                    body = json.dumps({"success": True, "format": "png",
+                                       "data": "data:image/png;base64," + data}).encode("utf-8")
+                else:
+                    body = stub.frames[mime]
+                self.send_response(200)
+                self.send_header("Content-Type", mime)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # 不输出访问日志
+
+        return Handler
+
+    def start(self):
+        """在后台线程中启动，返回端点地址"""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    from .vision_capture import MinecraftVisionCapture
+
+    for binary in (True, False):
+        with VisionStubServer(binary=binary) as stub:
+            capture = MinecraftVisionCapture(stub.url)
+            frame = capture.get_latest_frame()
+            print(f"binary={binary}: frame={frame.size if frame else None}, stats={capture.stats}")
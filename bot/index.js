@@ -1076,6 +1076,15 @@ app.get('/bot/vision', (req, res) => {
                 base64Data = base64Data.split('base64,')[0] + 'base64,' + paddedData;
             }
             
+            // 客户端通过 Accept 头请求原始图像时直接返回二进制，省去Base64膨胀和JSON解析
+            const mime = (base64Data.match(/^data:(image\/[a-z]+)/) || [])[1] || 'image/png';
+            if (req.accepts(['application/json', mime]) === mime) {
+                const buffer = Buffer.from(base64Data.split('base64,')[1], 'base64');
+                res.type(mime);
+                res.set('Cache-Control', 'no-store');
+                return res.send(buffer);
+            }
+
             // 返回Base64编码的图像数据
             res.json({
                 success: true,
@@ -877,6 +877,10 @@ class MainWindow(QMainWindow):
                 self.ai_thread.terminate() # Use terminate for now, though join is safer
                 self.ai_thread.wait() # Wait for thread to finish
 
+            # Save learned data and stop the local inference process
+            if getattr(self, 'agent', None) is not None:
+                self.agent.close()
+
             # Stop chat timer if exists
             if hasattr(self, 'chat_timer') and self.chat_timer.isActive():
                 self.chat_timer.stop()
@@ -63,6 +63,7 @@ if __name__ == "__main__":
     parser.add_argument("--local", action="store_true", help="使用本地模型")
     parser.add_argument("--cache", action="store_true", help="启用缓存")
     parser.add_argument("--prediction", action="store_true", help="启用动作预测")
+    parser.add_argument("--bandit", action="store_true", help="启用老虎机动作选择 (跳过LLM)")
     parser.add_argument("--debug", action="store_true", help="调试模式")
     parser.add_argument("--vision", action="store_true", help="启用视觉学习系统")
     args = parser.parse_args()
@@ -74,6 +75,8 @@ if __name__ == "__main__":
         os.environ["USE_CACHE"] = "1"
     if args.prediction:
         os.environ["USE_PREDICTION"] = "1"
+    if args.bandit:
+        os.environ["USE_BANDIT"] = "1"
     if args.debug:
         os.environ["DEBUG"] = "1"
     # 默认启用视觉系统，除非显式禁用 (添加 --no-vision 参数?)
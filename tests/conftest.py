@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 让测试能以项目根目录为起点导入 ai / gui 包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,16 @@
+from ai.action_schema import ActionGrammar, build_schema
+
+
+def test_macro_name_limited_to_library():
+    """约束解码只接受宏库中已有的宏名"""
+    schema = build_schema(["collect_craft", "dig_dig"])
+    assert ActionGrammar(schema).feed_text('{"type": "macro", "name": "collect_craft"}')
+    assert not ActionGrammar(schema).feed_text('{"type": "macro", "name": "build_house"}')
+
+
+def test_empty_library_drops_macro():
+    """宏库为空时不能生成 macro 动作"""
+    schema = build_schema([])
+    assert "macro" not in schema
+    assert not ActionGrammar(schema).feed_text('{"type": "macro"')
+    assert ActionGrammar(schema).feed_text('{"type": "collect", "blockType": "oak_log"}')
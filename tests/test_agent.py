@@ -0,0 +1,182 @@
+import json
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import ai.agent as agent_module
+from ai.agent import MinecraftAgent
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    agent = MinecraftAgent(None)
+    yield agent
+    agent.close()
+
+
+def test_calibrated_bypass_is_shadow_verified(agent):
+    """已校准的高置信度预测中，仍有 prediction_shadow_rate 比例的步骤交给LLM比较"""
+    prediction = {"action": {"type": "wait"}, "calibrated": True, "confidence": 0.99}
+    agent.prediction_shadow_rate = 0.0
+    assert agent._trust_prediction(prediction)
+    agent.prediction_shadow_rate = 1.0
+    assert not agent._trust_prediction(prediction)
+    assert agent.shadow_verifications == 1
+    assert not agent._trust_prediction(dict(prediction, calibrated=False))
+
+
+class _StubVisionLearning:
+    """记录场景描述和入队调用的视觉学习替身"""
+
+    def __init__(self):
+        self.recorded = []
+        self.descriptions = 0
+
+    def get_visual_context_description(self, image):
+        self.descriptions += 1
+        return "grass"
+
+    def learn_from_frame_async(self, image, context_data, action, result):
+        self.recorded.append((image.size, context_data, action, result))
+        return True
+
+    def close(self):
+        pass
+
+
+class _StubAPI:
+    def __init__(self):
+        self.messages = []
+
+    def chat(self, messages, **kwargs):
+        self.messages.append(messages)
+        return json.dumps({"type": "collect", "blockType": "oak_log", "count": 1})
+
+
+class _StubResponse:
+    status_code = 200
+    text = ""
+
+    def json(self):
+        return {"success": True, "actionResult": "ok"}
+
+
+def _png_bytes(color=(0, 128, 0)):
+    buffer = BytesIO()
+    Image.new("RGB", (32, 24), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _connect(agent, monkeypatch, state):
+    """让 agent 使用替身机器人服务器、视觉系统和API"""
+    agent.use_vision = True
+    agent.vision_learning = _StubVisionLearning()
+    agent.use_bandit = False
+    agent.api = _StubAPI()
+    monkeypatch.setattr(agent, "get_bot_status", lambda: {"connected": True, "state": state})
+    monkeypatch.setattr(agent.vision_capture, "get_latest_frame_bytes", lambda: (_png_bytes(), "image/png"))
+    monkeypatch.setattr(agent_module.requests, "post", lambda *args, **kwargs: _StubResponse())
+
+
+def test_step_records_replay_experience(agent, monkeypatch):
+    """step() 执行动作后把本步的帧、状态、动作和结果交给视觉学习系统入队"""
+    state = {"position": {"x": 0, "y": 64, "z": 0}, "health": 20, "food": 20}
+    _connect(agent, monkeypatch, state)
+    stub = agent.vision_learning
+
+    result = agent.step()
+
+    assert result["success"]
+    assert stub.recorded == [((32, 24), state, {"type": "collect", "blockType": "oak_log", "count": 1}, result)]
+
+
+class _StubPrefetcher:
+    def __init__(self):
+        self.requests = 0
+
+    def latest(self):
+        return None, None, None
+
+    def request(self):
+        self.requests += 1
+
+    def stop(self):
+        pass
+
+
+class _FailingAPI:
+    def chat(self, messages, **kwargs):
+        raise RuntimeError("rate limited")
+
+
+def test_step_requests_next_frame_even_when_it_fails(agent, monkeypatch):
+    """LLM调用失败、没有执行动作的步骤结束时也请求预取下一帧"""
+    prefetcher = _StubPrefetcher()
+    agent.frame_prefetcher = prefetcher
+    agent.use_bandit = False
+    agent.api = _FailingAPI()
+    monkeypatch.setattr(agent, "get_bot_status", lambda: {"connected": True, "state": {"health": 20}})
+
+    result = agent.step()
+
+    assert "LLM call failed" in result["error"]
+    assert prefetcher.requests == 1
+
+
+def test_scene_description_does_not_move_image_reference(agent, monkeypatch):
+    """只发送场景描述、没有附带图像时不更新已发送图像的参考帧，描述按自己的参考帧复用"""
+    _connect(agent, monkeypatch, {"health": 20})
+    agent.scene_tags_only = True
+
+    agent.step()
+    agent.step()
+
+    assert agent.vision_learning.descriptions == 1
+    assert agent.frame_detector.sent == 0
+    assert agent.frame_detector.last_hash is None
+    assert all(part["type"] == "text" for messages in agent.api.messages for part in messages[1]["content"])
+
+
+def test_attached_image_updates_image_reference(agent, monkeypatch):
+    """图像附带在请求中时才把这一帧记为已发送"""
+    _connect(agent, monkeypatch, {"health": 20})
+
+    agent.step()
+
+    assert agent.frame_detector.sent == 1
+    assert agent.api.messages[0][1]["content"][1]["type"] == "image_url"
+
+
+def test_unchanged_frame_sends_scene_description_instead_of_image(agent, monkeypatch):
+    """画面未变化时不附带图像，只发送场景描述并说明画面自上一步以来没有变化"""
+    _connect(agent, monkeypatch, {"health": 20})
+
+    agent.step()
+    agent.step()
+
+    content = agent.api.messages[1][1]["content"]
+    assert [part["type"] for part in content] == ["text"]
+    assert "[Visual context: grass (the view has not changed since the previous step)]" in content[0]["text"]
+    assert "last image" not in content[0]["text"]
+
+
+def test_unchanged_frame_without_description_still_sends_image(agent, monkeypatch):
+    """没有可用的场景描述时，即使画面未变化也附带图像"""
+    _connect(agent, monkeypatch, {"health": 20})
+    monkeypatch.setattr(agent.vision_learning, "get_visual_context_description", lambda image: None)
+
+    agent.step()
+    agent.step()
+
+    assert agent.api.messages[1][1]["content"][-1]["type"] == "image_url"
+
+
+def test_close_saves_learning(tmp_path, monkeypatch):
+    """close() 把尚未到保存间隔的动作结果也写回磁盘"""
+    monkeypatch.chdir(tmp_path)
+    agent = MinecraftAgent(None)
+    agent.learning.record_action_outcome("dig", {"health": 20}, "success")
+    agent.close()
+    assert "dig_" in next(iter(json.loads((tmp_path / agent.learning.learning_file).read_text())["action_outcomes"]))
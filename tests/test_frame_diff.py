@@ -0,0 +1,39 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from ai.frame_diff import FrameChangeDetector
+
+
+def _frame(flip=False):
+    """带水平渐变的帧；flip 时渐变方向相反"""
+    row = np.linspace(0, 255, 64, dtype=np.uint8)
+    pixels = np.tile(row[::-1] if flip else row, (48, 1))
+    buffer = BytesIO()
+    Image.fromarray(pixels).convert("RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("method", ["dhash", "phash"])
+def test_identical_frame_is_ignored_and_changed_frame_is_flagged(method):
+    """与已发送帧相同的帧不需要重新发送，画面变化的帧需要"""
+    detector = FrameChangeDetector(method=method, threshold=8, max_interval=10)
+    assert detector.check(_frame()) == (True, None)
+    detector.mark_sent()
+
+    changed, distance = detector.check(_frame())
+    assert not changed and distance == 0
+
+    changed, distance = detector.check(_frame(flip=True))
+    assert changed and distance > 8
+    assert detector.get_stats()["skipped"] == 2
+
+
+def test_unchanged_frame_is_resent_after_max_interval():
+    """画面一直不变时，最多跳过 max_interval 步后重新发送"""
+    detector = FrameChangeDetector(max_interval=3)
+    detector.check(_frame())
+    detector.mark_sent()
+    assert [detector.check(_frame())[0] for _ in range(3)] == [False, False, True]
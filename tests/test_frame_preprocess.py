@@ -0,0 +1,40 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from ai.frame_preprocess import FramePreprocessor
+
+
+def _screenshot(seed, size=(1280, 720)):
+    """带噪声的大尺寸PNG截图，压缩后仍有一定体积"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels).resize(size, Image.BILINEAR)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_output_stays_under_byte_budget():
+    """每帧重新编码后的大小不超过字节预算，最长边不超过 max_edge"""
+    budget = 30000
+    preprocessor = FramePreprocessor(max_edge=768, byte_budget=budget)
+    for seed in range(5):
+        frame = _screenshot(seed)
+        output, mime = preprocessor.process(frame, "image/png")
+        assert mime == "image/jpeg"
+        assert len(output) <= budget < len(frame)
+        assert max(Image.open(BytesIO(output)).size) <= 768
+    stats = preprocessor.get_stats()
+    assert stats["frames"] == 5
+    assert stats["bytes_out"] <= 5 * budget
+    assert stats["last_edge"] < 768
+
+
+def test_small_frame_is_passed_through():
+    """原图已经足够小时保留原始字节和类型"""
+    buffer = BytesIO()
+    Image.new("RGB", (32, 24), (0, 128, 0)).save(buffer, format="PNG")
+    frame = buffer.getvalue()
+    assert FramePreprocessor(byte_budget=30000).process(frame, "image/png") == (frame, "image/png")
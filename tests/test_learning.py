@@ -0,0 +1,34 @@
+import json
+
+from ai.learning import LearningSystem
+
+
+def _context(block="oak_log"):
+    return {"nearbyBlocks": [{"name": block}], "inventory": [], "health": 20, "food": 20}
+
+
+def test_outcomes_are_saved_every_save_interval(tmp_path):
+    """每记录 save_interval 次动作结果保存一次"""
+    path = tmp_path / "learning.json"
+    learning = LearningSystem(learning_file=str(path), save_interval=3)
+    learning.record_action_outcome("dig", _context(), "success")
+    learning.record_action_outcome("dig", _context(), "success")
+    assert not path.exists()
+    learning.record_action_outcome("dig", _context(), "failed")
+    saved = json.loads(path.read_text())
+    assert sum(len(outcomes) for outcomes in saved["action_outcomes"].values()) == 3
+    assert learning.unsaved_outcomes == 0
+
+
+def test_bandit_favours_action_with_higher_success_rate(tmp_path):
+    """老虎机在多次抽样中偏向成功率更高的动作"""
+    learning = LearningSystem(learning_file=str(tmp_path / "learning.json"), exploration_rate=0.0,
+                              confidence_threshold=0.0, min_samples=1, min_success_rate=0.0, save_interval=1000)
+    context = _context()
+    for i in range(20):
+        learning.record_action_outcome("dig", context, "success" if i < 16 else "failed",
+                                       action={"type": "dig"})
+        learning.record_action_outcome("move", context, "success" if i < 4 else "failed",
+                                       action={"type": "move"})
+    choices = [learning.select_action(context)["action"]["type"] for _ in range(100)]
+    assert choices.count("dig") > 90
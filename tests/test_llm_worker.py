@@ -0,0 +1,60 @@
+import threading
+
+from ai.llm_worker import LLMWorkerClient
+
+
+def test_concurrent_chats_are_merged_into_one_batch(monkeypatch):
+    """batch_wait 内并发到达的 chat 请求合并为一次 chat_batch，回复按请求分发"""
+    calls = []
+
+    def fake_call(self, method, args, kwargs, timeout):
+        calls.append((method, args, kwargs))
+        if method == "chat_batch":
+            return [f"reply to {messages[0]['content']}" for messages in args[0]]
+        return f"reply to {args[0][0]['content']}"
+
+    monkeypatch.setattr(LLMWorkerClient, "_ensure_started", lambda self: True)
+    monkeypatch.setattr(LLMWorkerClient, "_call", fake_call)
+    client = LLMWorkerClient(health_interval=3600, batch_wait=0.5)
+    replies = {}
+    barrier = threading.Barrier(4)
+
+    def ask(i):
+        barrier.wait()
+        replies[i] = client.chat([{"role": "user", "content": f"q{i}"}], max_tokens=16)
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+    finally:
+        client.close()
+
+    assert [method for method, _, _ in calls] == ["chat_batch"]
+    assert len(calls[0][1][0]) == 4
+    assert calls[0][2]["max_tokens"] == 16
+    assert replies == {i: f"reply to q{i}" for i in range(4)}
+    assert (client.batches, client.batched_requests) == (1, 4)
+
+
+def test_requests_with_other_settings_are_not_merged(monkeypatch):
+    """采样参数不同的请求不并入同一批，按到达顺序单独处理"""
+    calls = []
+
+    def fake_call(self, method, args, kwargs, timeout):
+        calls.append((method, kwargs["max_tokens"]))
+        return "ok"
+
+    monkeypatch.setattr(LLMWorkerClient, "_ensure_started", lambda self: True)
+    monkeypatch.setattr(LLMWorkerClient, "_call", fake_call)
+    client = LLMWorkerClient(health_interval=3600, batch_wait=0.2)
+    try:
+        first = client._submit("chat", ([],), {"temperature": 0.7, "max_tokens": 16, "constrained": None})
+        second = client._submit("chat", ([],), {"temperature": 0.7, "max_tokens": 32, "constrained": None})
+        assert (first.result(timeout=5), second.result(timeout=5)) == ("ok", "ok")
+    finally:
+        client.close()
+    assert calls == [("chat", 16), ("chat", 32)]
+    assert client.batches == 0
@@ -0,0 +1,54 @@
+from ai.observation_store import ObservationStore
+from ai.pattern_recognition import PatternRecognition
+
+
+def _state(i):
+    return {"position": {"x": i, "y": 64, "z": 0}, "health": 20, "food": 20,
+            "nearbyBlocks": [{"name": f"block_{i % 7}"}], "inventory": [{"name": f"item_{i % 5}"}]}
+
+
+def test_memory_bytes_counts_rows_in_use():
+    """memory_bytes 只计算已使用的行，不含预分配的容量"""
+    store = ObservationStore(capacity=1000, recency_size=500)
+    store.add(_state(0), {"type": "dig"}, {"success": True})
+    one_row = store.memory_bytes()
+    store.add(_state(1), {"type": "dig"}, {"success": True})
+    assert store.memory_bytes() < store.features.nbytes
+    assert store.memory_bytes() > one_row
+
+
+def test_background_save_round_trip(tmp_path):
+    """后台定期保存的文件可以完整恢复"""
+    path = str(tmp_path / "patterns.npz")
+    patterns = PatternRecognition(store_file=path, save_interval=10)
+    for i in range(25):
+        patterns.add_observation(_state(i), {"type": "dig", "x": i}, {"success": i % 2 == 0})
+    patterns.save()
+    restored = PatternRecognition(store_file=path)
+    assert restored.store.size == 25
+    assert restored.actions == patterns.actions
+    assert restored.features.state_view(24) == patterns.features.state_view(24)
+    assert list(restored.features.success[:25]) == [i % 2 == 0 for i in range(25)]
+
+
+def test_success_flags_survive_reservoir_reload(tmp_path):
+    """{"success": False} 不算成功；蓄水池替换并重新加载后成功标记仍对应各自的观察"""
+    path = str(tmp_path / "patterns.npz")
+    patterns = PatternRecognition(store_file=path, capacity=10, recency_size=4, save_interval=1000)
+    for i in range(40):
+        patterns.add_observation(_state(i), {"type": "dig", "x": i}, {"success": i % 2 == 0})
+    patterns.save()
+    restored = PatternRecognition(store_file=path, capacity=10, recency_size=4)
+    assert restored.store.size == 10
+    for row in range(restored.store.size):
+        x = int(restored.features.positions[row, 0])
+        assert bool(restored.features.success[row]) == (x % 2 == 0)
+        assert restored.actions[row]["x"] == x
+
+
+def test_success_from_outcome_strings():
+    """智能体传入的结果字符串只有 "success" 算成功，错误信息不算"""
+    store = ObservationStore(capacity=10, recency_size=5)
+    for result in ("success", "Bot server error: no successful path", {"success": False}, {"success": True}, None):
+        store.add(_state(0), {"type": "dig"}, result)
+    assert list(store.features.success[:5]) == [True, False, False, True, False]
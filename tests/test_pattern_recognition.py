@@ -0,0 +1,42 @@
+from ai.pattern_recognition import PatternRecognition, SequenceMiner
+
+
+def test_sequence_miner_ranks_repeated_successful_sequence():
+    """重复出现且都成功的动作序列被计数，并排在失败序列之前"""
+    miner = SequenceMiner(max_n=3)
+    for i in range(5):
+        miner.update({"type": "dig", "n": i}, True)
+        miner.update({"type": "collect", "n": i}, True)
+        miner.update({"type": "craft", "n": i}, True)
+    for i in range(5):
+        miner.update({"type": "move", "n": i}, False)
+        miner.update({"type": "attack", "n": i}, False)
+
+    assert miner.stats[("dig", "collect", "craft")]["support"] == 5
+    assert miner.stats[("dig", "collect", "craft")]["successes"] == 5
+    assert miner.stats[("move", "attack")]["successes"] == 0
+
+    top = miner.top_sequences(k=3, min_length=3, min_support=3)
+    assert top[0]["sequence"] == ["dig", "collect", "craft"]
+    assert top[0]["support"] == 5
+    assert top[0]["success_rate"] == 1.0
+    assert top[0]["actions"] == [{"type": "dig", "n": 4}, {"type": "collect", "n": 4}, {"type": "craft", "n": 4}]
+    assert all("move" not in c["sequence"] and "attack" not in c["sequence"] for c in top)
+
+
+def test_calibration_bins_survive_save_and_load(tmp_path):
+    """save() 后重新加载，校准分箱的计数、一致数和统计保持不变"""
+    path = str(tmp_path / "patterns.npz")
+    patterns = PatternRecognition(store_file=path)
+    for i in range(30):
+        agreed = i % 3 != 0
+        chosen = {"type": "dig"} if agreed else {"type": "move"}
+        patterns.record_shadow({"action": {"type": "dig"}, "raw_score": 0.95, "confidence": 0.9}, chosen, 0.8)
+    patterns.save()
+
+    restored = PatternRecognition(store_file=path)
+    assert list(restored.calibrator.counts) == list(patterns.calibrator.counts)
+    assert list(restored.calibrator.agreements) == list(patterns.calibrator.agreements)
+    assert restored.calibrator.stats() == patterns.calibrator.stats()
+    assert restored.calibrator.is_calibrated(0.95)
+    assert restored.calibrator.calibrate(0.95) == patterns.calibrator.calibrate(0.95)
@@ -0,0 +1,30 @@
+import numpy as np
+
+from ai.replay_buffer import ReplayBuffer
+
+
+def _filled(tmp_path, count, capacity=10):
+    buffer = ReplayBuffer(str(tmp_path), embedding_dim=4, capacity=capacity)
+    for i in range(count):
+        buffer.add(np.full(4, i), {"position": {"x": i}}, {"type": "dig"}, {"success": True})
+    return buffer
+
+
+def test_window_never_spans_wrap_point(tmp_path):
+    """写满回绕后，窗口内的经验仍按时间顺序排列"""
+    buffer = _filled(tmp_path, 14)  # 位置 0-3 是最新的 10-13，4-9 是最旧的 4-9
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        window = buffer.sample_window(5, rng)
+        order = window["states"][:, 0]
+        assert len(order) == 5
+        assert np.all(np.diff(order) == 1)
+
+
+def test_sample_returns_copies(tmp_path):
+    """随机采样返回副本，修改不会写回缓冲区"""
+    buffer = _filled(tmp_path, 8)
+    batch = buffer.sample(4, np.random.default_rng(0))
+    assert len(set(batch["states"][:, 0].tolist())) == 4
+    batch["states"][:] = -1
+    assert (buffer.arrays["states"][:8, 0] >= 0).all()
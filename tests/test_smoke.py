@@ -0,0 +1,56 @@
+import importlib
+import pathlib
+import py_compile
+import subprocess
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+SOURCES = sorted(str(path.relative_to(ROOT)) for folder in ("ai", "gui") for path in (ROOT / folder).glob("*.py"))
+
+# 不依赖 torch / transformers / PyQt6 即可导入的模块
+MODULES = ("ai", "ai.agent", "ai.llm_worker", "ai.action_schema", "ai.vision_capture",
+           "ai.frame_diff", "ai.frame_preprocess", "ai.replay_buffer", "ai.scene_tags",
+           "ai.state_index", "ai.observation_store", "ai.startup_benchmark")
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_compiles(source):
+    """每个源文件都能编译"""
+    py_compile.compile(str(ROOT / source), doraise=True)
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_imports(module):
+    """核心模块都能导入"""
+    importlib.import_module(module)
+
+
+def test_agent_constructs_without_bot(tmp_path, monkeypatch):
+    """没有机器人连接时智能体也能构造，step() 返回错误而不是抛出异常"""
+    monkeypatch.chdir(tmp_path)  # 模式等数据文件写到临时目录
+    from ai.agent import MinecraftAgent
+    agent = MinecraftAgent(None)
+    try:
+        result = agent.step()
+        assert result["success"] is False
+    finally:
+        agent.close()
+
+
+def test_package_import_has_no_side_effects():
+    """推理子进程导入 ai 包时不应带入智能体"""
+    code = "import sys, ai.llm_worker; print('ai.agent' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
+
+
+def test_agent_close_is_idempotent(tmp_path, monkeypatch):
+    """close() 可以重复调用"""
+    monkeypatch.chdir(tmp_path)
+    from ai.agent import MinecraftAgent
+    agent = MinecraftAgent(None)
+    agent.close()
+    assert agent.closed
+    agent.close()
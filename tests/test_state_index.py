@@ -0,0 +1,54 @@
+import numpy as np
+
+from ai.state_index import StateIndex
+
+BLOCKS = ["stone", "dirt", "grass_block", "oak_log", "oak_leaves", "sand", "water", "gravel", "coal_ore",
+          "iron_ore", "andesite", "granite", "diorite", "birch_log", "birch_leaves", "spruce_log", "snow", "ice",
+          "clay", "deepslate", "copper_ore", "tall_grass", "fern", "poppy", "dandelion", "sandstone", "cactus",
+          "lava", "torch", "crafting_table", "cobblestone", "oak_planks", "moss_block", "azalea", "kelp",
+          "seagrass", "red_sand", "terracotta", "podzol", "mycelium"]
+ITEMS = BLOCKS + ["wooden_pickaxe", "stone_pickaxe", "iron_pickaxe", "stick", "coal", "iron_ingot", "bread",
+                  "apple", "raw_beef", "string", "bone", "arrow", "bow", "wooden_sword", "shield", "bucket"]
+
+
+def trajectory(count, seed=0):
+    """模拟一条游戏轨迹：随机游走的位置、按生物群系偏向的附近方块、逐渐变化的物品栏"""
+    rng = np.random.default_rng(seed)
+    states, position, inventory, biome = [], np.zeros(3), set(), 0
+    for _ in range(count):
+        if rng.random() < 0.01:
+            biome = rng.integers(0, 8)
+        position = position + rng.normal(0, 2, 3)
+        weights = np.ones(len(BLOCKS))
+        weights[biome * 5:biome * 5 + 5] += 20
+        blocks = rng.choice(BLOCKS, size=5, replace=False, p=weights / weights.sum())
+        if rng.random() < 0.1:
+            inventory.add(rng.choice(ITEMS))
+        if rng.random() < 0.03 and inventory:
+            inventory.discard(rng.choice(sorted(inventory)))
+        states.append({"position": dict(zip("xyz", position.tolist())),
+                       "nearbyBlocks": [{"name": b} for b in blocks],
+                       "inventory": [{"name": i} for i in sorted(inventory)]})
+    return states
+
+
+def test_lsh_candidate_fraction_is_bounded():
+    """同一轨迹上的查询，LSH 候选只占索引的一小部分，同时保留大部分 Jaccard 近邻"""
+    states = trajectory(3120)
+    queries, indexed = states[::26], [s for i, s in enumerate(states) if i % 26]
+    index = StateIndex()
+    tokens = [index.tokens(s) for s in indexed]
+    for row, state in enumerate(indexed):
+        index.lsh.insert(row, index.tokens(state))
+
+    fractions, recalls = [], []
+    for query in queries:
+        query_tokens = index.tokens(query)
+        found = index.lsh.query(query_tokens)
+        fractions.append(len(found) / len(indexed))
+        jaccard = np.array([len(query_tokens & t) / len(query_tokens | t) for t in tokens])
+        nearest = set(np.argsort(-jaccard, kind="stable")[:25].tolist())
+        recalls.append(len(nearest & found) / len(nearest))
+    assert index.lsh.rows_per_band >= 4
+    assert np.mean(fractions) < 0.15
+    assert np.mean(recalls) > 0.85
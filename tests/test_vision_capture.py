@@ -0,0 +1,75 @@
+import time
+
+import pytest
+from PIL import Image
+
+from ai.vision_capture import FramePrefetcher, MinecraftVisionCapture
+from ai.vision_stub_server import VisionStubServer
+
+
+class FlakyCapture:
+    """第一次请求失败，之后返回固定的帧"""
+    timeout = 1
+
+    def __init__(self):
+        self.calls = 0
+        self.last_error = None
+
+    def get_latest_frame_bytes(self):
+        self.calls += 1
+        if self.calls == 1:
+            self.last_error = "connection refused"
+            return None, None
+        self.last_error = None
+        return b"frame", "image/png"
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_fetches_on_request_and_clears_error():
+    """没有定时刷新时只在 request() 后取帧，成功后清除之前的错误"""
+    capture = FlakyCapture()
+    prefetcher = FramePrefetcher(capture).start()
+    try:
+        assert _wait_for(lambda: prefetcher.last_error == "connection refused")
+        time.sleep(0.1)
+        assert capture.calls == 1  # 空闲时不轮询
+        prefetcher.request()
+        assert _wait_for(lambda: prefetcher.stats["fetched"] == 1)
+        assert prefetcher.last_error is None
+        assert prefetcher.latest()[0] == b"frame"
+    finally:
+        prefetcher.stop()
+
+
+@pytest.mark.parametrize("binary, prefer_binary, transport, mime", [
+    (True, True, "binary", "image/png"),
+    (False, True, "json", "image/png"),
+    (True, False, "json", "image/png"),
+])
+def test_capture_against_stub_server(binary, prefer_binary, transport, mime):
+    """对替身 /bot/vision 端点取帧：二进制服务器返回原始字节，旧的JSON服务器回退到Base64"""
+    image = Image.new("RGB", (64, 48), color=(10, 200, 30))
+    with VisionStubServer(image=image, binary=binary) as stub:
+        capture = MinecraftVisionCapture(stub.url, prefer_binary=prefer_binary)
+        data, frame_mime = capture.get_latest_frame_bytes()
+        frame = capture.get_latest_frame()
+    assert frame_mime == mime
+    assert data == stub.frames[mime]
+    assert frame.size == (64, 48) and frame.convert("RGB").getpixel((0, 0)) == (10, 200, 30)
+    assert capture.stats[transport] == 2 and capture.stats["failed"] == 0
+    assert stub.requests == 2
+
+
+def test_capture_reports_missing_endpoint():
+    """端点不存在时返回 (None, None) 并记录原因"""
+    with VisionStubServer() as stub:
+        capture = MinecraftVisionCapture(stub.url + "/missing")
+        assert capture.get_latest_frame_bytes() == (None, None)
+    assert "404" in capture.last_error
+    assert capture.stats["failed"] == 1